@@ -3,4 +3,12 @@ set -e
 
 python manage.py migrate --noinput
 python manage.py collectstatic --noinput
-gunicorn tu_canasta_backend.wsgi:application
+if [ "${RUN_WORKER:-false}" = "true" ]; then
+  # Background jobs in the same instance; stops with the container.
+  python manage.py run_worker &
+fi
+if [ "${WEB_SERVER:-wsgi}" = "asgi" ]; then
+  gunicorn tu_canasta_backend.asgi:application -k uvicorn.workers.UvicornWorker
+else
+  gunicorn tu_canasta_backend.wsgi:application
+fi
@@ -0,0 +1,99 @@
+"""
+Login and bulk user import, hashing through the pool in tu_canasta.passwords.
+"""
+from django.db import transaction
+from rest_framework.exceptions import ValidationError
+
+from .catalog import ImportReport
+from .models import User
+from .passwords import (
+    ahash_password,
+    averify_password,
+    hash_password,
+    hash_passwords,
+    verify_password,
+)
+from .serializers import UserImportRowSerializer
+
+
+def authenticate(email: str, raw_password: str):
+    """
+    The active user with these credentials, or None. A hash made with an
+    older hasher or weaker parameters is replaced on a successful login.
+    """
+    user = User.objects.filter(email=email).first()
+    if user is None or not user.is_active:
+        # Hash anyway so the response time does not reveal unknown emails.
+        hash_password(raw_password)
+        return None
+    valid, outdated = verify_password(raw_password, user.password)
+    if not valid:
+        return None
+    if outdated:
+        user.password = hash_password(raw_password)
+        user.save(update_fields=['password', 'updated_at'])
+    return user
+
+
+async def aauthenticate(email: str, raw_password: str):
+    """Same as ``authenticate`` for async callers."""
+    user = await User.objects.filter(email=email).afirst()
+    if user is None or not user.is_active:
+        await ahash_password(raw_password)
+        return None
+    valid, outdated = await averify_password(raw_password, user.password)
+    if not valid:
+        return None
+    if outdated:
+        user.password = await ahash_password(raw_password)
+        await user.asave(update_fields=['password', 'updated_at'])
+    return user
+
+
+def _create_chunk(chunk, report) -> int:
+    if not chunk:
+        return 0
+    existing = set(
+        User.objects.filter(email__in=chunk.keys()).values_list('email', flat=True)
+    )
+    for email in existing:
+        line, _ = chunk.pop(email)
+        report.add_error(line, {'email': ['Ya existe un usuario con este correo.']})
+    if not chunk:
+        return 0
+    rows = [data for _, data in chunk.values()]
+    passwords = hash_passwords(row.pop('password') for row in rows)
+    with transaction.atomic():
+        User.objects.bulk_create(
+            [User(password=password, **row) for row, password in zip(rows, passwords)],
+            ignore_conflicts=True,
+        )
+    return len(rows)
+
+
+def import_users(rows, chunk_size: int = 500) -> ImportReport:
+    """
+    Create users from ``(line, row)`` pairs with plain-text passwords,
+    hashing each chunk in parallel and inserting it with one bulk_create.
+    Emails that already exist are reported and skipped; when a chunk
+    repeats an email the last row wins.
+    """
+    report = ImportReport()
+    validator = UserImportRowSerializer()
+    chunk = {}
+    for line, row in rows:
+        report.processed += 1
+        if isinstance(row, str):
+            report.add_error(line, {'non_field_errors': [row]})
+            continue
+        try:
+            data = validator.run_validation(row)
+        except ValidationError as exc:
+            report.add_error(line, exc.detail)
+            continue
+        chunk[data['email']] = (line, data)
+        if len(chunk) >= chunk_size:
+            report.imported += _create_chunk(chunk, report)
+            chunk = {}
+    report.imported += _create_chunk(chunk, report)
+    return report
@@ -0,0 +1,92 @@
+"""
+Spending analytics computed in the database.
+
+Each section is one grouped query: months aggregate the stored list totals
+(no join with the items table) and products aggregate the items of the
+user's lists. Templates are left out. The budget summary is folded from
+the monthly rows.
+"""
+from decimal import Decimal
+
+from django.db.models import Avg, Count, F, Q, Sum
+from django.db.models.functions import Coalesce, TruncMonth
+
+from .models import MONEY_FIELD, ShoppingList, ShoppingListItem
+
+ZERO = Decimal('0.00')
+
+
+def _money(expression, **extra):
+    return Coalesce(
+        Sum(expression, output_field=MONEY_FIELD, **extra), ZERO, output_field=MONEY_FIELD
+    )
+
+
+def monthly_spending(user, year=None) -> list:
+    """Lists, budget, planned cost and spend per ``target_date`` month."""
+    lists = ShoppingList.objects.filter(user=user, is_template=False)
+    if year is not None:
+        lists = lists.filter(target_date__year=year)
+    budgeted = Q(budget__isnull=False)
+    return list(
+        lists.annotate(month=TruncMonth('target_date'))
+        .values('month')
+        .annotate(
+            lists=Count('pk'),
+            budgeted_lists=Count('pk', filter=budgeted),
+            within_budget=Count('pk', filter=budgeted & Q(cost_total__lte=F('budget'))),
+            budget_total=_money('budget', filter=budgeted),
+            budgeted_cost=_money('cost_total', filter=budgeted),
+            planned=_money('cost_total'),
+            spent=_money('spent_total'),
+        )
+        .order_by(F('month').asc(nulls_last=True))
+    )
+
+
+def budget_adherence(months) -> dict:
+    """Totals over ``monthly_spending`` rows; lists without budget are excluded."""
+    summary = {
+        'budgeted_lists': sum(row['budgeted_lists'] for row in months),
+        'within_budget': sum(row['within_budget'] for row in months),
+        'budget_total': sum((row['budget_total'] for row in months), ZERO),
+        'budgeted_cost': sum((row['budgeted_cost'] for row in months), ZERO),
+    }
+    summary['over_budget'] = summary['budgeted_lists'] - summary['within_budget']
+    summary['adherence_rate'] = (
+        round(summary['within_budget'] / summary['budgeted_lists'], 4)
+        if summary['budgeted_lists']
+        else None
+    )
+    return summary
+
+
+def top_products(user, year=None, limit=10) -> list:
+    """Most bought products with their average ``unit_price``."""
+    items = ShoppingListItem.objects.filter(
+        shopping_list__user=user, shopping_list__is_template=False
+    )
+    if year is not None:
+        items = items.filter(shopping_list__target_date__year=year)
+    purchased = Q(is_purchased=True)
+    return list(
+        items.values('product_id', 'product__sku', 'product__name')
+        .annotate(
+            lists=Count('pk'),
+            total_quantity=Sum('quantity'),
+            purchased_quantity=Coalesce(Sum('quantity', filter=purchased), 0),
+            average_unit_price=Avg('unit_price', output_field=MONEY_FIELD),
+            spent=_money(F('quantity') * F('unit_price'), filter=purchased),
+        )
+        .order_by('-purchased_quantity', '-total_quantity', 'product_id')[:limit]
+    )
+
+
+def spending_analytics(user, year=None, products=10) -> dict:
+    months = monthly_spending(user, year)
+    return {
+        'year': year,
+        'months': months,
+        'budget': budget_adherence(months),
+        'products': top_products(user, year, products),
+    }
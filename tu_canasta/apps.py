@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class TuCanastaConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'tu_canasta'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        from .throttling import check_throttle_cache
+
+        check_throttle_cache()
@@ -0,0 +1,153 @@
+"""
+Async read path for the viewsets when served over ASGI.
+
+With ``ASYNC_READ_VIEWS`` enabled (the default in ``asgi.py``), the
+``list`` and ``retrieve`` actions, plus any other action a view lists in
+``async_actions``, run as coroutines on the event loop and reach the
+database through Django's async ORM, so a worker does not park a thread per
+in-flight request. Every other action, and reads that need the browsable
+API, keep the regular synchronous code path.
+"""
+import functools
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import Http404, HttpResponse
+from rest_framework.response import Response
+
+from .middleware import timed
+
+
+class AsyncReadViewSetMixin:
+    """
+    Serves ``async_actions`` through ``adispatch`` instead of DRF's
+    synchronous ``dispatch``.
+
+    The async path runs DRF's content negotiation, permission and throttle
+    checks; authentication classes stay lazy because these views identify the
+    user through X-USER-ID. Views opt out per request with ``supports_async``.
+    """
+    async_actions = ('list', 'retrieve')
+
+    @classmethod
+    def as_view(cls, actions=None, **initkwargs):
+        view = super().as_view(actions, **initkwargs)
+        if not getattr(settings, 'ASYNC_READ_VIEWS', False):
+            return view
+        sync_view = sync_to_async(view)
+
+        async def async_view(request, *args, **kwargs):
+            method = request.method.lower()
+            action = actions.get(method) or (actions.get('get') if method == 'head' else None)
+            if action not in cls.async_actions:
+                return await sync_view(request, *args, **kwargs)
+
+            # Mirrors ViewSetMixin.as_view() before dispatching.
+            self = cls(**initkwargs)
+            self.action_map = dict(actions)
+            if 'get' in self.action_map:
+                self.action_map.setdefault('head', self.action_map['get'])
+            for handler_method, handler_action in self.action_map.items():
+                setattr(self, handler_method, getattr(self, handler_action))
+            self.request = request
+            self.args = args
+            self.kwargs = kwargs
+            return await self.adispatch(request, *args, **kwargs)
+
+        functools.update_wrapper(async_view, view)
+        del async_view.__wrapped__
+        return async_view
+
+    def supports_async(self, request) -> bool:
+        """Whether this request can be served by the async handler."""
+        paginator = self.paginator if self.action == 'list' else None
+        return request.accepted_renderer.format == 'json' and (
+            paginator is None or hasattr(paginator, 'apaginate_queryset')
+        )
+
+    async def adispatch(self, request, *args, **kwargs):
+        django_request = request
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+
+        try:
+            self.format_kwarg = self.get_format_suffix(**kwargs)
+            request.accepted_renderer, request.accepted_media_type = (
+                self.perform_content_negotiation(request)
+            )
+            if not self.supports_async(request):
+                return await sync_to_async(self.dispatch)(django_request, *args, **kwargs)
+            request.version, request.versioning_scheme = self.determine_version(
+                request, *args, **kwargs
+            )
+            await self.ainitial(request, *args, **kwargs)
+            handler = getattr(self, f'a{self.action}')
+            response = await handler(request, *args, **kwargs)
+        except Exception as exc:
+            response = self.handle_exception(exc)
+
+        self.response = await self.afinalize_response(request, response, *args, **kwargs)
+        return self._rendered(self.response)
+
+    async def afinalize_response(self, request, response, *args, **kwargs):
+        # Overridden by mixins whose finalize_response does I/O.
+        return self.finalize_response(request, response, *args, **kwargs)
+
+    async def ainitial(self, request, *args, **kwargs):
+        self.check_permissions(request)
+        await self.acheck_throttles(request)
+
+    async def acheck_throttles(self, request):
+        """``check_throttles`` with the async variant of throttles that have one."""
+        durations = []
+        for throttle in self.get_throttles():
+            if hasattr(throttle, 'aallow_request'):
+                allowed = await throttle.aallow_request(request, self)
+            else:
+                allowed = throttle.allow_request(request, self)
+            if not allowed:
+                durations.append(throttle.wait())
+        if durations:
+            durations = [duration for duration in durations if duration is not None]
+            self.throttled(request, max(durations, default=None))
+
+    @staticmethod
+    def _rendered(response):
+        # Django renders deferred responses through a thread hop; render here
+        # and hand back a plain response so the request never leaves the loop.
+        if not hasattr(response, 'render'):
+            return response
+        with timed('render'):
+            response.render()
+        plain = HttpResponse(response.content, status=response.status_code)
+        for header, value in response.items():
+            plain[header] = value
+        return plain
+
+    async def alist(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        if self.paginator is not None:
+            page = await self.paginator.apaginate_queryset(queryset, request, view=self)
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
+        serializer = self.get_serializer([row async for row in queryset], many=True)
+        return Response(serializer.data)
+
+    async def aretrieve(self, request, *args, **kwargs):
+        instance = await self.aget_object()
+        serializer = self.get_serializer(instance)
+        return Response(serializer.data)
+
+    async def aget_object(self):
+        queryset = self.filter_queryset(self.get_queryset())
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        filter_kwargs = {self.lookup_field: self.kwargs[lookup_url_kwarg]}
+        try:
+            instance = await queryset.aget(**filter_kwargs)
+        except (queryset.model.DoesNotExist, TypeError, ValueError):
+            raise Http404
+        self.check_object_permissions(self.request, instance)
+        return instance
@@ -0,0 +1,413 @@
+"""
+Query-count, latency and memory benchmarks for every API route.
+
+``run_benchmarks`` drives each scenario through the test client against
+seeded fixtures and ``compare_to_baseline`` checks the results against the
+committed ``benchmark_baseline.json``. The query budgets are what guard
+against N+1 regressions: they do not depend on the fixture size, so any
+per-row query shows up as a route going over its budget.
+"""
+import http.client
+import json
+import statistics
+import threading
+import time
+import tracemalloc
+from collections import namedtuple
+from datetime import date
+from decimal import Decimal
+from pathlib import Path
+from urllib.parse import urlsplit
+
+from django.contrib.auth.hashers import make_password
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import URLPattern, URLResolver
+from rest_framework.test import APIClient
+
+from .models import Job, Product, ShoppingList, ShoppingListItem, User
+from .user_resolver import get_user_resolver
+
+BASELINE_PATH = Path(__file__).with_name('benchmark_baseline.json')
+
+Fixtures = namedtuple(
+    'Fixtures', ['user_id', 'list_id', 'item_id', 'product_id', 'spare_product_id', 'job_id']
+)
+Scenario = namedtuple('Scenario', ['route', 'method', 'path', 'data', 'format'])
+
+
+def _scenario(route, method, path, data=None, format='json'):
+    return Scenario(route, method, path, data, format)
+
+
+SCENARIOS = [
+    _scenario('api-root', 'get', '/api/'),
+    _scenario('user-list', 'get', '/api/users/'),
+    _scenario('user-detail', 'get', '/api/users/{user_id}/'),
+    _scenario('user-detail', 'patch', '/api/users/{user_id}/', {'first_name': 'Ana'}),
+    _scenario(
+        'user-login',
+        'post',
+        '/api/users/login/',
+        {'email': 'bench0@example.com', 'password': 'benchmark'},
+    ),
+    _scenario('product-list', 'get', '/api/products/'),
+    _scenario('product-list', 'get', '/api/products/?search=producto'),
+    _scenario('product-list', 'post', '/api/products/', {'sku': 'BENCH-NEW', 'name': 'Nuevo'}),
+    _scenario('product-detail', 'get', '/api/products/{product_id}/'),
+    _scenario('product-autocomplete', 'get', '/api/products/autocomplete/?q=pro'),
+    _scenario('product-export', 'get', '/api/products/export/?file_format=ndjson'),
+    _scenario(
+        'product-import-catalog',
+        'post',
+        '/api/products/import/',
+        'sku,name,description\nBENCH-1,Importado,\nBENCH-2,Importado,\n',
+        'multipart',
+    ),
+    _scenario('shopping-list-list', 'get', '/api/shopping-lists/'),
+    _scenario('shopping-list-list', 'get', '/api/shopping-lists/?expand='),
+    _scenario(
+        'shopping-list-list',
+        'post',
+        '/api/shopping-lists/',
+        {'title': 'Nueva', 'target_date': '2030-01-01'},
+    ),
+    _scenario('shopping-list-detail', 'get', '/api/shopping-lists/{list_id}/'),
+    _scenario('shopping-list-detail', 'patch', '/api/shopping-lists/{list_id}/', {'title': 'Editada'}),
+    _scenario('shopping-list-detail', 'delete', '/api/shopping-lists/{list_id}/'),
+    _scenario('shopping-list-list-items', 'get', '/api/shopping-lists/{list_id}/items/'),
+    _scenario('shopping-list-events', 'get', '/api/shopping-lists/{list_id}/events/'),
+    _scenario(
+        'shopping-list-duplicate',
+        'post',
+        '/api/shopping-lists/{list_id}/duplicate/',
+        {'title': 'Copia', 'refresh_prices': True},
+    ),
+    _scenario(
+        'shopping-list-mark-purchased',
+        'post',
+        '/api/shopping-lists/{list_id}/mark-purchased/',
+    ),
+    _scenario('shopping-list-reset', 'post', '/api/shopping-lists/{list_id}/reset/'),
+    _scenario(
+        'shopping-list-clear-purchased',
+        'post',
+        '/api/shopping-lists/{list_id}/clear-purchased/',
+    ),
+    _scenario('shopping-list-item-list', 'get', '/api/shopping-list-items/'),
+    _scenario(
+        'shopping-list-item-list',
+        'post',
+        '/api/shopping-list-items/',
+        {'shopping_list': '{list_id}', 'product': '{spare_product_id}', 'quantity': 1},
+    ),
+    _scenario('shopping-list-item-detail', 'get', '/api/shopping-list-items/{item_id}/'),
+    _scenario(
+        'shopping-list-item-detail',
+        'patch',
+        '/api/shopping-list-items/{item_id}/',
+        {'is_purchased': True},
+    ),
+    _scenario('shopping-list-item-detail', 'delete', '/api/shopping-list-items/{item_id}/'),
+    _scenario(
+        'shopping-list-item-bulk',
+        'post',
+        '/api/shopping-list-items/bulk/',
+        {'toggle': [{'id': '{item_id}', 'is_purchased': True}], 'delete': ['{item_id}']},
+    ),
+    _scenario('job-list', 'get', '/api/jobs/'),
+    _scenario('job-list', 'post', '/api/jobs/', {'kind': 'analytics', 'year': 2030}),
+    _scenario('job-detail', 'get', '/api/jobs/{job_id}/'),
+    _scenario('sync', 'get', '/api/sync/'),
+    _scenario('analytics', 'get', '/api/analytics/'),
+]
+
+
+def scenario_key(scenario) -> str:
+    return f'{scenario.method.upper()} {scenario.path}'
+
+
+def api_route_names(patterns=None) -> set:
+    """Names of every route declared in ``tu_canasta.urls``."""
+    if patterns is None:
+        from . import urls
+        patterns = urls.urlpatterns
+    names = set()
+    for pattern in patterns:
+        if isinstance(pattern, URLResolver):
+            names |= api_route_names(pattern.url_patterns)
+        elif isinstance(pattern, URLPattern) and pattern.name:
+            names.add(pattern.name)
+    return names
+
+
+def seed_fixtures(users=20, lists_per_user=5, items_per_list=20, products=2000) -> Fixtures:
+    """Bulk-insert a realistic data set and return the ids scenarios act on."""
+    Product.objects.bulk_create(
+        Product(sku=f'BENCH-{index:06d}', name=f'Producto {index}', description='Benchmark')
+        for index in range(products)
+    )
+    product_ids = list(Product.objects.order_by('pk').values_list('pk', flat=True))
+    password = make_password('benchmark')
+    User.objects.bulk_create(
+        User(
+            first_name=f'Usuario {index}',
+            last_name='Benchmark',
+            email=f'bench{index}@example.com',
+            password=password,
+        )
+        for index in range(users)
+    )
+    user_ids = list(User.objects.order_by('pk').values_list('pk', flat=True))
+    ShoppingList.objects.bulk_create(
+        ShoppingList(
+            user_id=user_id,
+            title=f'Lista {index}',
+            target_date=date(2030, 1, 1 + index % 28),
+            budget=Decimal('100000'),
+        )
+        for user_id in user_ids
+        for index in range(lists_per_user)
+    )
+    list_ids = list(ShoppingList.objects.order_by('pk').values_list('pk', flat=True))
+    ShoppingListItem.objects.bulk_create(
+        ShoppingListItem(
+            shopping_list_id=list_id,
+            product_id=product_ids[(offset + index) % len(product_ids)],
+            quantity=1 + index % 3,
+            unit_price=Decimal('1500.00'),
+            is_purchased=index % 2 == 0,
+        )
+        for offset, list_id in enumerate(list_ids)
+        for index in range(min(items_per_list, len(product_ids)))
+    )
+    first_list = ShoppingList.objects.filter(user_id=user_ids[0]).order_by('pk').first()
+    first_item = first_list.items.order_by('pk').first()
+    job = Job.objects.create(user_id=user_ids[0], kind=Job.ANALYTICS)
+    return Fixtures(
+        user_id=user_ids[0],
+        list_id=first_list.pk,
+        item_id=first_item.pk if first_item else None,
+        product_id=product_ids[0],
+        # Last in the catalogue, so not yet on the first list.
+        spare_product_id=product_ids[-1],
+        job_id=job.pk,
+    )
+
+
+def _fill(value, fixtures):
+    if isinstance(value, str):
+        filled = value.format(**fixtures._asdict())
+        return int(filled) if value.startswith('{') and filled.isdigit() else filled
+    if isinstance(value, dict):
+        return {key: _fill(item, fixtures) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_fill(item, fixtures) for item in value]
+    return value
+
+
+def _request(client, scenario, fixtures):
+    path = _fill(scenario.path, fixtures)
+    data = _fill(scenario.data, fixtures)
+    if scenario.format == 'multipart':
+        upload = SimpleUploadedFile('catalogo.csv', data.encode('utf-8'), content_type='text/csv')
+        response = client.post(path, {'file': upload}, format='multipart')
+    elif data is None:
+        response = getattr(client, scenario.method)(path)
+    else:
+        response = getattr(client, scenario.method)(path, data, format=scenario.format)
+    if response.streaming:
+        # Streamed bodies run their queries while being consumed.
+        b''.join(response.streaming_content)
+    return response
+
+
+def _run_once(client, scenario, fixtures):
+    """Run one request from a cold cache, rolling back whatever it wrote."""
+    cache.clear()
+    get_user_resolver().backend.clear()
+    with transaction.atomic():
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            response = _request(client, scenario, fixtures)
+            elapsed = time.perf_counter() - started
+        transaction.set_rollback(True)
+    return response, len(queries), elapsed
+
+
+def _percentile(samples, percent):
+    if len(samples) == 1:
+        return samples[0]
+    return statistics.quantiles(samples, n=100, method='inclusive')[percent - 1]
+
+
+def run_benchmarks(fixtures, repeat=20, scenarios=SCENARIOS) -> dict:
+    """
+    Measure every scenario: query count, p50/p95 latency in milliseconds and
+    peak traced memory in KiB. Memory is traced on a separate run so the
+    tracing overhead does not skew the latency samples.
+    """
+    client = APIClient()
+    client.credentials(HTTP_X_USER_ID=str(fixtures.user_id))
+    results = {}
+    for scenario in scenarios:
+        timings, query_counts = [], set()
+        for _ in range(repeat):
+            response, query_count, elapsed = _run_once(client, scenario, fixtures)
+            timings.append(elapsed * 1000)
+            query_counts.add(query_count)
+        tracemalloc.start()
+        try:
+            _run_once(client, scenario, fixtures)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        results[scenario_key(scenario)] = {
+            'route': scenario.route,
+            'status': response.status_code,
+            'queries': max(query_counts),
+            'p50_ms': round(_percentile(timings, 50), 2),
+            'p95_ms': round(_percentile(timings, 95), 2),
+            'peak_kib': round(peak / 1024, 1),
+        }
+    return results
+
+
+def load_baseline(path=BASELINE_PATH) -> dict:
+    with open(path, encoding='utf-8') as handle:
+        return json.load(handle)
+
+
+def write_baseline(results, path=BASELINE_PATH) -> None:
+    with open(path, 'w', encoding='utf-8') as handle:
+        json.dump(results, handle, indent=2, sort_keys=True)
+        handle.write('\n')
+
+
+def failed_scenarios(results) -> list:
+    return [
+        f'{key}: respondió {result["status"]}.'
+        for key, result in results.items()
+        if result['status'] >= 400
+    ]
+
+
+def compare_to_baseline(results, baseline, latency_tolerance=None, latency_slack_ms=5.0) -> list:
+    """
+    Problems found in ``results``: failed requests, scenarios missing from
+    the baseline, query counts above their budget and, when
+    ``latency_tolerance`` is given, p95 latencies above the baseline by more
+    than that fraction (plus ``latency_slack_ms`` to absorb timer noise).
+    """
+    problems = failed_scenarios(results)
+    for key, result in results.items():
+        budget = baseline.get(key)
+        if budget is None:
+            problems.append(f'{key}: no tiene línea base.')
+            continue
+        if result['queries'] > budget['queries']:
+            problems.append(
+                f'{key}: {result["queries"]} consultas, presupuesto {budget["queries"]}.'
+            )
+        if latency_tolerance is not None:
+            allowed = budget['p95_ms'] * (1 + latency_tolerance) + latency_slack_ms
+            if result['p95_ms'] > allowed:
+                problems.append(
+                    f'{key}: p95 {result["p95_ms"]} ms, línea base {budget["p95_ms"]} ms.'
+                )
+    return problems
+
+
+def run_load(url, concurrency=32, duration=10.0, headers=None) -> dict:
+    """
+    Closed-loop load test against a running server: ``concurrency`` clients
+    with keep-alive connections request ``url`` back to back for
+    ``duration`` seconds. Returns throughput and latency percentiles.
+    """
+    parts = urlsplit(url)
+    target = parts.path + (f'?{parts.query}' if parts.query else '')
+    deadline = time.perf_counter() + duration
+    latencies, errors, lock = [], [0], threading.Lock()
+
+    def client():
+        connection = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=30)
+        samples, failed = [], 0
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                connection.request('GET', target, headers=headers or {})
+                response = connection.getresponse()
+                response.read()
+                if response.status >= 400:
+                    failed += 1
+            except (OSError, http.client.HTTPException):
+                failed += 1
+                connection.close()
+                connection = http.client.HTTPConnection(
+                    parts.hostname, parts.port or 80, timeout=30
+                )
+                continue
+            samples.append((time.perf_counter() - started) * 1000)
+        connection.close()
+        with lock:
+            latencies.extend(samples)
+            errors[0] += failed
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    return {
+        'requests': len(latencies),
+        'errors': errors[0],
+        'rps': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(_percentile(latencies, 50), 2) if latencies else None,
+        'p95_ms': round(_percentile(latencies, 95), 2) if latencies else None,
+        'p99_ms': round(_percentile(latencies, 99), 2) if latencies else None,
+    }
+
+
+def benchmark_serialization(shopping_list_id, repeat=20) -> dict:
+    """
+    Median milliseconds to serialize and render the items of a list with
+    their product detail, for DRF's field machinery and ``JSONRenderer``
+    against the fast serializers and ``ORJSONRenderer``, scaled to 1,000
+    items.
+    """
+    from rest_framework.renderers import JSONRenderer
+
+    from .renderers import ORJSONRenderer
+    from .serializers import ShoppingListItemSerializer
+
+    items = list(
+        ShoppingListItem.objects.filter(shopping_list_id=shopping_list_id)
+        .select_related('product__price_stats')
+    )
+    scale = 1000 / max(len(items), 1)
+    results = {}
+    for name, fast, renderer in (
+        ('drf+json', False, JSONRenderer()),
+        ('drf+orjson', False, ORJSONRenderer()),
+        ('fast+json', True, JSONRenderer()),
+        ('fast+orjson', True, ORJSONRenderer()),
+    ):
+        serialize, render = [], []
+        with override_settings(FAST_READ_SERIALIZERS=fast):
+            for _ in range(repeat):
+                started = time.perf_counter()
+                data = ShoppingListItemSerializer(items, many=True).data
+                serialized = time.perf_counter()
+                renderer.render(data)
+                serialize.append((serialized - started) * 1000 * scale)
+                render.append((time.perf_counter() - serialized) * 1000 * scale)
+        results[name] = {
+            'serialize_ms': round(statistics.median(serialize), 2),
+            'render_ms': round(statistics.median(render), 2),
+            'total_ms': round(statistics.median(map(sum, zip(serialize, render))), 2),
+        }
+    return results
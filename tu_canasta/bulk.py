@@ -0,0 +1,181 @@
+from itertools import groupby
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Product, ShoppingList, ShoppingListItem, User
+from .prices import record_price_observations
+from .serializers import BulkItemToggleSerializer, BulkItemUpsertSerializer
+from .signals import coalesce_items_bulk_changed
+
+# Fields an upsert row may send; an existing item only gets the ones sent.
+UPSERT_FIELDS = ('quantity', 'unit_price', 'is_purchased')
+
+
+def _ok(index, **extra):
+    return {'index': index, 'status': 'ok', **extra}
+
+
+def _error(index, errors):
+    return {'index': index, 'status': 'error', 'errors': errors}
+
+
+def _validate_rows(rows, serializer_class):
+    valid, results = [], {}
+    for index, row in enumerate(rows):
+        serializer = serializer_class(data=row)
+        if serializer.is_valid():
+            valid.append((index, serializer.validated_data))
+        else:
+            results[index] = _error(index, serializer.errors)
+    return valid, results
+
+
+def _upserted_purchases(new_items) -> list:
+    """
+    Price observations for items about to be upserted as purchased, at the
+    price and quantity they end up with, skipping the ones already stored as
+    purchased at the same price.
+    """
+    purchased = [(fields, item) for _, fields, item in new_items if item.is_purchased]
+    if not purchased:
+        return []
+    existing = {
+        (shopping_list_id, product_id): (unit_price, quantity, is_purchased)
+        for shopping_list_id, product_id, unit_price, quantity, is_purchased in (
+            ShoppingListItem.objects.filter(
+                shopping_list_id__in={item.shopping_list_id for _, item in purchased},
+                product_id__in={item.product_id for _, item in purchased},
+            ).order_by().values_list(
+                'shopping_list_id', 'product_id', 'unit_price', 'quantity', 'is_purchased'
+            )
+        )
+    }
+    observations = []
+    for fields, item in purchased:
+        current = existing.get((item.shopping_list_id, item.product_id))
+        if current is None:
+            observations.append((item.product_id, item.unit_price, item.quantity))
+            continue
+        unit_price = item.unit_price if 'unit_price' in fields else current[0]
+        quantity = item.quantity if 'quantity' in fields else current[1]
+        if not (current[2] and unit_price == current[0]):
+            observations.append((item.product_id, unit_price, quantity))
+    return observations
+
+
+def apply_item_batch(user: User, upsert=(), toggle=(), delete=()) -> dict:
+    """
+    Apply a batch of item upserts, purchase toggles and deletions owned by
+    ``user`` with a fixed number of queries, whatever the batch size.
+
+    Returns one result per input row, in input order, for each operation.
+    """
+    upserts, upsert_results = _validate_rows(upsert, BulkItemUpsertSerializer)
+    toggles, toggle_results = _validate_rows(toggle, BulkItemToggleSerializer)
+
+    owned_lists = set(
+        ShoppingList.objects.filter(
+            user=user, pk__in={row['shopping_list'] for _, row in upserts}
+        ).order_by().values_list('pk', flat=True)
+    ) if upserts else set()
+    known_products = dict(
+        Product.objects.filter(
+            pk__in={row['product'] for _, row in upserts}
+        ).order_by().values_list('pk', 'price_stats__last_price')
+    ) if upserts else {}
+    item_ids = {row['id'] for _, row in toggles} | set(delete)
+    owned_items = {
+        item.pk: item
+        for item in ShoppingListItem.objects.filter(
+            shopping_list__user=user, pk__in=item_ids
+        ).order_by().only(
+            'pk', 'shopping_list_id', 'product_id', 'quantity', 'unit_price', 'is_purchased'
+        )
+    } if item_ids else {}
+
+    now = timezone.now()
+    new_items, seen_pairs = [], set()
+    for index, row in upserts:
+        pair = (row['shopping_list'], row['product'])
+        if row['shopping_list'] not in owned_lists:
+            upsert_results[index] = _error(
+                index, {'shopping_list': ['No puedes gestionar listas de otros usuarios.']}
+            )
+        elif row['product'] not in known_products:
+            upsert_results[index] = _error(index, {'product': ['Producto no encontrado.']})
+        elif pair in seen_pairs:
+            upsert_results[index] = _error(
+                index, {'product': ['Producto repetido para la misma lista en el lote.']}
+            )
+        else:
+            seen_pairs.add(pair)
+            fields = tuple(name for name in UPSERT_FIELDS if name in row)
+            # The defaults only apply to new items.
+            item = ShoppingListItem(
+                shopping_list_id=row['shopping_list'],
+                product_id=row['product'],
+                quantity=row.get('quantity', 1),
+                # Without a price, pre-fill the last one paid for the product.
+                unit_price=row.get('unit_price', known_products[row['product']] or 0),
+                is_purchased=row.get('is_purchased', False),
+            )
+            new_items.append((index, fields, item))
+
+    # Toggles are applied after the upserts, so a row in both is purchased
+    # at its upserted price.
+    upserted = {
+        (item.shopping_list_id, item.product_id): (fields, item)
+        for _, fields, item in new_items
+    }
+    toggled, purchases = [], []
+    for index, row in toggles:
+        item = owned_items.get(row['id'])
+        if item is None:
+            toggle_results[index] = _error(index, {'id': ['Ítem no encontrado.']})
+            continue
+        if row['is_purchased'] and not item.is_purchased:
+            fields, final = upserted.get((item.shopping_list_id, item.product_id), ((), item))
+            purchases.append((
+                item.product_id,
+                final.unit_price if 'unit_price' in fields else item.unit_price,
+                final.quantity if 'quantity' in fields else item.quantity,
+            ))
+        item.is_purchased = row['is_purchased']
+        item.updated_at = now
+        toggled.append(item)
+        toggle_results[index] = _ok(index, id=item.pk, is_purchased=item.is_purchased)
+
+    deleted_ids = [pk for pk in delete if pk in owned_items]
+    delete_results = [
+        _ok(index, id=pk) if pk in owned_items
+        else _error(index, {'id': ['Ítem no encontrado.']})
+        for index, pk in enumerate(delete)
+    ]
+
+    with transaction.atomic(), coalesce_items_bulk_changed():
+        purchases += _upserted_purchases(new_items)
+        # One statement per set of fields sent, so existing items keep the
+        # fields a row left out.
+        by_fields = sorted(new_items, key=lambda entry: entry[1])
+        for fields, group in groupby(by_fields, key=lambda entry: entry[1]):
+            ShoppingListItem.objects.bulk_create(
+                [item for _, _, item in group],
+                update_conflicts=True,
+                unique_fields=['shopping_list', 'product'],
+                update_fields=[*fields, 'updated_at'],
+            )
+        if toggled:
+            ShoppingListItem.objects.bulk_update(toggled, ['is_purchased', 'updated_at'])
+        if deleted_ids:
+            ShoppingListItem.objects.filter(pk__in=deleted_ids).delete()
+        record_price_observations(purchases)
+
+    for index, _, item in new_items:
+        upsert_results[index] = _ok(index, id=item.pk)
+
+    return {
+        'upsert': [upsert_results[index] for index in range(len(upsert))],
+        'toggle': [toggle_results[index] for index in range(len(toggle))],
+        'delete': delete_results,
+    }
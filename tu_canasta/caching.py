@@ -0,0 +1,187 @@
+import hashlib
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_vary_headers
+from django.utils.dateparse import parse_datetime
+from django.utils.http import http_date, parse_http_date_safe
+
+from .middleware import timed
+from .routers import read_from_replica
+
+PRODUCTS_SCOPE = 'products'
+GENERATION_KEY = 'tu_canasta:gen:{scope}'
+RESPONSE_KEY = 'tu_canasta:response:{digest}'
+
+
+def user_scope(user_id) -> str:
+    return f'user:{user_id}'
+
+
+def get_generations(scopes) -> dict:
+    keys = {GENERATION_KEY.format(scope=scope): scope for scope in scopes}
+    stored = cache.get_many(keys)
+    return {scope: stored.get(key, 0) for key, scope in keys.items()}
+
+
+async def aget_generations(scopes) -> dict:
+    keys = {GENERATION_KEY.format(scope=scope): scope for scope in scopes}
+    stored = await cache.aget_many(keys)
+    return {scope: stored.get(key, 0) for key, scope in keys.items()}
+
+
+def response_cache_enabled() -> bool:
+    return getattr(settings, 'RESPONSE_CACHE', {}).get('ENABLED', False)
+
+
+def bump_generation(*scopes) -> None:
+    """
+    Invalidate every cached response built from ``scopes``. Each bump writes
+    a new random generation rather than incrementing: backends without an
+    atomic ``incr`` (the file cache) could lose one of two concurrent bumps,
+    and a plain set cannot.
+    """
+    if scopes:
+        cache.set_many(
+            {GENERATION_KEY.format(scope=scope): uuid.uuid4().hex for scope in scopes},
+            timeout=None,
+        )
+
+
+def _last_modified(data):
+    rows = data.get('results', [data]) if isinstance(data, dict) else data
+    stamps = [
+        parse_datetime(row['updated_at'])
+        for row in rows
+        if isinstance(row, dict) and row.get('updated_at')
+    ]
+    stamps = [stamp for stamp in stamps if stamp is not None]
+    return int(max(stamps).timestamp()) if stamps else None
+
+
+class CachedResponseMixin:
+    """
+    Read-through cache of the rendered ``list`` and ``retrieve`` responses,
+    versioned by the generation counters of ``get_cache_scopes()``.
+
+    The ETag is derived from the URL and those counters, so a conditional GET
+    is answered with ``304 Not Modified`` before any query or serializer runs.
+    Only JSON responses are cached; the browsable API always renders live.
+    Disabled unless ``RESPONSE_CACHE['ENABLED']``: with a per-process cache a
+    write in one process would not invalidate the others' entries. A miss
+    reads the primary: a lagging replica would store an old body under the
+    current generations.
+    """
+    response_cache_timeout = 300
+
+    def get_cache_scopes(self):
+        return []
+
+    def list(self, request, *args, **kwargs):
+        return self._cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self._cached_response(super().retrieve, request, *args, **kwargs)
+
+    async def alist(self, request, *args, **kwargs):
+        return await self._acached_response(super().alist, request, *args, **kwargs)
+
+    async def aretrieve(self, request, *args, **kwargs):
+        return await self._acached_response(super().aretrieve, request, *args, **kwargs)
+
+    def _cached_response(self, handler, request, *args, **kwargs):
+        if not response_cache_enabled() or request.accepted_renderer.format != 'json':
+            return handler(request, *args, **kwargs)
+        generations = get_generations(self.get_cache_scopes())
+        key, etag = self._cache_entry(request, generations)
+        cached = cache.get(key)
+        response = self._response_from_cache(request, key, etag, cached)
+        if response is None:
+            with read_from_replica(enabled=False):
+                return handler(request, *args, **kwargs)
+        return response
+
+    async def _acached_response(self, handler, request, *args, **kwargs):
+        if not response_cache_enabled() or request.accepted_renderer.format != 'json':
+            return await handler(request, *args, **kwargs)
+        generations = await aget_generations(self.get_cache_scopes())
+        key, etag = self._cache_entry(request, generations)
+        cached = await cache.aget(key)
+        response = self._response_from_cache(request, key, etag, cached)
+        if response is None:
+            with read_from_replica(enabled=False):
+                return await handler(request, *args, **kwargs)
+        return response
+
+    def _cache_entry(self, request, generations):
+        seed = '|'.join([
+            request.build_absolute_uri(),
+            request.accepted_media_type,
+            repr(sorted(generations.items())),
+        ])
+        digest = hashlib.sha256(seed.encode('utf-8')).hexdigest()
+        return RESPONSE_KEY.format(digest=digest), f'"{digest[:32]}"'
+
+    def _response_from_cache(self, request, key, etag, cached):
+        """The cached or 304 response, or None after marking a cache miss."""
+        if self._not_modified(request, etag, cached):
+            response = HttpResponseNotModified()
+        elif cached is not None:
+            response = HttpResponse(cached['content'], content_type=cached['content_type'])
+        else:
+            request._response_cache_entry = (key, etag)
+            return None
+
+        response['ETag'] = etag
+        if cached and cached.get('last_modified'):
+            response['Last-Modified'] = http_date(cached['last_modified'])
+        return response
+
+    def _not_modified(self, request, etag, cached):
+        if_none_match = request.headers.get('If-None-Match')
+        if if_none_match is not None:
+            return etag in [tag.strip() for tag in if_none_match.split(',')] or if_none_match == '*'
+        if_modified_since = parse_http_date_safe(request.headers.get('If-Modified-Since', ''))
+        last_modified = cached and cached.get('last_modified')
+        return bool(
+            if_modified_since and last_modified and last_modified <= if_modified_since
+        )
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        stored = self._store_miss(response, getattr(request, '_response_cache_entry', None))
+        if stored is not None:
+            cache.set(*stored, self.response_cache_timeout)
+        if request.method in ('GET', 'HEAD'):
+            response.setdefault('Cache-Control', 'private, no-cache')
+            patch_vary_headers(response, ['X-USER-ID'])
+        return response
+
+    async def afinalize_response(self, request, response, *args, **kwargs):
+        """``finalize_response`` for ``adispatch``, storing a miss with ``aset``."""
+        entry = getattr(request, '_response_cache_entry', None)
+        request._response_cache_entry = None
+        response = self.finalize_response(request, response, *args, **kwargs)
+        stored = self._store_miss(response, entry)
+        if stored is not None:
+            await cache.aset(*stored, self.response_cache_timeout)
+        return response
+
+    def _store_miss(self, response, entry):
+        """Render a cacheable miss and return its cache key and value, or None."""
+        if entry is None or response.status_code != 200 or not hasattr(response, 'render'):
+            return None
+        key, etag = entry
+        last_modified = _last_modified(response.data)
+        with timed('render'):
+            response.render()
+        response['ETag'] = etag
+        if last_modified:
+            response['Last-Modified'] = http_date(last_modified)
+        return key, {
+            'content': response.content,
+            'content_type': response['Content-Type'],
+            'last_modified': last_modified,
+        }
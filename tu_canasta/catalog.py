@@ -0,0 +1,151 @@
+"""
+Streaming catalogue import and export for ``Product``.
+
+Both directions work on iterators, one chunk at a time, so memory use stays
+flat whatever the size of the file.
+"""
+import csv
+import io
+import json
+
+from django.db import transaction
+from rest_framework.exceptions import ValidationError
+
+from .caching import PRODUCTS_SCOPE, bump_generation
+from .models import Product
+from .serializers import ProductImportRowSerializer
+
+FORMATS = ('csv', 'ndjson')
+EXPORT_FIELDS = ('sku', 'name', 'description')
+CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+def detect_format(filename: str, requested: str = None) -> str:
+    file_format = (requested or filename.rpartition('.')[2]).lower()
+    if file_format == 'jsonl':
+        file_format = 'ndjson'
+    if file_format not in FORMATS:
+        raise ValueError(f'Formato no soportado: usa {" o ".join(FORMATS)}.')
+    return file_format
+
+
+def read_rows(stream, file_format: str):
+    """
+    Yield ``(line, row)`` pairs from a text stream. ``row`` is a dict, or a
+    string describing why the line could not be parsed.
+    """
+    if file_format == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for line, text in enumerate(stream, start=1):
+        if not text.strip():
+            continue
+        try:
+            row = json.loads(text)
+        except ValueError:
+            yield line, 'JSON inválido.'
+            continue
+        yield line, row if isinstance(row, dict) else 'Se esperaba un objeto JSON.'
+
+
+class ImportReport:
+    """Counts for an import run plus the first ``max_errors`` row errors."""
+    max_errors = 100
+
+    def __init__(self):
+        self.processed = 0
+        self.imported = 0
+        self.error_count = 0
+        self.errors = []
+
+    def add_error(self, line, errors):
+        self.error_count += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({'line': line, 'errors': errors})
+
+    def as_dict(self) -> dict:
+        return {
+            'processed': self.processed,
+            'imported': self.imported,
+            'error_count': self.error_count,
+            'errors': self.errors,
+        }
+
+
+def _upsert_chunk(chunk) -> int:
+    if not chunk:
+        return 0
+    with transaction.atomic():
+        Product.objects.bulk_create(
+            chunk.values(),
+            update_conflicts=True,
+            unique_fields=['sku'],
+            update_fields=['name', 'description', 'updated_at'],
+        )
+    return len(chunk)
+
+
+def import_products(rows, chunk_size: int = 1000, progress=None) -> ImportReport:
+    """
+    Upsert products on ``sku`` from ``(line, row)`` pairs, one INSERT ... ON
+    CONFLICT per chunk. Invalid rows are reported and skipped; when a chunk
+    repeats a sku the last row wins, as it would across chunks. ``progress``
+    is called with the number of processed rows after each chunk.
+    """
+    report = ImportReport()
+    # One serializer for the whole run: building its fields per row would
+    # cost more than the database writes.
+    validator = ProductImportRowSerializer()
+    chunk = {}
+    try:
+        for line, row in rows:
+            report.processed += 1
+            if isinstance(row, str):
+                report.add_error(line, {'non_field_errors': [row]})
+                continue
+            try:
+                data = validator.run_validation(row)
+            except ValidationError as exc:
+                report.add_error(line, exc.detail)
+                continue
+            chunk[data['sku']] = Product(**data)
+            if len(chunk) >= chunk_size:
+                report.imported += _upsert_chunk(chunk)
+                chunk = {}
+                if progress is not None:
+                    progress(report.processed)
+        report.imported += _upsert_chunk(chunk)
+    finally:
+        if report.imported:
+            # bulk_create skips post_save, so cached product reads are
+            # invalidated here instead of by the signal receivers.
+            transaction.on_commit(lambda: bump_generation(PRODUCTS_SCOPE))
+    return report
+
+
+def export_products(file_format: str, chunk_size: int = 2000):
+    """Yield the whole catalogue as CSV or NDJSON text, ordered by id."""
+    rows = (
+        Product.objects.order_by('pk')
+        .values_list(*EXPORT_FIELDS)
+        .iterator(chunk_size=chunk_size)
+    )
+    if file_format == 'ndjson':
+        for row in rows:
+            yield json.dumps(dict(zip(EXPORT_FIELDS, row)), ensure_ascii=False) + '\n'
+        return
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_FIELDS)
+    for row in rows:
+        writer.writerow(row)
+        if buffer.tell() >= 64 * 1024:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
@@ -0,0 +1,258 @@
+"""
+Push channel for shared lists (Server-Sent Events).
+
+Item writes publish small per-item events (``item.created``,
+``item.updated``, ``item.deleted``; ``items.changed`` for bulk writes, which
+only know the lists they touched) to a broker once their transaction
+commits. ``GET /api/shopping-lists/{id}/events/`` streams the events of one
+list from the broker instead of re-serializing the whole list on every poll.
+
+The default broker fans out in process and keeps the last ``HISTORY`` events
+of each list, so a client reconnecting with ``Last-Event-ID`` receives what
+it missed. When the cursor is unknown (too old, or issued by another process
+for a list this one has events of) the stream starts with ``resync`` and the
+client reloads the list once. Every stream, and every reply of the WSGI
+fallback, ends its backlog with ``ready``, whose id is the position to
+resume from.
+
+It only sees the writes of its own process, so it suits a single web
+process. ``LIST_EVENTS['BROKER']`` names the class, so tests and
+multi-process deployments can swap it.
+
+Serializing an item is only worth it while someone follows its list: writes
+to lists nobody has streamed or polled for ``WATCH_SECONDS`` publish
+``items.changed`` instead.
+"""
+import asyncio
+import itertools
+import threading
+import time
+import uuid
+from collections import OrderedDict, defaultdict, deque, namedtuple
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from .renderers import ORJSONRenderer
+
+DEFAULTS = {
+    'BROKER': 'tu_canasta.events.InProcessBroker',
+    'HISTORY': 200,
+    'QUEUE_SIZE': 1000,
+    'KEEPALIVE_SECONDS': 15,
+    'RETRY_MS': 3000,
+    'WATCH_SECONDS': 60,
+}
+
+ListEvent = namedtuple('ListEvent', ['id', 'shopping_list_id', 'type', 'data'])
+
+READY = 'ready'
+RESYNC = 'resync'
+LIST_DELETED = 'list.deleted'
+
+
+def event_options() -> dict:
+    return {**DEFAULTS, **getattr(settings, 'LIST_EVENTS', {})}
+
+
+def format_event(event) -> bytes:
+    """One event in the text/event-stream format."""
+    data = ORJSONRenderer().render(event.data)
+    lines = [b'event: ' + event.type.encode(), b'data: ' + data]
+    if event.id is not None:
+        lines.insert(0, b'id: ' + event.id.encode())
+    return b'\n'.join(lines) + b'\n\n'
+
+
+def format_retry(milliseconds) -> bytes:
+    return f'retry: {milliseconds}\n\n'.encode()
+
+
+def resync_event(shopping_list_id) -> ListEvent:
+    return ListEvent(None, shopping_list_id, RESYNC, {'shopping_list': shopping_list_id})
+
+
+class Subscription:
+    """
+    Events of one list for one stream. ``deliver`` may be called from any
+    thread; the events are read on the event loop that subscribed.
+    """
+
+    def __init__(self, shopping_list_id, backlog, queue_size):
+        self.shopping_list_id = shopping_list_id
+        self.backlog = backlog
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue(maxsize=queue_size)
+
+    def deliver(self, event) -> None:
+        try:
+            self._loop.call_soon_threadsafe(self._put, event)
+        except RuntimeError:
+            pass  # the stream's loop is gone; unsubscribe() follows
+
+    def _put(self, event):
+        try:
+            self._queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # A stalled client: make it reload the list instead of buffering more.
+            while not self._queue.empty():
+                self._queue.get_nowait()
+            self._queue.put_nowait(resync_event(self.shopping_list_id))
+
+    async def next(self, timeout):
+        """The next event, or None after ``timeout`` seconds without one."""
+        try:
+            return await asyncio.wait_for(self._queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class InProcessBroker:
+    """
+    Fan-out to the streams of this process, keeping the last ``history``
+    events of the ``max_lists`` lists written most recently.
+    """
+    max_lists = 10000
+
+    def __init__(self, history=200, queue_size=1000, watch_seconds=60):
+        self.history = history
+        self.queue_size = queue_size
+        self.watch_seconds = watch_seconds
+        # Event ids are only meaningful to the process that issued them.
+        self._prefix = uuid.uuid4().hex[:12]
+        self._sequence = itertools.count(1)
+        self._last = 0
+        self._lock = threading.Lock()
+        # list id -> (floor, deque of (sequence, event)). Cursors below the
+        # floor point at events that are no longer kept.
+        self._history = OrderedDict()
+        self._floor = 0
+        self._subscriptions = defaultdict(set)
+        # list id -> when the WSGI fallback last replayed it
+        self._polled = OrderedDict()
+
+    def publish(self, shopping_list_id, event_type, data) -> ListEvent:
+        with self._lock:
+            sequence = self._last = next(self._sequence)
+            event = ListEvent(f'{self._prefix}-{sequence}', shopping_list_id, event_type, data)
+            floor, events = self._history.pop(shopping_list_id, None) or (
+                self._floor, deque(maxlen=self.history)
+            )
+            if len(events) == self.history:
+                floor = events[0][0]
+            events.append((sequence, event))
+            self._history[shopping_list_id] = (floor, events)
+            if len(self._history) > self.max_lists:
+                _, (_, dropped) = self._history.popitem(last=False)
+                self._floor = max(self._floor, dropped[-1][0])
+            subscriptions = list(self._subscriptions.get(shopping_list_id, ()))
+        for subscription in subscriptions:
+            subscription.deliver(event)
+        return event
+
+    def is_watched(self, shopping_list_id) -> bool:
+        """Whether a stream follows the list, or a client polled it recently."""
+        with self._lock:
+            if self._subscriptions.get(shopping_list_id):
+                return True
+            polled_at = self._polled.get(shopping_list_id)
+        return polled_at is not None and time.monotonic() - polled_at < self.watch_seconds
+
+    def _missed(self, shopping_list_id, last_event_id):
+        """Events after ``last_event_id``, or None when it cannot be resumed."""
+        if not last_event_id:
+            return []
+        prefix, _, sequence = last_event_id.rpartition('-')
+        if prefix != self._prefix:
+            # Issued by another process: nothing is lost if this one has not
+            # seen the list change.
+            return [] if shopping_list_id not in self._history else None
+        if not sequence.isdigit():
+            return None
+        sequence = int(sequence)
+        floor, events = self._history.get(shopping_list_id, (self._floor, ()))
+        if sequence < floor:
+            return None
+        return [event for event_sequence, event in events if event_sequence > sequence]
+
+    def _backlog(self, shopping_list_id, last_event_id) -> list:
+        # Closed by ``ready``, whose id is the current position: a client that
+        # reconnects with it resumes here even if it received nothing else.
+        missed = self._missed(shopping_list_id, last_event_id)
+        ready = ListEvent(
+            f'{self._prefix}-{self._last}', shopping_list_id, READY,
+            {'shopping_list': shopping_list_id},
+        )
+        return ([resync_event(shopping_list_id)] if missed is None else missed) + [ready]
+
+    def replay(self, shopping_list_id, last_event_id=None) -> list:
+        """The events missed since ``last_event_id``, then ``ready``."""
+        with self._lock:
+            self._polled.pop(shopping_list_id, None)
+            self._polled[shopping_list_id] = time.monotonic()
+            if len(self._polled) > self.max_lists:
+                self._polled.popitem(last=False)
+            return self._backlog(shopping_list_id, last_event_id)
+
+    def subscribe(self, shopping_list_id, last_event_id=None) -> Subscription:
+        """
+        Start receiving the events of a list, after the same backlog as
+        ``replay``. Call on the event loop that reads the subscription.
+        """
+        with self._lock:
+            subscription = Subscription(
+                shopping_list_id, self._backlog(shopping_list_id, last_event_id), self.queue_size
+            )
+            self._subscriptions[shopping_list_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription) -> None:
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.shopping_list_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[subscription.shopping_list_id]
+
+
+async def stream_events(broker, subscription, keepalive, retry_ms):
+    """Body of an event stream: the backlog, then live events and keep-alives."""
+    try:
+        yield format_retry(retry_ms)
+        for event in subscription.backlog:
+            yield format_event(event)
+        while True:
+            event = await subscription.next(keepalive)
+            if event is None:
+                # Comment line: keeps proxies from closing an idle connection.
+                yield b': keep-alive\n\n'
+                continue
+            yield format_event(event)
+            if event.type == LIST_DELETED:
+                return
+    finally:
+        broker.unsubscribe(subscription)
+
+
+_broker = None
+
+
+def get_list_broker():
+    global _broker
+    if _broker is None:
+        options = event_options()
+        _broker = import_string(options['BROKER'])(
+            history=options['HISTORY'],
+            queue_size=options['QUEUE_SIZE'],
+            watch_seconds=options['WATCH_SECONDS'],
+        )
+    return _broker
+
+
+@receiver(setting_changed)
+def _reset_list_broker(setting, **kwargs):
+    global _broker
+    if setting == 'LIST_EVENTS':
+        _broker = None
@@ -0,0 +1,194 @@
+"""
+Idempotency keys for the create and bulk write endpoints.
+
+A client that sends ``Idempotency-Key`` with a write gets the same response
+for every retry of it. The first request runs the write and stores its
+response in ``IdempotencyKey`` within the same transaction; retries replay
+that response without running the write again. A retry that arrives while
+the first request is still running waits on the key's row instead of
+racing it into the unique constraints.
+
+Only successful responses are stored. A failed write is rolled back together
+with its key, so the client can retry it with the same key. Keys expire
+after ``TTL_SECONDS``, and some of the writes that store a key prune a batch
+of expired ones once they commit.
+"""
+import hashlib
+import json
+import random
+import zlib
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.db import router, transaction
+from django.http import HttpResponse, QueryDict
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import APIException, ValidationError
+from rest_framework.throttling import BaseThrottle
+
+from .middleware import timed
+from .models import IdempotencyKey
+
+HEADER = 'Idempotency-Key'
+
+DEFAULTS = {
+    'TTL_SECONDS': 86400,
+    'PRUNE_PROBABILITY': 0.01,
+    'PRUNE_BATCH_SIZE': 1000,
+}
+
+
+def idempotency_options() -> dict:
+    return {**DEFAULTS, **getattr(settings, 'IDEMPOTENCY', {})}
+
+
+class IdempotencyKeyReused(APIException):
+    status_code = status.HTTP_422_UNPROCESSABLE_ENTITY
+    default_detail = 'La clave Idempotency-Key ya se usó con una solicitud distinta.'
+    default_code = 'idempotency_key_reused'
+
+
+def _encode_value(value):
+    # Files are compared by content: each retry gets a new multipart boundary.
+    if isinstance(value, UploadedFile):
+        digest = hashlib.sha256()
+        for chunk in value.chunks():
+            digest.update(chunk)
+        value.seek(0)
+        return {'name': value.name, 'sha256': digest.hexdigest()}
+    return str(value)
+
+
+def request_fingerprint(request) -> str:
+    """Hash of what makes two writes the same: method, path and parsed body."""
+    data = request.data
+    if isinstance(data, QueryDict):
+        data = {key: data.getlist(key) for key in data}
+    body = json.dumps(data, sort_keys=True, default=_encode_value)
+    seed = f'{request.method} {request.get_full_path()}\n{body}'
+    return hashlib.sha256(seed.encode('utf-8')).hexdigest()
+
+
+def request_scope(request) -> str:
+    """Namespace of the request's keys: its user, or its client address."""
+    user_identifier = request.headers.get('X-USER-ID') or request.query_params.get('user_id')
+    if user_identifier:
+        return user_identifier
+    # Anonymous sign-ups must not share one namespace of keys.
+    return f'ip:{BaseThrottle().get_ident(request)}'
+
+
+def prune_idempotency_keys(batch_size=None, now=None) -> int:
+    """Delete up to ``batch_size`` expired keys. Returns how many were deleted."""
+    batch_size = batch_size or idempotency_options()['PRUNE_BATCH_SIZE']
+    now = now or timezone.now()
+    using = router.db_for_write(IdempotencyKey)
+    expired = IdempotencyKey.objects.using(using).filter(expires_at__lte=now)
+    pks = list(expired.values_list('pk', flat=True)[:batch_size])
+    if not pks:
+        return 0
+    return IdempotencyKey.objects.using(using).filter(pk__in=pks).delete()[0]
+
+
+class IdempotentWriteMixin:
+    """
+    Honors ``Idempotency-Key`` on the ``idempotent_actions`` of a viewset.
+    List it before the other mixins so it stores the final response.
+    """
+    idempotent_actions = ('create',)
+
+    def dispatch(self, request, *args, **kwargs):
+        self._idempotency_key = request.headers.get(HEADER)
+        self._idempotency_record = None
+        action = getattr(self, 'action_map', {}).get(request.method.lower())
+        if self._idempotency_key is None or action not in self.idempotent_actions:
+            return super().dispatch(request, *args, **kwargs)
+        # The key, the write and the stored response commit together.
+        with transaction.atomic(using=router.db_for_write(IdempotencyKey)):
+            return super().dispatch(request, *args, **kwargs)
+
+    def supports_async(self, request):
+        # Keyed writes take the synchronous path, which holds the key's lock.
+        if request.headers.get(HEADER) is not None and self.action in self.idempotent_actions:
+            return False
+        return super().supports_async(request)
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if self._idempotency_key is None or self.action not in self.idempotent_actions:
+            return
+        record = self._lock_idempotency_key(request, self._idempotency_key)
+        if record.status_code is not None:
+            # Handlers are bound per instance, so the retry skips the action.
+            setattr(self, request.method.lower(), self._replay)
+        self._idempotency_record = record
+
+    def _lock_idempotency_key(self, request, key):
+        if not key or len(key) > 255:
+            raise ValidationError(
+                {HEADER: ['Usa una clave de entre 1 y 255 caracteres.']}
+            )
+        scope = request_scope(request)
+        fingerprint = request_fingerprint(request)
+        now = timezone.now()
+        expires_at = now + timedelta(seconds=idempotency_options()['TTL_SECONDS'])
+        keys = IdempotencyKey.objects.using(router.db_for_write(IdempotencyKey))
+        # Blocks while a request with the same key is still running; the row
+        # lock then makes the retries that find it committed take turns.
+        keys.bulk_create(
+            [IdempotencyKey(scope=scope, key=key, fingerprint=fingerprint, expires_at=expires_at)],
+            ignore_conflicts=True,
+        )
+        record = keys.select_for_update().get(scope=scope, key=key)
+        if record.expires_at <= now:
+            # Not pruned yet: an expired key starts over.
+            record.fingerprint = fingerprint
+            record.status_code = None
+            record.content_type = ''
+            record.content = None
+            record.location = ''
+            record.created_at = now
+            record.expires_at = expires_at
+            record.save()
+        elif record.fingerprint != fingerprint:
+            raise IdempotencyKeyReused()
+        return record
+
+    def _replay(self, request, *args, **kwargs):
+        record = self._idempotency_record
+        response = HttpResponse(
+            zlib.decompress(record.content),
+            status=record.status_code,
+            content_type=record.content_type,
+        )
+        if record.location:
+            response['Location'] = record.location
+        response['Idempotent-Replayed'] = 'true'
+        return response
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        record = getattr(self, '_idempotency_record', None)
+        if record is None or record.status_code is not None:
+            return response
+        using = router.db_for_write(IdempotencyKey)
+        if not status.is_success(response.status_code):
+            # Keep nothing of a failed write, the key included.
+            transaction.set_rollback(True, using=using)
+            return response
+        if hasattr(response, 'render'):
+            with timed('render'):
+                response.render()
+        record.status_code = response.status_code
+        record.content_type = response['Content-Type']
+        record.content = zlib.compress(response.content)
+        record.location = response.get('Location', '')
+        record.save(update_fields=['status_code', 'content_type', 'content', 'location'])
+        options = idempotency_options()
+        if random.random() < options['PRUNE_PROBABILITY']:
+            transaction.on_commit(
+                lambda: prune_idempotency_keys(options['PRUNE_BATCH_SIZE']), using=using
+            )
+        return response
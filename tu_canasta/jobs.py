@@ -0,0 +1,275 @@
+"""
+Database-backed job queue.
+
+``enqueue()`` stores a ``Job`` row; ``manage.py run_worker`` claims due jobs
+by priority and runs their handler outside any transaction. On PostgreSQL
+the claim is ``SELECT ... FOR UPDATE SKIP LOCKED``, so workers never wait on
+each other; backends without it (SQLite) claim with a compare-and-swap
+UPDATE on the status. Failed jobs are retried with exponential backoff up to
+``max_attempts``, and running jobs whose worker stopped sending heartbeats
+are requeued; such a worker, if it was only slow, no longer records its
+outcome. Nothing outside the database is needed.
+"""
+import io
+import logging
+import os
+import socket
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connections, router, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .analytics import spending_analytics
+from .catalog import import_products, read_rows
+from .models import Job, ShoppingList
+from .prices import refresh_stale_price_stats
+from .serializers import SpendingAnalyticsSerializer
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'POLL_INTERVAL': 1.0,
+    'RETRY_DELAY': 10,
+    'MAX_RETRY_DELAY': 600,
+    'HEARTBEAT_TIMEOUT': 300,
+}
+
+HANDLERS = {}
+
+
+def job_options() -> dict:
+    return {**DEFAULTS, **getattr(settings, 'JOB_QUEUE', {})}
+
+
+def job_handler(kind):
+    """Register ``func(job, progress)`` as the handler of a job kind."""
+    def register(func):
+        HANDLERS[kind] = func
+        return func
+    return register
+
+
+def enqueue(kind, *, user=None, payload=None, upload=None, priority=0, max_attempts=3) -> Job:
+    if kind not in HANDLERS:
+        raise ValueError(f'Tipo de tarea desconocido: {kind}.')
+    return Job.objects.create(
+        kind=kind,
+        user=user,
+        payload=payload or {},
+        upload=upload,
+        priority=priority,
+        max_attempts=max_attempts,
+    )
+
+
+def default_worker_name() -> str:
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def _due(now):
+    return (
+        Job.objects.filter(status=Job.QUEUED, run_after__lte=now)
+        .order_by('-priority', 'run_after', 'id')
+    )
+
+
+def _claim_values(worker, now) -> dict:
+    return {
+        'status': Job.RUNNING,
+        'worker': worker,
+        'heartbeat_at': now,
+        'started_at': now,
+        'updated_at': now,
+    }
+
+
+def claim_job(worker: str):
+    """
+    Take the next due job for ``worker``, or None when there is none. The
+    claim counts as an attempt, so a job that keeps killing its worker is
+    eventually given up.
+    """
+    now = timezone.now()
+    using = router.db_for_write(Job)
+    values = _claim_values(worker, now)
+    if connections[using].features.has_select_for_update_skip_locked:
+        with transaction.atomic(using=using):
+            job = _due(now).using(using).select_for_update(skip_locked=True).first()
+            if job is None:
+                return None
+            Job.objects.using(using).filter(pk=job.pk).update(
+                attempts=F('attempts') + 1, **values
+            )
+        job.attempts += 1
+        for name, value in values.items():
+            setattr(job, name, value)
+        return job
+    # No row locks to skip: the status check in the UPDATE makes the claim
+    # atomic, and a worker that loses the race tries the next candidate.
+    for pk in _due(now).using(using).values_list('pk', flat=True)[:10]:
+        if Job.objects.using(using).filter(pk=pk, status=Job.QUEUED).update(
+            attempts=F('attempts') + 1, **values
+        ):
+            return Job.objects.using(using).get(pk=pk)
+    return None
+
+
+def _progress(job):
+    def report(done, total=None):
+        now = timezone.now()
+        values = {'progress': done, 'heartbeat_at': now, 'updated_at': now}
+        if total is not None:
+            values['progress_total'] = total
+        Job.objects.filter(pk=job.pk, status=Job.RUNNING).update(**values)
+    return report
+
+
+def _retry_delay(attempts) -> timedelta:
+    options = job_options()
+    seconds = min(options['RETRY_DELAY'] * 2 ** (attempts - 1), options['MAX_RETRY_DELAY'])
+    return timedelta(seconds=seconds)
+
+
+def _delete_upload(name) -> None:
+    if name:
+        Job.upload.field.storage.delete(name)
+
+
+def _record_outcome(job: Job, **values) -> bool:
+    """
+    Save the outcome of ``job`` unless it stopped being this worker's run
+    meanwhile: requeued for a missed heartbeat, and maybe claimed again.
+    """
+    values['updated_at'] = timezone.now()
+    finished = values.get('status') in (Job.SUCCEEDED, Job.FAILED)
+    upload = job.upload.name
+    if finished:
+        values['upload'] = ''
+    recorded = Job.objects.filter(pk=job.pk, status=Job.RUNNING, worker=job.worker).update(
+        **values
+    )
+    if recorded:
+        if finished:
+            _delete_upload(upload)
+        for name, value in values.items():
+            setattr(job, name, value)
+    else:
+        logger.warning(
+            'Job %s was requeued while %s ran it; dropping its outcome', job.pk, job.worker
+        )
+        job.refresh_from_db()
+    return bool(recorded)
+
+
+def run_job(job: Job) -> Job:
+    """Run a claimed job and record its result, or schedule its retry."""
+    try:
+        result = HANDLERS[job.kind](job, _progress(job))
+    except Exception as exc:
+        logger.exception('Job %s (%s) failed on attempt %s', job.pk, job.kind, job.attempts)
+        now = timezone.now()
+        values = {'error': f'{type(exc).__name__}: {exc}', 'worker': ''}
+        if job.attempts < job.max_attempts:
+            values.update(status=Job.QUEUED, run_after=now + _retry_delay(job.attempts))
+        else:
+            values.update(status=Job.FAILED, finished_at=now)
+        _record_outcome(job, **values)
+        return job
+    _record_outcome(
+        job,
+        status=Job.SUCCEEDED,
+        result=result,
+        error='',
+        worker='',
+        finished_at=timezone.now(),
+    )
+    return job
+
+
+def requeue_stale_jobs(now=None) -> int:
+    """
+    Requeue the running jobs of workers that stopped sending heartbeats, or
+    fail them when they have no attempts left. Returns the jobs requeued.
+    """
+    now = now or timezone.now()
+    stale = Job.objects.filter(
+        status=Job.RUNNING,
+        heartbeat_at__lt=now - timedelta(seconds=job_options()['HEARTBEAT_TIMEOUT']),
+    )
+    exhausted = stale.filter(attempts__gte=F('max_attempts'))
+    uploads = list(exhausted.exclude(upload='').values_list('upload', flat=True))
+    exhausted.update(
+        status=Job.FAILED,
+        error='El proceso que ejecutaba la tarea dejó de responder.',
+        worker='',
+        upload='',
+        finished_at=now,
+        updated_at=now,
+    )
+    for name in uploads:
+        _delete_upload(name)
+    return stale.update(status=Job.QUEUED, worker='', run_after=now, updated_at=now)
+
+
+def work(worker=None, once=False, max_jobs=None, poll_interval=None, should_stop=None) -> int:
+    """
+    Claim and run jobs until ``should_stop()`` is true, ``max_jobs`` have
+    run, or (with ``once``) the queue is empty. Returns the jobs run.
+    """
+    worker = worker or default_worker_name()
+    poll_interval = job_options()['POLL_INTERVAL'] if poll_interval is None else poll_interval
+    should_stop = should_stop or (lambda: False)
+    processed = 0
+    requeue_stale_jobs()
+    while not should_stop() and (max_jobs is None or processed < max_jobs):
+        # Like a request would, drop connections past CONN_MAX_AGE or broken.
+        close_old_connections()
+        job = claim_job(worker)
+        if job is None:
+            if once:
+                break
+            requeue_stale_jobs()
+            time.sleep(poll_interval)
+            continue
+        run_job(job)
+        processed += 1
+    return processed
+
+
+@job_handler(Job.IMPORT_PRODUCTS)
+def _import_products(job, progress):
+    # Read line by line from storage, like the synchronous import.
+    with job.upload.open('rb') as upload:
+        stream = io.TextIOWrapper(upload.file, encoding='utf-8-sig', newline='')
+        rows = read_rows(stream, job.payload['file_format'])
+        report = import_products(rows, progress=progress)
+    progress(report.processed, report.processed)
+    return report.as_dict()
+
+
+@job_handler(Job.ANALYTICS)
+def _analytics(job, progress):
+    data = spending_analytics(
+        job.user, year=job.payload.get('year'), products=job.payload.get('products', 10)
+    )
+    progress(1, 1)
+    return SpendingAnalyticsSerializer(data).data
+
+
+@job_handler(Job.REPAIR_LIST_TOTALS)
+def _repair_list_totals(job, progress):
+    lists = ShoppingList.objects.all()
+    if job.user_id is not None:
+        lists = lists.filter(user_id=job.user_id)
+    progress(0, lists.count())
+    checked, repaired = lists.repair_totals(progress=progress)
+    return {'checked': checked, 'repaired': repaired}
+
+
+@job_handler(Job.REFRESH_PRICE_STATS)
+def _refresh_price_stats(job, progress):
+    refreshed = refresh_stale_price_stats(all=job.payload.get('all', False), progress=progress)
+    return {'refreshed': refreshed}
@@ -0,0 +1,84 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from tu_canasta.benchmarks import (
+    BASELINE_PATH,
+    compare_to_baseline,
+    failed_scenarios,
+    load_baseline,
+    run_benchmarks,
+    seed_fixtures,
+    write_baseline,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Mide consultas, latencia p50/p95 y memoria de cada endpoint sobre una base '
+        'de datos de prueba y falla si alguno supera su línea base.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=20)
+        parser.add_argument('--lists', type=int, default=5, help='Listas por usuario.')
+        parser.add_argument('--items', type=int, default=20, help='Ítems por lista.')
+        parser.add_argument('--products', type=int, default=2000)
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--baseline', default=str(BASELINE_PATH))
+        parser.add_argument(
+            '--update-baseline',
+            action='store_true',
+            help='Guarda los resultados como nueva línea base en lugar de comparar.',
+        )
+        parser.add_argument(
+            '--latency-tolerance',
+            type=float,
+            default=None,
+            help='Fracción de aumento del p95 permitida frente a la línea base (p. ej. 0.5).',
+        )
+        parser.add_argument('--json', action='store_true', help='Imprime los resultados en JSON.')
+
+    def handle(self, *args, **options):
+        # Fixtures are written to a throwaway test database, never the real one.
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            fixtures = seed_fixtures(
+                users=options['users'],
+                lists_per_user=options['lists'],
+                items_per_list=options['items'],
+                products=options['products'],
+            )
+            results = run_benchmarks(fixtures, repeat=max(options['repeat'], 1))
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2, sort_keys=True))
+        else:
+            for key, result in results.items():
+                self.stdout.write(
+                    f'{key:<55} {result["queries"]:>3} q  p50 {result["p50_ms"]:>8.2f} ms  '
+                    f'p95 {result["p95_ms"]:>8.2f} ms  {result["peak_kib"]:>9.1f} KiB'
+                )
+
+        if options['update_baseline']:
+            failed = failed_scenarios(results)
+            if failed:
+                raise CommandError('Escenarios con error:\n' + '\n'.join(failed))
+            write_baseline(results, options['baseline'])
+            self.stdout.write(self.style.SUCCESS(f'Línea base guardada en {options["baseline"]}.'))
+            return
+
+        try:
+            baseline = load_baseline(options['baseline'])
+        except FileNotFoundError:
+            raise CommandError('No existe la línea base; ejecútalo con --update-baseline.')
+        problems = compare_to_baseline(results, baseline, options['latency_tolerance'])
+        if problems:
+            raise CommandError('Regresiones detectadas:\n' + '\n'.join(problems))
+        self.stdout.write(self.style.SUCCESS(f'{len(results)} escenarios dentro de la línea base.'))
@@ -0,0 +1,25 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from tu_canasta.benchmarks import run_load
+
+
+class Command(BaseCommand):
+    help = (
+        'Prueba de carga contra un servidor en ejecución (WSGI o ASGI): mide '
+        'peticiones por segundo y latencia p50/p95/p99 con N clientes concurrentes.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('url', help='URL completa, p. ej. http://127.0.0.1:8000/api/products/')
+        parser.add_argument('--user-id', help='Valor del encabezado X-USER-ID.')
+        parser.add_argument('--concurrency', type=int, default=32)
+        parser.add_argument('--duration', type=float, default=10.0, help='Segundos.')
+
+    def handle(self, *args, url, user_id, concurrency, duration, **options):
+        headers = {'Accept': 'application/json'}
+        if user_id:
+            headers['X-USER-ID'] = str(user_id)
+        result = run_load(url, concurrency=concurrency, duration=duration, headers=headers)
+        self.stdout.write(json.dumps(result))
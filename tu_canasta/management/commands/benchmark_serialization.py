@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from tu_canasta.benchmarks import benchmark_serialization, seed_fixtures
+
+
+class Command(BaseCommand):
+    help = (
+        'Compara el costo de serializar y renderizar 1.000 ítems con los serializadores '
+        'de DRF y JSONRenderer frente a la ruta rápida y orjson.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--items', type=int, default=1000)
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, items, repeat, **options):
+        # Fixtures are written to a throwaway test database, never the real one.
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            fixtures = seed_fixtures(
+                users=1, lists_per_user=1, items_per_list=items, products=items
+            )
+            results = benchmark_serialization(fixtures.list_id, repeat=max(repeat, 1))
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        baseline = results['drf+json']['total_ms']
+        self.stdout.write('Milisegundos por cada 1.000 ítems (mediana):')
+        for name, result in results.items():
+            self.stdout.write(
+                f'{name:<12} serializar {result["serialize_ms"]:>8.2f}  '
+                f'renderizar {result["render_ms"]:>7.2f}  total {result["total_ms"]:>8.2f}  '
+                f'({baseline / result["total_ms"]:.1f}x)'
+            )
@@ -0,0 +1,47 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from tu_canasta.catalog import FORMATS, detect_format, import_products, read_rows
+
+
+class Command(BaseCommand):
+    help = 'Importa o actualiza productos por SKU desde un archivo CSV o NDJSON.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Ruta del archivo, o '-' para leer de stdin.")
+        parser.add_argument('--file-format', choices=FORMATS)
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, path, file_format, chunk_size, **options):
+        if path == '-' and not file_format:
+            raise CommandError('Indica --file-format al leer de stdin.')
+        try:
+            file_format = detect_format(path, file_format)
+        except ValueError as exc:
+            raise CommandError(str(exc))
+
+        if path == '-':
+            sys.stdin.reconfigure(encoding='utf-8-sig', newline='')
+            report = import_products(read_rows(sys.stdin, file_format), chunk_size)
+        else:
+            try:
+                with open(path, encoding='utf-8-sig', newline='') as stream:
+                    report = import_products(read_rows(stream, file_format), chunk_size)
+            except OSError as exc:
+                raise CommandError(str(exc))
+
+        for error in report.errors:
+            details = '; '.join(
+                f"{field}: {' '.join(str(message) for message in messages)}"
+                for field, messages in error['errors'].items()
+            )
+            self.stderr.write(f"Línea {error['line']}: {details}")
+        if report.error_count > len(report.errors):
+            self.stderr.write(
+                f'... y {report.error_count - len(report.errors)} errores más.'
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f'{report.processed} filas procesadas, {report.imported} productos '
+            f'importados, {report.error_count} con errores.'
+        ))
@@ -0,0 +1,51 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from tu_canasta.accounts import import_users
+from tu_canasta.catalog import FORMATS, detect_format, read_rows
+
+
+class Command(BaseCommand):
+    help = (
+        'Crea usuarios desde un archivo CSV o NDJSON (first_name, last_name, email, '
+        'password), calculando los hashes de cada lote en paralelo.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Ruta del archivo, o '-' para leer de stdin.")
+        parser.add_argument('--file-format', choices=FORMATS)
+        parser.add_argument('--chunk-size', type=int, default=500)
+
+    def handle(self, *args, path, file_format, chunk_size, **options):
+        if path == '-' and not file_format:
+            raise CommandError('Indica --file-format al leer de stdin.')
+        try:
+            file_format = detect_format(path, file_format)
+        except ValueError as exc:
+            raise CommandError(str(exc))
+
+        if path == '-':
+            sys.stdin.reconfigure(encoding='utf-8-sig', newline='')
+            report = import_users(read_rows(sys.stdin, file_format), chunk_size)
+        else:
+            try:
+                with open(path, encoding='utf-8-sig', newline='') as stream:
+                    report = import_users(read_rows(stream, file_format), chunk_size)
+            except OSError as exc:
+                raise CommandError(str(exc))
+
+        for error in report.errors:
+            details = '; '.join(
+                f"{field}: {' '.join(str(message) for message in messages)}"
+                for field, messages in error['errors'].items()
+            )
+            self.stderr.write(f"Línea {error['line']}: {details}")
+        if report.error_count > len(report.errors):
+            self.stderr.write(
+                f'... y {report.error_count - len(report.errors)} errores más.'
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f'{report.processed} filas procesadas, {report.imported} usuarios '
+            f'creados, {report.error_count} con errores.'
+        ))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from tu_canasta.sync import prune_deleted_records
+
+
+class Command(BaseCommand):
+    help = 'Elimina los registros de borrados más antiguos que SYNC_TOMBSTONE_RETENTION_DAYS.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, batch_size, **options):
+        deleted = total = prune_deleted_records(batch_size)
+        while deleted:
+            deleted = prune_deleted_records(batch_size)
+            total += deleted
+        self.stdout.write(self.style.SUCCESS(f'{total} registros de borrados eliminados.'))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from tu_canasta.idempotency import prune_idempotency_keys
+
+
+class Command(BaseCommand):
+    help = 'Elimina las claves Idempotency-Key vencidas y sus respuestas guardadas.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, batch_size, **options):
+        deleted = total = prune_idempotency_keys(batch_size)
+        while deleted:
+            deleted = prune_idempotency_keys(batch_size)
+            total += deleted
+        self.stdout.write(self.style.SUCCESS(f'{total} claves eliminadas.'))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from tu_canasta.models import ShoppingList
+
+
+class Command(BaseCommand):
+    help = 'Repara los totales almacenados de las listas de compras que no coinciden con sus ítems.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Solo reporta las listas con diferencias, sin corregirlas.',
+        )
+
+    def handle(self, *args, batch_size, dry_run, **options):
+        checked, repaired = ShoppingList.objects.repair_totals(batch_size, dry_run)
+        verb = 'con diferencias' if dry_run else 'reparadas'
+        self.stdout.write(
+            self.style.SUCCESS(f'{checked} listas revisadas, {repaired} {verb}.')
+        )
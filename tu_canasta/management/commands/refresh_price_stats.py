@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from tu_canasta.prices import refresh_stale_price_stats
+
+
+class Command(BaseCommand):
+    help = (
+        'Actualiza las estadísticas de precios (ventanas de 30 y 90 días) de los '
+        'productos que no se han refrescado en el último día.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='Recalcula todos los productos con observaciones de precio.',
+        )
+
+    def handle(self, *args, batch_size, all, **options):
+        refreshed = refresh_stale_price_stats(all=all, batch_size=batch_size)
+        self.stdout.write(self.style.SUCCESS(f'{refreshed} productos actualizados.'))
@@ -0,0 +1,60 @@
+import signal
+
+from django.core.management.base import BaseCommand, CommandError
+
+from tu_canasta.caching import response_cache_enabled
+from tu_canasta.jobs import default_worker_name, work
+from tu_canasta.shared_cache import is_shared_cache
+
+
+class Command(BaseCommand):
+    help = (
+        'Ejecuta las tareas en segundo plano encoladas en la base de datos '
+        '(importaciones, analíticas, reparación de totales).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Procesa las tareas pendientes y termina cuando la cola está vacía.',
+        )
+        parser.add_argument('--max-jobs', type=int, default=None)
+        parser.add_argument(
+            '--poll-interval',
+            type=float,
+            default=None,
+            help='Segundos de espera cuando no hay tareas (JOB_POLL_INTERVAL por defecto).',
+        )
+        parser.add_argument('--name', default=None, help='Nombre del worker en las tareas.')
+
+    def handle(self, *args, once, max_jobs, poll_interval, name, **options):
+        if response_cache_enabled() and not is_shared_cache('default'):
+            # The jobs invalidate cached responses; in a private cache the web
+            # processes would never see it.
+            raise CommandError(
+                'Con la caché de respuestas activa, run_worker necesita una caché compartida '
+                '(CACHE_BACKEND=file o redis).'
+            )
+        stopping = []
+
+        def stop(signum, frame):
+            # Finish the current job, then exit.
+            stopping.append(signum)
+
+        previous = {
+            signum: signal.signal(signum, stop) for signum in (signal.SIGINT, signal.SIGTERM)
+        }
+        name = name or default_worker_name()
+        try:
+            processed = work(
+                worker=name,
+                once=once,
+                max_jobs=max_jobs,
+                poll_interval=poll_interval,
+                should_stop=lambda: bool(stopping),
+            )
+        finally:
+            for signum, handler in previous.items():
+                signal.signal(signum, handler)
+        self.stdout.write(self.style.SUCCESS(f'{processed} tareas procesadas por {name}.'))
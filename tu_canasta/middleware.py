@@ -0,0 +1,463 @@
+"""
+Per-request performance instrumentation.
+
+``RequestMetricsMiddleware`` records the query count, database time,
+serializer time and render time of a sampled request, reports them in a
+``Server-Timing`` header and a JSON log line, and flags routes that run more
+queries than their budget in ``benchmark_baseline.json``. When disabled it
+removes itself from the middleware chain at startup.
+
+``LoadSheddingMiddleware`` answers ``503`` to expensive requests while the
+database is slow, judged by the query latency of recent requests.
+
+``ReplicaRoutingMiddleware`` sends the reads of safe API requests to the
+read replica (see tu_canasta.routers).
+
+The middlewares here run natively in sync (WSGI) and async (ASGI) chains,
+so none forces Django to adapt the rest of the stack through threads.
+"""
+import json
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured, MiddlewareNotUsed
+from django.db import connections
+from django.http import JsonResponse
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.views import APIView
+from whitenoise.middleware import WhiteNoiseMiddleware
+
+from .routers import (
+    ais_pinned_to_primary,
+    apin_to_primary,
+    is_pinned_to_primary,
+    pin_to_primary,
+    read_from_replica,
+    replica_alias,
+    replica_options,
+    route_reads_to_replica,
+)
+from .shared_cache import is_shared_cache
+from .throttling import request_cost
+
+logger = logging.getLogger('tu_canasta.performance')
+
+DEFAULTS = {
+    'ENABLED': False,
+    'SAMPLE_RATE': 1.0,
+    'SLOW_QUERY_MS': 100,
+    'SLOW_REQUEST_MS': 500,
+}
+
+LOAD_SHEDDING_DEFAULTS = {
+    'ENABLED': False,
+    'SAMPLE_RATE': 1.0,
+    'DB_LATENCY_MS': 250,
+    'MIN_COST': 5,
+    'RETRY_AFTER': 5,
+    'SMOOTHING': 0.2,
+}
+
+_current_metrics = ContextVar('tu_canasta_request_metrics', default=None)
+
+
+class RequestMetrics:
+    """Timings collected while one request is processed, in seconds."""
+
+    def __init__(self, slow_query_seconds: float):
+        self.slow_query_seconds = slow_query_seconds
+        self.query_count = 0
+        self.timings = {'db': 0.0, 'serialize': 0.0, 'render': 0.0}
+        self.slow_queries = []
+
+    def add(self, name: str, seconds: float) -> None:
+        self.timings[name] += seconds
+
+    def __call__(self, execute, sql, params, many, context):
+        # Installed with connection.execute_wrapper() to time every query.
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.query_count += 1
+            self.timings['db'] += elapsed
+            if elapsed >= self.slow_query_seconds:
+                self.slow_queries.append({'sql': sql[:500], 'ms': round(elapsed * 1000, 2)})
+
+
+def current_metrics():
+    """Metrics of the request being sampled, or None."""
+    return _current_metrics.get()
+
+
+@contextmanager
+def timed(name: str):
+    """Add the block's duration to ``name`` when the request is sampled."""
+    metrics = _current_metrics.get()
+    if metrics is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.add(name, time.perf_counter() - started)
+
+
+def _install(metrics):
+    for alias in connections:
+        connections[alias].execute_wrappers.append(metrics)
+
+
+def _uninstall(metrics):
+    for alias in connections:
+        connections[alias].execute_wrappers.remove(metrics)
+
+
+def load_query_budgets() -> dict:
+    """``{(url_name, METHOD): queries}`` from the committed benchmark baseline."""
+    from .benchmarks import load_baseline
+
+    budgets = {}
+    try:
+        baseline = load_baseline()
+    except (OSError, ValueError):
+        return budgets
+    for key, result in baseline.items():
+        route_key = (result['route'], key.split(' ', 1)[0])
+        budgets[route_key] = max(budgets.get(route_key, 0), result['queries'])
+    return budgets
+
+
+class RequestMetricsMiddleware:
+    """Measure sampled requests; see the module docstring."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        options = {**DEFAULTS, **getattr(settings, 'REQUEST_METRICS', {})}
+        if not options['ENABLED']:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+        self.sample_rate = options['SAMPLE_RATE']
+        self.slow_query_seconds = options['SLOW_QUERY_MS'] / 1000
+        self.slow_request_seconds = options['SLOW_REQUEST_MS'] / 1000
+        self.budgets = load_query_budgets()
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if not self._sampled():
+            return self.get_response(request)
+
+        metrics = RequestMetrics(self.slow_query_seconds)
+        token = _current_metrics.set(metrics)
+        started = time.perf_counter()
+        _install(metrics)
+        try:
+            response = self.get_response(request)
+        finally:
+            _uninstall(metrics)
+            _current_metrics.reset(token)
+        self._report(request, response, metrics, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        if not self._sampled():
+            return await self.get_response(request)
+
+        metrics = RequestMetrics(self.slow_query_seconds)
+        token = _current_metrics.set(metrics)
+        started = time.perf_counter()
+        # Under ASGI the ORM runs in the request's thread-sensitive executor
+        # thread, whose connections are the ones that need the wrapper.
+        await sync_to_async(_install)(metrics)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(_uninstall)(metrics)
+            _current_metrics.reset(token)
+        self._report(request, response, metrics, time.perf_counter() - started)
+        return response
+
+    def _sampled(self) -> bool:
+        return self.sample_rate >= 1 or random.random() < self.sample_rate
+
+    def process_template_response(self, request, response):
+        # DRF responses render after the view returns; render them here so the
+        # time is attributed to rendering rather than lost in the total.
+        with timed('render'):
+            response.render()
+        return response
+
+    def _report(self, request, response, metrics, total):
+        match = request.resolver_match
+        route = match.url_name if match else None
+        budget = self.budgets.get((route, request.method))
+        over_budget = budget is not None and metrics.query_count > budget
+
+        entries = [
+            f'db;dur={metrics.timings["db"] * 1000:.2f};desc="{metrics.query_count} queries"',
+            f'serialize;dur={metrics.timings["serialize"] * 1000:.2f}',
+            f'render;dur={metrics.timings["render"] * 1000:.2f}',
+            f'total;dur={total * 1000:.2f}',
+        ]
+        if over_budget:
+            entries.append(f'budget;desc="{metrics.query_count}/{budget} queries"')
+        response['Server-Timing'] = ', '.join(entries)
+
+        record = {
+            'method': request.method,
+            'path': request.path,
+            'route': route,
+            'status': response.status_code,
+            'queries': metrics.query_count,
+            'query_budget': budget,
+            'over_budget': over_budget,
+            'db_ms': round(metrics.timings['db'] * 1000, 2),
+            'serialize_ms': round(metrics.timings['serialize'] * 1000, 2),
+            'render_ms': round(metrics.timings['render'] * 1000, 2),
+            'total_ms': round(total * 1000, 2),
+            'slow_queries': metrics.slow_queries,
+        }
+        slow = total >= self.slow_request_seconds or metrics.slow_queries
+        level = logging.WARNING if over_budget or slow else logging.INFO
+        logger.log(level, json.dumps(record))
+
+
+class DatabaseLatencyMonitor:
+    """
+    Exponentially weighted average of the query latency of recent requests,
+    in seconds. A reading older than ``max_age`` seconds no longer counts.
+    """
+
+    def __init__(self, smoothing: float, max_age: float):
+        self.smoothing = smoothing
+        self.max_age = max_age
+        self.average = None
+        self.updated_at = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, metrics: RequestMetrics) -> None:
+        if not metrics.query_count:
+            return
+        sample = metrics.timings['db'] / metrics.query_count
+        with self._lock:
+            if self.average is None:
+                self.average = sample
+            else:
+                self.average += self.smoothing * (sample - self.average)
+            self.updated_at = time.monotonic()
+
+    def latency(self):
+        """The current average, or None without recent samples."""
+        if self.average is None or time.monotonic() - self.updated_at > self.max_age:
+            return None
+        return self.average
+
+
+class LoadSheddingMiddleware:
+    """
+    Overload mode: while the average query latency is above ``DB_LATENCY_MS``,
+    API requests that cost at least ``MIN_COST`` throttle tokens get ``503``
+    with ``Retry-After`` before their view runs. Cheaper requests keep going
+    through and measuring the database, and a reading without new samples
+    expires after ``RETRY_AFTER`` seconds, so the mode ends by itself.
+    Measures the requests sampled by RequestMetricsMiddleware when that runs
+    first, otherwise its own ``SAMPLE_RATE``. Removed at startup when disabled.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        options = {**LOAD_SHEDDING_DEFAULTS, **getattr(settings, 'LOAD_SHEDDING', {})}
+        if not options['ENABLED']:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+            self.process_view = self._aprocess_view
+        self.sample_rate = options['SAMPLE_RATE']
+        self.threshold = options['DB_LATENCY_MS'] / 1000
+        self.min_cost = options['MIN_COST']
+        self.retry_after = options['RETRY_AFTER']
+        self.monitor = DatabaseLatencyMonitor(options['SMOOTHING'], options['RETRY_AFTER'])
+
+    def _metrics(self):
+        """This request's metrics and whether they still need installing."""
+        metrics = current_metrics()
+        if metrics is not None:
+            return metrics, False
+        if self.sample_rate < 1 and random.random() >= self.sample_rate:
+            return None, False
+        return RequestMetrics(float('inf')), True
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        metrics, install = self._metrics()
+        if not install:
+            response = self.get_response(request)
+        else:
+            _install(metrics)
+            try:
+                response = self.get_response(request)
+            finally:
+                _uninstall(metrics)
+        if metrics is not None:
+            self.monitor.observe(metrics)
+        return response
+
+    async def __acall__(self, request):
+        metrics, install = self._metrics()
+        if not install:
+            response = await self.get_response(request)
+        else:
+            await sync_to_async(_install)(metrics)
+            try:
+                response = await self.get_response(request)
+            finally:
+                await sync_to_async(_uninstall)(metrics)
+        if metrics is not None:
+            self.monitor.observe(metrics)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view_class = getattr(view_func, 'cls', None)
+        if not (isinstance(view_class, type) and issubclass(view_class, APIView)):
+            return None
+        method = request.method.lower()
+        actions = getattr(view_func, 'actions', None)
+        if actions is None:
+            action = method
+        else:
+            action = actions.get(method) or (actions.get('get') if method == 'head' else None)
+        if request_cost(view_class, action) < self.min_cost:
+            return None
+        latency = self.monitor.latency()
+        if latency is None or latency <= self.threshold:
+            return None
+        response = JsonResponse(
+            {'detail': 'El servicio está saturado; reintenta en unos segundos.'}, status=503
+        )
+        response['Retry-After'] = str(self.retry_after)
+        return response
+
+    async def _aprocess_view(self, request, view_func, view_args, view_kwargs):
+        return self.process_view(request, view_func, view_args, view_kwargs)
+
+
+class AsyncWhiteNoiseMiddleware(WhiteNoiseMiddleware):
+    """
+    WhiteNoise that can also sit in an async middleware chain. The stock
+    middleware is sync-only, which makes Django run every ASGI request
+    through a thread just to pass it along.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response=None, *args, **kwargs):
+        super().__init__(get_response, *args, **kwargs)
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        if self.autorefresh:
+            static_file = await sync_to_async(self.find_file)(request.path_info)
+        else:
+            static_file = self.files.get(request.path_info)
+        if static_file is not None:
+            return await sync_to_async(self.serve)(static_file, request)
+        return await self.get_response(request)
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Serves the safe methods of the API views from the read replica. Any
+    other request pins its X-USER-ID to the primary for a few seconds, so
+    the same user reads their own writes. Removed at startup when no replica
+    is configured; the pins need a cache shared by every worker.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if replica_alias() is None:
+            raise MiddlewareNotUsed
+        if not is_shared_cache(replica_options()['CACHE']):
+            raise ImproperlyConfigured(
+                'REPLICA_ROUTING necesita una caché compartida entre procesos (CACHE_BACKEND=file '
+                'o redis) para fijar al primario a quien acaba de escribir.'
+            )
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+            # A coroutine, so Django does not run it through a thread.
+            self.process_view = self._aprocess_view
+
+    @staticmethod
+    def _user_identifier(request):
+        return request.headers.get('X-USER-ID') or request.GET.get('user_id')
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        user_identifier = self._user_identifier(request)
+        if request.method not in SAFE_METHODS:
+            response = self.get_response(request)
+            if user_identifier:
+                pin_to_primary(user_identifier)
+            return response
+        request._replica_reads = not (
+            user_identifier and is_pinned_to_primary(user_identifier)
+        )
+        with read_from_replica(enabled=False):
+            return self.get_response(request)
+
+    async def __acall__(self, request):
+        user_identifier = self._user_identifier(request)
+        if request.method not in SAFE_METHODS:
+            response = await self.get_response(request)
+            if user_identifier:
+                await apin_to_primary(user_identifier)
+            return response
+        request._replica_reads = not (
+            user_identifier and await ais_pinned_to_primary(user_identifier)
+        )
+        with read_from_replica(enabled=False):
+            return await self.get_response(request)
+
+    @staticmethod
+    def _route(request, view_func):
+        # Only the API views: the admin and its sessions stay on the primary.
+        view_class = getattr(view_func, 'cls', None)
+        if (
+            getattr(request, '_replica_reads', False)
+            and isinstance(view_class, type)
+            and issubclass(view_class, APIView)
+        ):
+            route_reads_to_replica()
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        self._route(request, view_func)
+
+    async def _aprocess_view(self, request, view_func, view_args, view_kwargs):
+        self._route(request, view_func)
@@ -0,0 +1,65 @@
+# Generated by Django 5.2.7 on 2026-10-18 12:40
+
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import Count, F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def backfill_totals(apps, schema_editor):
+    ShoppingList = apps.get_model('tu_canasta', 'ShoppingList')
+    ShoppingListItem = apps.get_model('tu_canasta', 'ShoppingListItem')
+    money = models.DecimalField(max_digits=12, decimal_places=2)
+    items = (
+        ShoppingListItem.objects.filter(shopping_list=OuterRef('pk'))
+        .order_by()
+        .values('shopping_list')
+    )
+    purchased = items.filter(is_purchased=True)
+
+    def subquery(queryset, aggregate, default, output_field):
+        return Coalesce(
+            Subquery(queryset.annotate(value=aggregate).values('value')[:1]),
+            default,
+            output_field=output_field,
+        )
+
+    line_total = Sum(F('quantity') * F('unit_price'), output_field=money)
+    ShoppingList.objects.using(schema_editor.connection.alias).update(
+        item_count=subquery(items, Count('pk'), 0, models.IntegerField()),
+        purchased_count=subquery(purchased, Count('pk'), 0, models.IntegerField()),
+        cost_total=subquery(items, line_total, Decimal('0.00'), money),
+        spent_total=subquery(purchased, line_total, Decimal('0.00'), money),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tu_canasta', '0003_alter_shoppinglist_options_shoppinglist_budget_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='shoppinglist',
+            name='cost_total',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='shoppinglist',
+            name='item_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='shoppinglist',
+            name='purchased_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='shoppinglist',
+            name='spent_total',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=12),
+        ),
+        migrations.RunPython(backfill_totals, migrations.RunPython.noop),
+    ]
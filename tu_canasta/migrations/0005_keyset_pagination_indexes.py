@@ -0,0 +1,29 @@
+# Generated by Django 5.2.7 on 2026-10-18 12:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tu_canasta', '0004_shoppinglist_stored_totals'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['name', 'id'], name='product_name_keyset_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='shoppinglist',
+            index=models.Index(fields=['user', '-target_date', '-updated_at', '-id'], name='shoplist_user_keyset_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='shoppinglistitem',
+            index=models.Index(fields=['shopping_list', '-updated_at', '-id'], name='item_list_updated_keyset_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['-created_at', '-id'], name='user_created_keyset_idx'),
+        ),
+    ]
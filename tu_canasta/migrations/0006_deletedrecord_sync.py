@@ -0,0 +1,41 @@
+# Generated by Django 5.2.7 on 2026-10-18 12:45
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tu_canasta', '0005_keyset_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeletedRecord',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(choices=[('shopping_list', 'Shopping list'), ('shopping_list_item', 'Shopping list item')], max_length=32)),
+                ('object_id', models.BigIntegerField()),
+                ('shopping_list_id', models.BigIntegerField(blank=True, null=True)),
+                ('deleted_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'ordering': ['deleted_at', 'id'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='shoppinglist',
+            index=models.Index(fields=['user', 'updated_at', 'id'], name='shoplist_user_sync_idx'),
+        ),
+        migrations.AddField(
+            model_name='deletedrecord',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='deleted_records', to='tu_canasta.user'),
+        ),
+        migrations.AddIndex(
+            model_name='deletedrecord',
+            index=models.Index(fields=['user', 'deleted_at', 'id'], name='deleted_user_sync_idx'),
+        ),
+    ]
@@ -0,0 +1,84 @@
+# Full-text search indexes for the product catalogue (see tu_canasta.search).
+# On SQLite the FTS5 triggers live on tu_canasta_product: a later migration that
+# rebuilds that table must recreate them.
+from django.db import migrations
+
+SQLITE_FORWARD = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS tu_canasta_product_fts USING fts5(
+        sku, name, description,
+        content='tu_canasta_product', content_rowid='id',
+        prefix='2 3', tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS tu_canasta_product_fts_ai
+    AFTER INSERT ON tu_canasta_product BEGIN
+        INSERT INTO tu_canasta_product_fts(rowid, sku, name, description)
+        VALUES (new.id, new.sku, new.name, new.description);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS tu_canasta_product_fts_ad
+    AFTER DELETE ON tu_canasta_product BEGIN
+        INSERT INTO tu_canasta_product_fts(tu_canasta_product_fts, rowid, sku, name, description)
+        VALUES ('delete', old.id, old.sku, old.name, old.description);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS tu_canasta_product_fts_au
+    AFTER UPDATE ON tu_canasta_product BEGIN
+        INSERT INTO tu_canasta_product_fts(tu_canasta_product_fts, rowid, sku, name, description)
+        VALUES ('delete', old.id, old.sku, old.name, old.description);
+        INSERT INTO tu_canasta_product_fts(rowid, sku, name, description)
+        VALUES (new.id, new.sku, new.name, new.description);
+    END
+    """,
+    "INSERT INTO tu_canasta_product_fts(tu_canasta_product_fts) VALUES ('rebuild')",
+]
+
+SQLITE_REVERSE = [
+    'DROP TRIGGER IF EXISTS tu_canasta_product_fts_au',
+    'DROP TRIGGER IF EXISTS tu_canasta_product_fts_ad',
+    'DROP TRIGGER IF EXISTS tu_canasta_product_fts_ai',
+    'DROP TABLE IF EXISTS tu_canasta_product_fts',
+]
+
+POSTGRESQL_FORWARD = [
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    """
+    CREATE INDEX IF NOT EXISTS product_search_document_idx ON tu_canasta_product
+    USING gin (to_tsvector('simple', coalesce(tu_canasta_product.sku, '') || ' ' ||
+        coalesce(tu_canasta_product.name, '') || ' ' ||
+        coalesce(tu_canasta_product.description, '')))
+    """,
+    'CREATE INDEX IF NOT EXISTS product_name_trgm_idx ON tu_canasta_product USING gin (name gin_trgm_ops)',
+    'CREATE INDEX IF NOT EXISTS product_sku_trgm_idx ON tu_canasta_product USING gin (sku gin_trgm_ops)',
+]
+
+POSTGRESQL_REVERSE = [
+    'DROP INDEX IF EXISTS product_sku_trgm_idx',
+    'DROP INDEX IF EXISTS product_name_trgm_idx',
+    'DROP INDEX IF EXISTS product_search_document_idx',
+]
+
+
+def _run(statements_by_vendor):
+    def run(apps, schema_editor):
+        for statement in statements_by_vendor.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tu_canasta', '0006_deletedrecord_sync'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            _run({'sqlite': SQLITE_FORWARD, 'postgresql': POSTGRESQL_FORWARD}),
+            _run({'sqlite': SQLITE_REVERSE, 'postgresql': POSTGRESQL_REVERSE}),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.7 on 2026-10-18 13:14
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tu_canasta', '0007_product_search_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductPriceStats',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='price_stats', serialize=False, to='tu_canasta.product')),
+                ('last_price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('last_observed_at', models.DateTimeField()),
+                ('min_price_30d', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('avg_price_30d', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('min_price_90d', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('avg_price_90d', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('observations_90d', models.PositiveIntegerField(default=0)),
+                ('refreshed_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PriceObservation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('unit_price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('quantity', models.PositiveIntegerField(default=1)),
+                ('observed_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='price_observations', to='tu_canasta.product')),
+            ],
+            options={
+                'ordering': ['-observed_at', '-id'],
+                'indexes': [models.Index(fields=['product', 'observed_at'], name='priceobs_product_time_idx')],
+            },
+        ),
+    ]
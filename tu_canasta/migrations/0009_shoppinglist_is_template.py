@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-18 13:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tu_canasta', '0008_price_history'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='shoppinglist',
+            name='is_template',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.7 on 2026-10-18 13:22
+# The items and lists tables are the large ones: build their indexes without
+# locking writes on PostgreSQL (see tu_canasta.operations).
+
+from django.db import migrations, models
+
+from tu_canasta.operations import AddIndexConcurrently
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('tu_canasta', '0009_shoppinglist_is_template'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='productpricestats',
+            index=models.Index(fields=['refreshed_at'], name='pricestats_refreshed_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='shoppinglist',
+            index=models.Index(condition=models.Q(('is_template', True)), fields=['user', '-target_date', '-updated_at', '-id'], name='shoplist_user_template_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='shoppinglistitem',
+            index=models.Index(condition=models.Q(('is_purchased', False)), fields=['shopping_list', '-updated_at', '-id'], name='item_list_pending_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='shoppinglistitem',
+            index=models.Index(condition=models.Q(('is_purchased', True)), fields=['shopping_list', '-updated_at', '-id'], name='item_list_purchased_idx'),
+        ),
+    ]
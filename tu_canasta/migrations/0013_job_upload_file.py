@@ -0,0 +1,32 @@
+# Generated by Django 5.2.7 on 2026-10-18 14:17
+
+from django.core.files.base import ContentFile
+from django.db import migrations, models
+
+
+def move_uploads_to_storage(apps, schema_editor):
+    """Write the files of pending imports to storage before dropping the column."""
+    Job = apps.get_model('tu_canasta', 'Job')
+    pending = Job.objects.using(schema_editor.connection.alias).filter(data__isnull=False)
+    for job in pending.iterator(chunk_size=1):
+        job.upload.save(job.payload.get('filename') or 'import', ContentFile(job.data))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tu_canasta', '0012_idempotency_keys'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='upload',
+            field=models.FileField(blank=True, editable=False, max_length=255, upload_to='jobs/'),
+        ),
+        migrations.RunPython(move_uploads_to_storage, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='job',
+            name='data',
+        ),
+    ]
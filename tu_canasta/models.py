@@ -1,10 +1,12 @@
 from decimal import Decimal
 from typing import Optional
 
-from django.contrib.auth.hashers import is_password_usable, make_password
+from django.contrib.auth.hashers import UNUSABLE_PASSWORD_PREFIX, identify_hasher
 from django.core.validators import MinValueValidator
-from django.db import models
-from django.db.models import F, Sum
+from django.db import models, router, transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 
 
 class User(models.Model):
@@ -18,17 +20,33 @@ class User(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Keyset pagination: Meta.ordering plus the id tiebreaker.
+            models.Index(fields=['-created_at', '-id'], name='user_created_keyset_idx'),
+        ]
 
     def __str__(self):
         return f'{self.first_name} {self.last_name}'.strip() or self.email
 
     def set_password(self, raw_password: str) -> None:
-        self.password = make_password(raw_password)
+        from .passwords import hash_password
+
+        self.password = hash_password(raw_password)
+
+    def _password_needs_hashing(self) -> bool:
+        # Stored hashes and unusable passwords ("!...") are kept as they are.
+        if not self.password or self.password.startswith(UNUSABLE_PASSWORD_PREFIX):
+            return False
+        try:
+            identify_hasher(self.password)
+        except ValueError:
+            return True
+        return False
 
     def save(self, *args, **kwargs):
         # Ensure password stays hashed when saving via the ORM
-        if not is_password_usable(self.password):
-            self.password = make_password(self.password)
+        if self._password_needs_hashing():
+            self.set_password(self.password)
         super().save(*args, **kwargs)
 
 
@@ -41,11 +59,136 @@ class Product(models.Model):
 
     class Meta:
         ordering = ['name']
+        indexes = [
+            models.Index(fields=['name', 'id'], name='product_name_keyset_idx'),
+        ]
 
     def __str__(self):
         return f'{self.name} ({self.sku})'
 
 
+def _line_total(prefix: str = ''):
+    return F(f'{prefix}quantity') * F(f'{prefix}unit_price')
+
+
+MONEY_FIELD = models.DecimalField(max_digits=12, decimal_places=2)
+
+
+class ShoppingListQuerySet(models.QuerySet):
+    def with_metrics(self):
+        """
+        Annotate every list metric computed from the items table in the same
+        query. Used to detect and repair drift in the stored totals.
+        """
+        purchased = Q(items__is_purchased=True)
+        return self.annotate(
+            metric_total_items=Count('items'),
+            metric_purchased_items=Count('items', filter=purchased),
+            metric_total_cost=Coalesce(
+                Sum(_line_total('items__'), output_field=MONEY_FIELD),
+                Decimal('0.00'),
+                output_field=MONEY_FIELD,
+            ),
+            metric_total_spent=Coalesce(
+                Sum(_line_total('items__'), filter=purchased, output_field=MONEY_FIELD),
+                Decimal('0.00'),
+                output_field=MONEY_FIELD,
+            ),
+        )
+
+    def with_drift(self):
+        """Lists whose stored totals differ from the items they contain."""
+        return self.with_metrics().filter(
+            ~Q(item_count=F('metric_total_items'))
+            | ~Q(purchased_count=F('metric_purchased_items'))
+            | ~Q(cost_total=F('metric_total_cost'))
+            | ~Q(spent_total=F('metric_total_spent'))
+        )
+
+    def apply_item_delta(self, items=0, purchased=0, cost=Decimal('0'), spent=Decimal('0')):
+        """Shift the stored totals atomically with F() expressions."""
+        return self.update(
+            item_count=F('item_count') + items,
+            purchased_count=F('purchased_count') + purchased,
+            cost_total=F('cost_total') + cost,
+            spent_total=F('spent_total') + spent,
+            updated_at=timezone.now(),
+        )
+
+    def recompute_totals(self, touch: bool = True):
+        """
+        Rebuild the stored totals from the items table with a single UPDATE.
+        """
+        items = (
+            ShoppingListItem.objects.filter(shopping_list=OuterRef('pk'))
+            .order_by()
+            .values('shopping_list')
+        )
+        purchased = items.filter(is_purchased=True)
+
+        def subquery(queryset, aggregate, default, output_field):
+            return Coalesce(
+                Subquery(queryset.annotate(value=aggregate).values('value')[:1]),
+                default,
+                output_field=output_field,
+            )
+
+        values = {
+            'item_count': subquery(items, Count('pk'), 0, models.IntegerField()),
+            'purchased_count': subquery(
+                purchased, Count('pk'), 0, models.IntegerField()
+            ),
+            'cost_total': subquery(
+                items,
+                Sum(_line_total(), output_field=MONEY_FIELD),
+                Decimal('0.00'),
+                MONEY_FIELD,
+            ),
+            'spent_total': subquery(
+                purchased,
+                Sum(_line_total(), output_field=MONEY_FIELD),
+                Decimal('0.00'),
+                MONEY_FIELD,
+            ),
+        }
+        if touch:
+            values['updated_at'] = timezone.now()
+        return self.update(**values)
+
+    def repair_totals(self, batch_size: int = 500, dry_run: bool = False, progress=None):
+        """
+        Walk the lists in primary key batches and rebuild the stored totals of
+        the ones that drifted. Returns ``(checked, drifted)``; ``progress`` is
+        called with the running count of checked lists after each batch.
+        """
+        checked = drifted_count = 0
+        last_id = 0
+        while True:
+            batch = list(
+                self.filter(pk__gt=last_id)
+                .order_by('pk')
+                .values_list('pk', flat=True)[:batch_size]
+            )
+            if not batch:
+                break
+            last_id = batch[-1]
+            checked += len(batch)
+            drifted = list(
+                self.model.objects.using(self.db).filter(pk__in=batch)
+                .with_drift()
+                .values_list('pk', flat=True)
+            )
+            if drifted and not dry_run:
+                # A single UPDATE per batch, so concurrent item writes are not lost.
+                self.model.objects.using(self.db).filter(pk__in=drifted).recompute_totals(
+                    touch=False
+                )
+            drifted_count += len(drifted)
+            if progress is not None:
+                progress(checked)
+        return checked, drifted_count
+
+
 class ShoppingList(models.Model):
     user = models.ForeignKey(
         User,
@@ -54,6 +197,8 @@ class ShoppingList(models.Model):
     )
     title = models.CharField(max_length=255, default='Lista de compras')
     target_date = models.DateField(blank=True, null=True)
+    # Templates are lists kept only to be duplicated (see duplicate()).
+    is_template = models.BooleanField(default=False)
     budget = models.DecimalField(
         max_digits=10,
         decimal_places=2,
@@ -61,22 +206,80 @@ class ShoppingList(models.Model):
         null=True,
         validators=[MinValueValidator(0)],
     )
+    # Denormalized totals, maintained incrementally from ShoppingListItem writes
+    # (see tu_canasta.signals) so reads never aggregate the items table.
+    item_count = models.PositiveIntegerField(default=0, editable=False)
+    purchased_count = models.PositiveIntegerField(default=0, editable=False)
+    cost_total = models.DecimalField(
+        max_digits=12, decimal_places=2, default=0, editable=False
+    )
+    spent_total = models.DecimalField(
+        max_digits=12, decimal_places=2, default=0, editable=False
+    )
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = ShoppingListQuerySet.as_manager()
+
     class Meta:
         ordering = ['-target_date', '-updated_at']
+        indexes = [
+            models.Index(
+                fields=['user', '-target_date', '-updated_at', '-id'],
+                name='shoplist_user_keyset_idx',
+            ),
+            # Delta sync: changes per user since a cursor.
+            models.Index(fields=['user', 'updated_at', 'id'], name='shoplist_user_sync_idx'),
+            # ?is_template=true: templates are few, so a partial index stays small.
+            models.Index(
+                fields=['user', '-target_date', '-updated_at', '-id'],
+                condition=Q(is_template=True),
+                name='shoplist_user_template_idx',
+            ),
+        ]
 
     def __str__(self):
         return f'{self.title} ({self.user})'
 
+    def duplicate(self, *, title=None, target_date=None, is_template=False,
+                  reset_purchased=True, refresh_prices=False):
+        """
+        Copy the list and its items in one transaction. The items are read
+        with one query and inserted with one bulk_create, whatever their
+        number; ``refresh_prices`` takes each product's last paid price.
+        """
+        using = router.db_for_write(type(self), instance=self)
+        fields = ['product_id', 'quantity', 'unit_price', 'is_purchased']
+        if refresh_prices:
+            fields.append('product__price_stats__last_price')
+        with transaction.atomic(using=using):
+            copy = type(self).objects.using(using).create(
+                user_id=self.user_id,
+                title=title or self.title,
+                target_date=target_date,
+                budget=self.budget,
+                is_template=is_template,
+            )
+            rows = self.items.using(using).order_by('pk').values(*fields)
+            ShoppingListItem.objects.using(using).bulk_create(
+                ShoppingListItem(
+                    shopping_list=copy,
+                    product_id=row['product_id'],
+                    quantity=row['quantity'],
+                    unit_price=row.get('product__price_stats__last_price') or row['unit_price'],
+                    is_purchased=row['is_purchased'] and not reset_purchased,
+                )
+                for row in rows
+            )
+        return copy
+
     @property
     def total_items(self) -> int:
-        return self.items.count()
+        return self.item_count
 
     @property
     def purchased_items(self) -> int:
-        return self.items.filter(is_purchased=True).count()
+        return self.purchased_count
 
     @property
     def pending_items(self) -> int:
@@ -84,23 +287,11 @@ class ShoppingList(models.Model):
 
     @property
     def total_cost(self) -> Decimal:
-        aggregate = self.items.aggregate(
-            total=Sum(
-                F('quantity') * F('unit_price'),
-                output_field=models.DecimalField(max_digits=12, decimal_places=2),
-            )
-        )
-        return aggregate['total'] or Decimal('0.00')
+        return Decimal(self.cost_total)
 
     @property
     def total_spent(self) -> Decimal:
-        aggregate = self.items.filter(is_purchased=True).aggregate(
-            total=Sum(
-                F('quantity') * F('unit_price'),
-                output_field=models.DecimalField(max_digits=12, decimal_places=2),
-            )
-        )
-        return aggregate['total'] or Decimal('0.00')
+        return Decimal(self.spent_total)
 
     @property
     def remaining_budget(self) -> Optional[Decimal]:
@@ -109,6 +300,102 @@ class ShoppingList(models.Model):
         return self.budget - self.total_cost
 
 
+class ShoppingListItemQuerySet(models.QuerySet):
+    """
+    Bulk writes bypass post_save/post_delete, so they announce the affected
+    lists through ``items_bulk_changed`` to keep the stored totals in sync,
+    and record the price of the items they mark as purchased.
+    """
+
+    def _list_ids(self):
+        return set(
+            self.order_by().values_list('shopping_list_id', flat=True).distinct()
+        )
+
+    def _notify(self, shopping_list_ids):
+        from .signals import notify_items_bulk_changed
+
+        notify_items_bulk_changed(shopping_list_ids, using=self.db)
+
+    def update(self, **kwargs):
+        from .prices import record_price_observations
+
+        with transaction.atomic(using=self.db, savepoint=False):
+            shopping_list_ids = self._list_ids()
+            newly_purchased = (
+                list(self.filter(is_purchased=False).order_by().values_list('pk', flat=True))
+                if kwargs.get('is_purchased') is True
+                else []
+            )
+            rows = super().update(**kwargs)
+            if {'shopping_list', 'shopping_list_id'} & kwargs.keys():
+                shopping_list_ids |= self._list_ids()
+            self._notify(shopping_list_ids)
+            if newly_purchased:
+                record_price_observations(
+                    self.model._base_manager.using(self.db)
+                    .filter(pk__in=newly_purchased)
+                    .order_by()
+                    .values_list('product_id', 'unit_price', 'quantity'),
+                    using=self.db,
+                )
+        return rows
+
+    update.alters_data = True
+
+    def set_purchased(self, is_purchased: bool = True) -> int:
+        """
+        Mark the items as purchased (or not) with one UPDATE. Items already in
+        that state are left alone, so their ``updated_at`` does not move.
+        """
+        return self.exclude(is_purchased=is_purchased).update(
+            is_purchased=is_purchased, updated_at=timezone.now()
+        )
+
+    set_purchased.alters_data = True
+
+    def delete(self):
+        # Nothing references items and their post_delete receivers ignore
+        # queryset deletes, so the rows go with one DELETE instead of being
+        # loaded and deleted in batches by the collector.
+        if self.query.is_sliced:
+            raise TypeError("Cannot use 'limit' or 'offset' with delete().")
+        with transaction.atomic(using=self.db, savepoint=False):
+            rows = list(
+                self.order_by().values_list(
+                    'pk', 'shopping_list_id', 'shopping_list__user_id'
+                )
+            )
+            deleted = 0
+            if rows:
+                deleted = self.model._base_manager.using(self.db).filter(
+                    pk__in=[pk for pk, _, _ in rows]
+                )._raw_delete(self.db)
+            result = deleted, {self.model._meta.label: deleted}
+            DeletedRecord.objects.using(self.db).bulk_create(
+                DeletedRecord(
+                    user_id=user_id,
+                    model=DeletedRecord.SHOPPING_LIST_ITEM,
+                    object_id=pk,
+                    shopping_list_id=shopping_list_id,
+                )
+                for pk, shopping_list_id, user_id in rows
+            )
+            self._notify({shopping_list_id for _, shopping_list_id, _ in rows})
+        self._result_cache = None
+        return result
+
+    delete.alters_data = True
+    delete.queryset_only = True
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        with transaction.atomic(using=self.db, savepoint=False):
+            created = super().bulk_create(objs, *args, **kwargs)
+            self._notify({obj.shopping_list_id for obj in objs})
+        return created
+
+
 class ShoppingListItem(models.Model):
     shopping_list = models.ForeignKey(
         ShoppingList,
@@ -134,8 +421,27 @@ class ShoppingListItem(models.Model):
     added_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = ShoppingListItemQuerySet.as_manager()
+
     class Meta:
         ordering = ['-updated_at']
+        indexes = [
+            models.Index(
+                fields=['shopping_list', '-updated_at', '-id'],
+                name='item_list_updated_keyset_idx',
+            ),
+            # ?is_purchased=: pending and purchased items of a list, in keyset order.
+            models.Index(
+                fields=['shopping_list', '-updated_at', '-id'],
+                condition=Q(is_purchased=False),
+                name='item_list_pending_idx',
+            ),
+            models.Index(
+                fields=['shopping_list', '-updated_at', '-id'],
+                condition=Q(is_purchased=True),
+                name='item_list_purchased_idx',
+            ),
+        ]
         constraints = [
             models.UniqueConstraint(
                 fields=['shopping_list', 'product'],
@@ -146,6 +452,236 @@ class ShoppingListItem(models.Model):
     def __str__(self):
         return f'{self.quantity} x {self.product.name}'
 
+    def save(self, *args, **kwargs):
+        # post_save applies the totals delta against the locked stored row, so
+        # both writes share one transaction and concurrent edits are not lost.
+        using = kwargs.get('using') or router.db_for_write(type(self), instance=self)
+        with transaction.atomic(using=using):
+            self._stored_state = self._lock_stored_state(using) if self.pk else None
+            super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        using = kwargs.get('using') or router.db_for_write(type(self), instance=self)
+        with transaction.atomic(using=using):
+            self._stored_state = self._lock_stored_state(using)
+            return super().delete(*args, **kwargs)
+
     @property
     def total_price(self) -> Decimal:
         return self.unit_price * self.quantity
+
+    def totals_state(self) -> dict:
+        """Values of the fields that feed the list totals."""
+        return {
+            'shopping_list_id': self.shopping_list_id,
+            'quantity': self.quantity,
+            'unit_price': Decimal(self.unit_price),
+            'is_purchased': self.is_purchased,
+        }
+
+    def _lock_stored_state(self, using) -> Optional[dict]:
+        return (
+            type(self)._base_manager.using(using)
+            .select_for_update()
+            .filter(pk=self.pk)
+            .values('shopping_list_id', 'quantity', 'unit_price', 'is_purchased')
+            .first()
+        )
+
+
+class DeletedRecord(models.Model):
+    """
+    Tombstone left behind when a list or item is deleted so offline clients
+    can learn about deletions through the sync endpoint.
+    """
+    SHOPPING_LIST = 'shopping_list'
+    SHOPPING_LIST_ITEM = 'shopping_list_item'
+    MODEL_CHOICES = [
+        (SHOPPING_LIST, 'Shopping list'),
+        (SHOPPING_LIST_ITEM, 'Shopping list item'),
+    ]
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='deleted_records',
+    )
+    model = models.CharField(max_length=32, choices=MODEL_CHOICES)
+    object_id = models.BigIntegerField()
+    shopping_list_id = models.BigIntegerField(blank=True, null=True)
+    deleted_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ['deleted_at', 'id']
+        indexes = [
+            models.Index(fields=['user', 'deleted_at', 'id'], name='deleted_user_sync_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.model} {self.object_id}'
+
+
+class PriceObservation(models.Model):
+    """
+    Append-only record of the price paid for a product, written when an item
+    is marked as purchased (or its price changes while purchased).
+    """
+    product = models.ForeignKey(
+        Product,
+        on_delete=models.CASCADE,
+        related_name='price_observations',
+    )
+    unit_price = models.DecimalField(max_digits=10, decimal_places=2)
+    quantity = models.PositiveIntegerField(default=1)
+    observed_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ['-observed_at', '-id']
+        indexes = [
+            models.Index(fields=['product', 'observed_at'], name='priceobs_product_time_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.product_id} @ {self.unit_price}'
+
+
+class ProductPriceStats(models.Model):
+    """
+    Per-product price summary kept up to date from ``PriceObservation`` (see
+    tu_canasta.prices), so reads never aggregate the observations.
+    """
+    product = models.OneToOneField(
+        Product,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='price_stats',
+    )
+    last_price = models.DecimalField(max_digits=10, decimal_places=2)
+    last_observed_at = models.DateTimeField()
+    min_price_30d = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True)
+    avg_price_30d = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True)
+    min_price_90d = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True)
+    avg_price_90d = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True)
+    observations_90d = models.PositiveIntegerField(default=0)
+    refreshed_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            # refresh_price_stats: rows not refreshed in the last day.
+            models.Index(fields=['refreshed_at'], name='pricestats_refreshed_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.product_id}: {self.last_price}'
+
+
+class Job(models.Model):
+    """
+    Background work run by ``manage.py run_worker`` (see tu_canasta.jobs).
+    Claimed rows are marked ``running`` rather than kept locked, so a long job
+    holds no transaction; ``heartbeat_at`` lets another worker requeue the
+    jobs of a worker that died.
+    """
+    IMPORT_PRODUCTS = 'import_products'
+    ANALYTICS = 'analytics'
+    REPAIR_LIST_TOTALS = 'repair_list_totals'
+    REFRESH_PRICE_STATS = 'refresh_price_stats'
+    KIND_CHOICES = [
+        (IMPORT_PRODUCTS, 'Import products'),
+        (ANALYTICS, 'Spending analytics'),
+        (REPAIR_LIST_TOTALS, 'Repair list totals'),
+        (REFRESH_PRICE_STATS, 'Refresh price stats'),
+    ]
+
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (SUCCEEDED, 'Succeeded'),
+        (FAILED, 'Failed'),
+    ]
+
+    # Null for jobs enqueued from the command line.
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='jobs',
+        blank=True,
+        null=True,
+    )
+    kind = models.CharField(max_length=32, choices=KIND_CHOICES)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=QUEUED)
+    # Higher runs first.
+    priority = models.SmallIntegerField(default=0)
+    payload = models.JSONField(default=dict, blank=True)
+    # Uploaded file of an import, kept in the default storage (shared by the
+    # web and worker processes) and deleted once the job finishes.
+    upload = models.FileField(upload_to='jobs/', max_length=255, blank=True, editable=False)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=3)
+    run_after = models.DateTimeField(default=timezone.now)
+    progress = models.PositiveIntegerField(default=0)
+    progress_total = models.PositiveIntegerField(blank=True, null=True)
+    result = models.JSONField(blank=True, null=True)
+    error = models.TextField(blank=True)
+    worker = models.CharField(max_length=255, blank=True)
+    heartbeat_at = models.DateTimeField(blank=True, null=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['-created_at', '-id']
+        indexes = [
+            # Workers claim the next due job; only queued rows are indexed.
+            models.Index(
+                fields=['-priority', 'run_after', 'id'],
+                condition=Q(status='queued'),
+                name='job_queue_idx',
+            ),
+            models.Index(fields=['status', 'heartbeat_at'], name='job_heartbeat_idx'),
+            models.Index(fields=['user', '-created_at', '-id'], name='job_user_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.kind} #{self.pk} ({self.status})'
+
+    @property
+    def is_finished(self) -> bool:
+        return self.status in (self.SUCCEEDED, self.FAILED)
+
+
+class IdempotencyKey(models.Model):
+    """
+    Stored response of a write sent with an ``Idempotency-Key`` header,
+    replayed when the client retries it (see tu_canasta.idempotency). Rows
+    are written in the transaction of the write itself, so a committed row
+    always holds a response.
+    """
+    # X-USER-ID of the client; empty for anonymous writes such as sign-ups.
+    scope = models.CharField(max_length=255, blank=True)
+    key = models.CharField(max_length=255)
+    # SHA-256 of the method, path and parsed body.
+    fingerprint = models.CharField(max_length=64)
+    status_code = models.PositiveSmallIntegerField(blank=True, null=True)
+    content_type = models.CharField(max_length=100, blank=True)
+    # zlib-compressed response body.
+    content = models.BinaryField(blank=True, null=True)
+    location = models.CharField(max_length=2048, blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['scope', 'key'], name='unique_idempotency_key'),
+        ]
+        indexes = [
+            models.Index(fields=['expires_at'], name='idempotency_expiry_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.scope or "-"}:{self.key}'
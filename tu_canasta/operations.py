@@ -0,0 +1,38 @@
+"""
+Migration operations that adapt to the database backend.
+"""
+from django.db import migrations
+
+
+class AddIndexConcurrently(migrations.AddIndex):
+    """
+    ``AddIndex`` that uses ``CREATE INDEX CONCURRENTLY`` on PostgreSQL, so
+    building the index does not block writes to a large table, and falls back
+    to a plain ``CREATE INDEX`` elsewhere. Migrations using it must set
+    ``atomic = False``: PostgreSQL refuses concurrent builds in a transaction.
+    """
+
+    atomic = False
+
+    def describe(self):
+        return f'Create index {self.index.name} on model {self.model_name} (concurrently)'
+
+    @staticmethod
+    def _concurrently(schema_editor) -> dict:
+        if schema_editor.connection.vendor != 'postgresql':
+            return {}
+        if schema_editor.connection.in_atomic_block:
+            raise RuntimeError(
+                'AddIndexConcurrently requiere una migración con atomic = False.'
+            )
+        return {'concurrently': True}
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        model = to_state.apps.get_model(app_label, self.model_name)
+        if self.allow_migrate_model(schema_editor.connection.alias, model):
+            schema_editor.add_index(model, self.index, **self._concurrently(schema_editor))
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        model = from_state.apps.get_model(app_label, self.model_name)
+        if self.allow_migrate_model(schema_editor.connection.alias, model):
+            schema_editor.remove_index(model, self.index, **self._concurrently(schema_editor))
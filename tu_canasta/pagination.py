@@ -0,0 +1,251 @@
+import json
+from base64 import b64decode, b64encode
+from collections import OrderedDict, namedtuple
+
+from django.core.exceptions import ValidationError
+from django.db import connections
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, _positive_int
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+Cursor = namedtuple('Cursor', ['position', 'reverse'])
+OrderingField = namedtuple('OrderingField', ['field', 'descending'])
+
+
+class _LinkedPagination(BasePagination):
+    """Shared page size handling and ``{next, previous, results}`` envelope."""
+    page_size_query_param = 'page_size'
+
+    def get_page_size(self, request):
+        if self.page_size_query_param:
+            try:
+                return _positive_int(
+                    request.query_params[self.page_size_query_param],
+                    strict=True,
+                    cutoff=self.max_page_size,
+                )
+            except (KeyError, ValueError):
+                pass
+        return self.page_size
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+class KeysetCursorPagination(_LinkedPagination):
+    """
+    Cursor pagination that seeks on every ordering column plus an ``id``
+    tiebreaker, so any page costs the same as the first one.
+
+    The ordering is taken from the view's ``ordering`` attribute or the model's
+    ``Meta.ordering``. NULLs keep the backend's native placement (largest on
+    PostgreSQL, smallest on SQLite) so plain composite indexes serve the query.
+    """
+    cursor_query_param = 'cursor'
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+    invalid_cursor_message = 'Cursor inválido.'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        page_queryset, cursor = self._page_queryset(queryset, request, view)
+        return self._finish_page(list(page_queryset), cursor)
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """``paginate_queryset`` for async views: the page is one async fetch."""
+        page_queryset, cursor = self._page_queryset(queryset, request, view)
+        return self._finish_page([row async for row in page_queryset], cursor)
+
+    def _page_queryset(self, queryset, request, view):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.ordering = self.get_ordering(queryset, view)
+        self.nulls_largest = connections[queryset.db].features.nulls_order_largest
+        cursor = self.decode_cursor(request)
+        reverse = cursor.reverse if cursor else False
+
+        queryset = queryset.order_by(*(
+            f'-{ordering.field.attname}' if ordering.descending != reverse
+            else ordering.field.attname
+            for ordering in self.ordering
+        ))
+        if cursor is not None:
+            queryset = queryset.filter(self._seek(cursor.position, reverse))
+        return queryset[:self.page_size + 1], cursor
+
+    def _finish_page(self, results, cursor):
+        reverse = cursor.reverse if cursor else False
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if reverse:
+            results.reverse()
+
+        if reverse:
+            self.has_next, self.has_previous = cursor is not None, has_more
+        else:
+            self.has_next, self.has_previous = has_more, cursor is not None
+        self.first_position = self._position(results[0]) if results else None
+        self.last_position = self._position(results[-1]) if results else None
+        if not results and cursor is not None:
+            # An empty page still links back to where the client came from.
+            self.first_position = self.last_position = cursor.position
+        return results
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+    def get_ordering(self, queryset, view):
+        ordering = list(
+            getattr(view, 'ordering', None) or queryset.model._meta.ordering or ()
+        )
+        model_fields = []
+        for name in ordering:
+            descending = name.startswith('-')
+            model_fields.append(
+                OrderingField(queryset.model._meta.get_field(name.lstrip('-')), descending)
+            )
+        pk = queryset.model._meta.pk
+        if all(field.field != pk for field in model_fields):
+            descending = model_fields[-1].descending if model_fields else False
+            model_fields.append(OrderingField(pk, descending))
+        return model_fields
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return self.encode_cursor(Cursor(self.last_position, reverse=False))
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        return self.encode_cursor(Cursor(self.first_position, reverse=True))
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            payload = json.loads(b64decode(encoded.encode('ascii')).decode('utf-8'))
+            position = payload['p']
+            if len(position) != len(self.ordering):
+                raise ValueError
+            values = [
+                None if value is None else ordering.field.to_python(value)
+                for ordering, value in zip(self.ordering, position)
+            ]
+            return Cursor(values, reverse=bool(payload.get('r')))
+        except (TypeError, ValueError, KeyError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, cursor):
+        position = [
+            None if value is None else ordering.field.value_to_string(
+                _ValueHolder(ordering.field, value)
+            )
+            for ordering, value in zip(self.ordering, cursor.position)
+        ]
+        payload = {'p': position}
+        if cursor.reverse:
+            payload['r'] = 1
+        encoded = b64encode(
+            json.dumps(payload, separators=(',', ':')).encode('utf-8')
+        ).decode('ascii')
+        return replace_query_param(
+            remove_query_param(self.base_url, self.cursor_query_param),
+            self.cursor_query_param,
+            encoded,
+        )
+
+    def _position(self, instance):
+        return [ordering.field.value_from_object(instance) for ordering in self.ordering]
+
+    def _seek(self, position, reverse):
+        """
+        Rows strictly after ``position`` in the current direction, expanded as
+        ``(a after x) OR (a = x AND b after y) OR ...``.
+        """
+        condition = None
+        equal_so_far = Q()
+        for ordering, value in zip(self.ordering, position):
+            column = ordering.field.attname
+            descending = ordering.descending != reverse
+            # NULLs sit at the end of the walk when the direction runs toward
+            # the side the backend sorts them on.
+            nulls_at_end = descending != self.nulls_largest
+            if value is None:
+                after = None if nulls_at_end else Q(**{f'{column}__isnull': False})
+                equal = Q(**{f'{column}__isnull': True})
+            else:
+                lookup = 'lt' if descending else 'gt'
+                after = Q(**{f'{column}__{lookup}': value})
+                if ordering.field.null and nulls_at_end:
+                    after |= Q(**{f'{column}__isnull': True})
+                equal = Q(**{column: value})
+            if after is not None:
+                branch = equal_so_far & after
+                condition = branch if condition is None else condition | branch
+            equal_so_far &= equal
+        return condition if condition is not None else Q(pk__in=[])
+
+
+class _ValueHolder:
+    """Minimal object so Field.value_to_string can serialize a bare value."""
+
+    def __init__(self, field, value):
+        setattr(self, field.attname, value)
+
+
+class RankedPagination(_LinkedPagination):
+    """
+    Page-number pagination for ranked search results, which have no stable
+    keyset to seek on. Fetches one extra row to detect the next page instead
+    of running a COUNT over every match.
+    """
+    page_query_param = 'page'
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    max_page = 50
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        try:
+            self.page = _positive_int(
+                request.query_params.get(self.page_query_param, 1),
+                strict=True,
+                cutoff=self.max_page,
+            )
+        except ValueError:
+            raise NotFound('Página inválida.')
+        offset = (self.page - 1) * self.page_size
+        results = list(queryset[offset:offset + self.page_size + 1])
+        self.has_next = len(results) > self.page_size and self.page < self.max_page
+        return results[:self.page_size]
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self._page_link(self.page + 1) if self.has_next else None),
+            ('previous', self._page_link(self.page - 1) if self.page > 1 else None),
+            ('results', data),
+        ]))
+
+    def _page_link(self, page):
+        if page == 1:
+            return remove_query_param(self.base_url, self.page_query_param)
+        return replace_query_param(self.base_url, self.page_query_param, page)
@@ -0,0 +1,61 @@
+"""
+Password hashing for sync and async callers.
+
+A sync caller hashes on its own thread: handing one hash to another thread
+and blocking on it would add a hop and no concurrency. Async callers use
+the ``a`` variants, which run the hash in a bounded thread pool
+(``PASSWORD_HASHING_WORKERS``) so the ASGI event loop keeps serving other
+requests; the hashers release the GIL, so a burst of signups or logins
+takes at most that many cores. ``hash_passwords`` spreads a bulk import
+over the same pool.
+"""
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.hashers import check_password, make_password
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _hashing_pool() -> ThreadPoolExecutor:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadPoolExecutor(
+                    max_workers=settings.PASSWORD_HASHING_WORKERS,
+                    thread_name_prefix='password-hashing',
+                )
+    return _pool
+
+
+def hash_password(raw_password: str) -> str:
+    return make_password(raw_password)
+
+
+async def ahash_password(raw_password: str) -> str:
+    return await asyncio.wrap_future(_hashing_pool().submit(make_password, raw_password))
+
+
+def hash_passwords(raw_passwords) -> list:
+    """Hash many passwords in parallel, preserving their order."""
+    return list(_hashing_pool().map(make_password, raw_passwords))
+
+
+def verify_password(raw_password: str, encoded: str) -> tuple:
+    """``(valid, outdated)``: outdated hashes should be replaced."""
+    outdated = []
+    valid = check_password(raw_password, encoded, outdated.append)
+    return valid, bool(outdated)
+
+
+async def averify_password(raw_password: str, encoded: str) -> tuple:
+    """Same as ``verify_password`` for async callers."""
+    outdated = []
+    valid = await asyncio.wrap_future(
+        _hashing_pool().submit(check_password, raw_password, encoded, outdated.append)
+    )
+    return valid, bool(outdated)
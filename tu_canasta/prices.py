@@ -0,0 +1,147 @@
+"""
+Price history.
+
+Purchases append ``PriceObservation`` rows and refresh the
+``ProductPriceStats`` of the products involved. A refresh reads only the
+observations inside the longest window, through the (product, observed_at)
+index, and writes every touched product with one upsert, so its cost does
+not grow with the size of the items table.
+"""
+from datetime import timedelta
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.db import transaction
+from django.db.models import Avg, Count, Min, OuterRef, Q, Subquery
+from django.utils import timezone
+
+from .caching import PRODUCTS_SCOPE, bump_generation
+from .models import PriceObservation, ProductPriceStats
+
+WINDOWS = (30, 90)
+STALE_AFTER = timedelta(days=1)
+
+_CENT = Decimal('0.01')
+_WINDOW_PRICE_FIELDS = [
+    f'{name}_{days}d' for days in WINDOWS for name in ('min_price', 'avg_price')
+]
+
+
+def _cents(value):
+    return None if value is None else Decimal(value).quantize(_CENT, rounding=ROUND_HALF_UP)
+
+
+def record_price_observations(observations, using=None) -> None:
+    """
+    Store ``(product_id, unit_price, quantity)`` observations and refresh the
+    statistics of their products.
+    """
+    now = timezone.now()
+    rows = [
+        PriceObservation(
+            product_id=product_id, unit_price=unit_price, quantity=quantity, observed_at=now
+        )
+        for product_id, unit_price, quantity in observations
+    ]
+    if not rows:
+        return
+    PriceObservation.objects.using(using).bulk_create(rows)
+    refresh_price_stats({row.product_id for row in rows}, using=using, now=now)
+
+
+def refresh_price_stats(product_ids, using=None, now=None) -> int:
+    """
+    Recompute the statistics of ``product_ids`` from their observations.
+    Returns the number of products with observations in the window.
+    """
+    product_ids = set(product_ids)
+    if not product_ids:
+        return 0
+    now = now or timezone.now()
+    since = {days: now - timedelta(days=days) for days in WINDOWS}
+    latest = PriceObservation.objects.using(using).filter(
+        product=OuterRef('product_id')
+    ).order_by('-observed_at', '-pk')
+    aggregates = {'observations_90d': Count('pk')}
+    for days in WINDOWS:
+        in_window = Q(observed_at__gte=since[days])
+        aggregates[f'min_price_{days}d'] = Min('unit_price', filter=in_window)
+        aggregates[f'avg_price_{days}d'] = Avg('unit_price', filter=in_window)
+    rows = (
+        PriceObservation.objects.using(using)
+        .filter(product_id__in=product_ids, observed_at__gte=since[max(WINDOWS)])
+        .values('product_id')
+        .annotate(
+            last_price=Subquery(latest.values('unit_price')[:1]),
+            last_observed_at=Subquery(latest.values('observed_at')[:1]),
+            **aggregates,
+        )
+        .order_by()
+    )
+    stats = [
+        ProductPriceStats(
+            product_id=row['product_id'],
+            last_price=_cents(row['last_price']),
+            last_observed_at=row['last_observed_at'],
+            refreshed_at=now,
+            observations_90d=row['observations_90d'],
+            **{field: _cents(row[field]) for field in _WINDOW_PRICE_FIELDS},
+        )
+        for row in rows
+    ]
+    ProductPriceStats.objects.using(using).bulk_create(
+        stats,
+        update_conflicts=True,
+        unique_fields=['product'],
+        update_fields=[
+            'last_price', 'last_observed_at', 'refreshed_at', 'observations_90d',
+            *_WINDOW_PRICE_FIELDS,
+        ],
+    )
+    # Products whose observations all left the window keep their last price.
+    emptied = ProductPriceStats.objects.using(using).filter(
+        product_id__in=product_ids - {row.product_id for row in stats}
+    ).update(
+        refreshed_at=now,
+        observations_90d=0,
+        **{field: None for field in _WINDOW_PRICE_FIELDS},
+    )
+    if stats or emptied:
+        # Products embed their stats; after commit so no reader caches the old ones.
+        transaction.on_commit(lambda: bump_generation(PRODUCTS_SCOPE), using=using)
+    return len(stats)
+
+
+def stale_price_stats(now=None):
+    """Product ids whose window statistics were last refreshed a day ago or more."""
+    now = now or timezone.now()
+    return ProductPriceStats.objects.filter(
+        refreshed_at__lt=now - STALE_AFTER
+    ).values_list('product_id', flat=True)
+
+
+def refresh_stale_price_stats(all: bool = False, batch_size: int = 500, progress=None) -> int:
+    """
+    Refresh the stale statistics (or, with ``all``, those of every product
+    with observations) in product id batches. Returns how many products were
+    refreshed; ``progress`` gets the running count after each batch.
+    """
+    if all:
+        product_ids = (
+            PriceObservation.objects.order_by('product_id')
+            .values_list('product_id', flat=True)
+            .distinct()
+        )
+    else:
+        product_ids = stale_price_stats().order_by('product_id')
+    refreshed = 0
+    last_id = 0
+    while True:
+        batch = list(product_ids.filter(product_id__gt=last_id)[:batch_size])
+        if not batch:
+            break
+        last_id = batch[-1]
+        refresh_price_stats(batch)
+        refreshed += len(batch)
+        if progress is not None:
+            progress(refreshed)
+    return refreshed
@@ -0,0 +1,90 @@
+"""
+Read-replica routing.
+
+Writes and anything without an explicit decision go to ``default``. Reads go
+to the replica alias only while ``read_from_replica()`` is active, which
+``ReplicaRoutingMiddleware`` does for the safe methods of the API views. A
+user who just wrote is pinned to the primary for ``STICKY_SECONDS`` so they
+always read their own writes, whatever the replication lag.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS
+
+DEFAULTS = {
+    'ALIAS': 'replica',
+    'STICKY_SECONDS': 5,
+    'CACHE': 'default',
+}
+
+_read_alias = ContextVar('tu_canasta_read_alias', default=None)
+
+
+def replica_options() -> dict:
+    return {**DEFAULTS, **getattr(settings, 'REPLICA_ROUTING', {})}
+
+
+def replica_alias():
+    """The configured replica alias, or None when there is no replica."""
+    alias = replica_options()['ALIAS']
+    return alias if alias in settings.DATABASES else None
+
+
+@contextmanager
+def read_from_replica(enabled: bool = True):
+    """
+    Route the reads of the enclosed block to the replica, if there is one.
+    With ``enabled=False`` reads start on the primary, and
+    ``route_reads_to_replica()`` can switch them within the block.
+    """
+    token = _read_alias.set(replica_alias() if enabled else None)
+    try:
+        yield
+    finally:
+        _read_alias.reset(token)
+
+
+def route_reads_to_replica() -> None:
+    _read_alias.set(replica_alias())
+
+
+def _pin_key(user_identifier) -> str:
+    return f'tu_canasta:replica-pin:{user_identifier}'
+
+
+def pin_to_primary(user_identifier) -> None:
+    """Send this user's reads to the primary for the next STICKY_SECONDS."""
+    options = replica_options()
+    caches[options['CACHE']].set(_pin_key(user_identifier), True, options['STICKY_SECONDS'])
+
+
+async def apin_to_primary(user_identifier) -> None:
+    options = replica_options()
+    await caches[options['CACHE']].aset(
+        _pin_key(user_identifier), True, options['STICKY_SECONDS']
+    )
+
+
+def is_pinned_to_primary(user_identifier) -> bool:
+    return bool(caches[replica_options()['CACHE']].get(_pin_key(user_identifier)))
+
+
+async def ais_pinned_to_primary(user_identifier) -> bool:
+    return bool(await caches[replica_options()['CACHE']].aget(_pin_key(user_identifier)))
+
+
+class PrimaryReplicaRouter:
+    """Primary for writes; the replica for reads inside ``read_from_replica``."""
+
+    def db_for_read(self, model, **hints):
+        return _read_alias.get()
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replica holds the same rows as the primary.
+        return True
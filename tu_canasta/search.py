@@ -0,0 +1,161 @@
+"""
+Product catalogue search.
+
+SQLite uses an external-content FTS5 table kept in sync by triggers
+(migration 0007); PostgreSQL uses a ``simple`` tsvector GIN index plus
+pg_trgm indexes on ``name`` and ``sku`` for fuzzy and prefix matching.
+"""
+import re
+
+from django.db import connections
+from django.db.models import FloatField
+from django.db.models.expressions import RawSQL
+
+from .models import Product
+
+FTS_TABLE = 'tu_canasta_product_fts'
+# bm25 column weights for (sku, name, description); lower scores rank first.
+FTS_RANK = f'bm25({FTS_TABLE}, 10.0, 5.0, 1.0)'
+PG_DOCUMENT = (
+    "to_tsvector('simple', coalesce(tu_canasta_product.sku, '') || ' ' || "
+    "coalesce(tu_canasta_product.name, '') || ' ' || "
+    "coalesce(tu_canasta_product.description, ''))"
+)
+# Autocomplete ranks only the first matches found in the index, which keeps
+# short, very common prefixes as fast as rare ones.
+AUTOCOMPLETE_CANDIDATES = 200
+_TOKEN = re.compile(r'\w+', re.UNICODE)
+
+
+def _tokens(term: str):
+    return _TOKEN.findall(term.lower())[:8]
+
+
+def _fts5_query(tokens, columns=None) -> str:
+    # Quote every token so user input can never inject FTS5 operators.
+    query = ' '.join(f'"{token}"*' for token in tokens)
+    if columns:
+        return f'{{{" ".join(columns)}}} : ({query})'
+    return query
+
+
+def _pg_tsquery(tokens) -> str:
+    return ' & '.join(f'{token}:*' for token in tokens)
+
+
+def _fetch_in_order(queryset, ids):
+    products = queryset.in_bulk(ids)
+    return [products[pk] for pk in ids if pk in products]
+
+
+class ProductSearch:
+    """
+    Ranked search results for ``term`` over sku, name and description.
+
+    Supports slicing only, so it can be handed to a paginator: on SQLite each
+    slice ranks the matching ids inside the FTS index and then loads just
+    that page of products.
+    """
+
+    def __init__(self, term: str, queryset=None):
+        self.tokens = _tokens(term)
+        self.queryset = Product.objects.all() if queryset is None else queryset
+        self.vendor = connections[self.queryset.db].vendor
+
+    def __getitem__(self, item):
+        if not isinstance(item, slice) or item.step is not None:
+            raise TypeError('ProductSearch only supports slicing.')
+        offset = item.start or 0
+        limit = None if item.stop is None else max(item.stop - offset, 0)
+        if not self.tokens or limit == 0:
+            return []
+        if self.vendor == 'sqlite':
+            return self._sqlite_page(offset, limit)
+        return list(self._ranked_queryset()[offset:None if limit is None else offset + limit])
+
+    def __iter__(self):
+        return iter(self[0:None])
+
+    def _sqlite_page(self, offset, limit):
+        with connections[self.queryset.db].cursor() as cursor:
+            cursor.execute(
+                f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s '
+                f'ORDER BY {FTS_RANK} LIMIT %s OFFSET %s',
+                [_fts5_query(self.tokens), -1 if limit is None else limit, offset],
+            )
+            ids = [row[0] for row in cursor.fetchall()]
+        return _fetch_in_order(self.queryset, ids)
+
+    def _ranked_queryset(self):
+        if self.vendor == 'postgresql':
+            tsquery = _pg_tsquery(self.tokens)
+            phrase = ' '.join(self.tokens)
+            return self.queryset.annotate(
+                search_rank=RawSQL(
+                    f"ts_rank({PG_DOCUMENT}, to_tsquery('simple', %s)) "
+                    "+ similarity(tu_canasta_product.name, %s)",
+                    [tsquery, phrase],
+                    output_field=FloatField(),
+                )
+            ).extra(
+                where=[
+                    f"({PG_DOCUMENT} @@ to_tsquery('simple', %s) "
+                    "OR tu_canasta_product.name %% %s)"
+                ],
+                params=[tsquery, phrase],
+            ).order_by('-search_rank', 'name', 'pk')
+        query = self.queryset
+        for token in self.tokens:
+            query = query.filter(name__icontains=token)
+        return query.order_by('name', 'pk')
+
+
+def autocomplete_products(term: str, limit: int = 10):
+    """
+    Typeahead suggestions as ``(id, sku, name)`` rows whose name or sku words
+    start with ``term``. Only ``limit`` product rows are ever read.
+    """
+    tokens = _tokens(term)
+    if not tokens or len(''.join(tokens)) < 2:
+        return []
+    connection = connections[Product.objects.db]
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT id FROM ('
+                f'SELECT rowid AS id, {FTS_RANK} AS score FROM {FTS_TABLE} '
+                f'WHERE {FTS_TABLE} MATCH %s LIMIT %s'
+                f') ORDER BY score LIMIT %s',
+                [
+                    _fts5_query(tokens, columns=('sku', 'name')),
+                    AUTOCOMPLETE_CANDIDATES,
+                    limit,
+                ],
+            )
+            ids = [row[0] for row in cursor.fetchall()]
+        rows = {
+            row[0]: row
+            for row in Product.objects.filter(pk__in=ids).values_list('id', 'sku', 'name')
+        }
+        return [rows[pk] for pk in ids if pk in rows]
+    return list(_prefix_matches(' '.join(tokens), connection)[:limit])
+
+
+def _prefix_matches(phrase: str, connection):
+    """Products whose name or sku starts with ``phrase``, best matches first."""
+    if connection.vendor == 'postgresql':
+        # A plain ILIKE, which the pg_trgm GIN indexes on name and sku serve;
+        # the ORM's istartswith compiles to UPPER(...) LIKE, which they don't.
+        pattern = re.sub(r'([\\%_])', r'\\\1', phrase) + '%'
+        return Product.objects.extra(
+            where=['(tu_canasta_product.name ILIKE %s OR tu_canasta_product.sku ILIKE %s)'],
+            params=[pattern, pattern],
+        ).annotate(
+            similarity=RawSQL(
+                'similarity(tu_canasta_product.name, %s)', [phrase], output_field=FloatField()
+            )
+        ).order_by('-similarity', 'name').values_list('id', 'sku', 'name')
+    queryset = Product.objects.filter(name__istartswith=phrase) | Product.objects.filter(
+        sku__istartswith=phrase
+    )
+    return queryset.order_by('name').values_list('id', 'sku', 'name')
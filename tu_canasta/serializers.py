@@ -1,10 +1,225 @@
-from django.contrib.auth.hashers import make_password
-from rest_framework import serializers
+import inspect
+import time
+from decimal import Decimal
 
-from .models import Product, ShoppingList, ShoppingListItem, User
+from django.conf import settings
+from rest_framework import ISO_8601, serializers
+from rest_framework.fields import SkipField
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.relations import PKOnlyObject
+from rest_framework.settings import api_settings
 
+from .middleware import current_metrics
+from .models import (
+    DeletedRecord,
+    Job,
+    Product,
+    ProductPriceStats,
+    ShoppingList,
+    ShoppingListItem,
+    User,
+)
+from .passwords import hash_password
 
-class UserSerializer(serializers.ModelSerializer):
+
+def _split_param(value):
+    return {part.strip() for part in value.split(',') if part.strip()}
+
+
+class SparseFieldset:
+    """
+    Parsed ``?fields=`` and ``?expand=`` query parameters of a read request.
+
+    ``fields`` limits the fields returned (``fields=id,title,items.quantity``).
+    ``expand`` names the nested relations to embed with dotted paths
+    (``expand=items.product_detail``); when it is absent every relation keeps
+    its default, fully expanded representation.
+    """
+
+    def __init__(self, request=None):
+        params = getattr(request, 'query_params', {})
+        if request is None or request.method not in SAFE_METHODS:
+            params = {}
+        self.fields = _split_param(params['fields']) if 'fields' in params else None
+        expand = _split_param(params['expand']) if 'expand' in params else None
+        if expand is not None:
+            # Expanding items.product_detail implies expanding items.
+            for path in list(expand):
+                parts = path.split('.')
+                expand.update('.'.join(parts[:size]) for size in range(1, len(parts)))
+        self.expand = expand
+
+    def fields_for(self, prefix):
+        """Requested field names for the serializer at ``prefix`` (None: all)."""
+        if self.fields is None:
+            return None
+        if not prefix:
+            return {field.split('.', 1)[0] for field in self.fields}
+        names = {
+            field[len(prefix) + 1:].split('.', 1)[0]
+            for field in self.fields
+            if field.startswith(f'{prefix}.')
+        }
+        return names or None
+
+    def is_expanded(self, path):
+        parent = path.rpartition('.')[0]
+        requested = self.fields_for(parent)
+        if requested is not None and path.rpartition('.')[2] not in requested:
+            return False
+        return self.expand is None or path in self.expand
+
+
+class SparseFieldsetMixin:
+    """Drops the fields and nested relations a read request did not ask for."""
+    expandable_fields = ()
+
+    def _sparse_path(self):
+        names, node = [], self
+        while node is not None:
+            if node.field_name:
+                names.append(node.field_name)
+            node = node.parent
+        return '.'.join(reversed(names))
+
+    def get_fields(self):
+        fields = super().get_fields()
+        fieldset = SparseFieldset(self.context.get('request'))
+        prefix = self._sparse_path()
+        requested = fieldset.fields_for(prefix)
+        for name in list(fields):
+            path = f'{prefix}.{name}' if prefix else name
+            if requested is not None and name not in requested:
+                fields.pop(name)
+            elif name in self.expandable_fields and not fieldset.is_expanded(path):
+                fields.pop(name)
+        return fields
+
+
+class TimedSerializerMixin:
+    """
+    Adds the time spent representing top-level instances to the request
+    metrics; nested serializers are already inside their parent's time.
+    """
+
+    def to_representation(self, instance):
+        metrics = current_metrics()
+        parent = self.parent
+        if metrics is None or not (
+            parent is None
+            or (isinstance(parent, serializers.ListSerializer) and parent.parent is None)
+        ):
+            return super().to_representation(instance)
+        started = time.perf_counter()
+        try:
+            return super().to_representation(instance)
+        finally:
+            metrics.add('serialize', time.perf_counter() - started)
+
+
+def _datetime_converter(field):
+    tz = field.timezone if hasattr(field, 'timezone') else field.default_timezone()
+    if tz is None:
+        return None
+
+    def convert(value):
+        if value.utcoffset() is None:
+            return field.to_representation(value)
+        value = value.astimezone(tz).isoformat()
+        return value[:-6] + 'Z' if value.endswith('+00:00') else value
+    return convert
+
+
+def _decimal_converter(field):
+    coerce_to_string = getattr(field, 'coerce_to_string', api_settings.COERCE_DECIMAL_TO_STRING)
+    if not coerce_to_string or field.localize or field.normalize_output:
+        return None
+    exponent = -field.decimal_places if field.decimal_places is not None else None
+
+    def convert(value):
+        # Stored values already carry the field's decimal places.
+        if isinstance(value, Decimal) and value.as_tuple().exponent == exponent:
+            return f'{value:f}'
+        return field.to_representation(value)
+    return convert
+
+
+def _iso_format(field, default_format):
+    output_format = getattr(field, 'format', default_format)
+    return isinstance(output_format, str) and output_format.lower() == ISO_8601
+
+
+def _field_converter(field):
+    """A plain conversion equivalent to ``field.to_representation``, or None."""
+    kind = type(field)
+    if kind in (serializers.IntegerField, serializers.CharField, serializers.EmailField):
+        return int if kind is serializers.IntegerField else str
+    if kind is serializers.BooleanField:
+        return bool
+    if kind is serializers.DecimalField:
+        return _decimal_converter(field)
+    if kind is serializers.DateTimeField and _iso_format(field, api_settings.DATETIME_FORMAT):
+        return _datetime_converter(field)
+    if kind is serializers.DateField and _iso_format(field, api_settings.DATE_FORMAT):
+        return lambda value: value.isoformat()
+    if kind in (serializers.ReadOnlyField, serializers.PrimaryKeyRelatedField):
+        if getattr(field, 'pk_field', None) is None:
+            return lambda value: value
+    return None
+
+
+class FastRepresentationMixin:
+    """
+    Serializes plain model attributes without DRF's per-field machinery.
+
+    Integers, strings, booleans, dates, datetimes, decimals and primary keys
+    are read straight from the instance and converted by functions built
+    once per serializer; nested serializers and any other field go through
+    DRF as usual. The output is identical. ``FAST_READ_SERIALIZERS = False``
+    restores DRF's ``to_representation``.
+    """
+
+    def to_representation(self, instance):
+        plan = self.__dict__.get('_representation_plan')
+        if plan is None:
+            if not getattr(settings, 'FAST_READ_SERIALIZERS', True):
+                return super().to_representation(instance)
+            plan = self._representation_plan = self._compile_representation()
+        ret = {}
+        for name, attname, convert, field in plan:
+            if convert is not None:
+                value = getattr(instance, attname)
+                ret[name] = None if value is None else convert(value)
+                continue
+            try:
+                attribute = field.get_attribute(instance)
+            except SkipField:
+                continue
+            check_for_none = attribute.pk if isinstance(attribute, PKOnlyObject) else attribute
+            ret[name] = None if check_for_none is None else field.to_representation(attribute)
+        return ret
+
+    def _compile_representation(self):
+        model = self.Meta.model
+        plan = []
+        for field in self._readable_fields:
+            attname = field.source
+            convert = None
+            plain = len(field.source_attrs) == 1 and not inspect.isfunction(
+                getattr(model, attname, None)
+            )
+            if plain:
+                convert = _field_converter(field)
+            if convert is not None and isinstance(field, serializers.PrimaryKeyRelatedField):
+                attname = model._meta.get_field(attname).attname
+            plan.append((field.field_name, attname, convert, field))
+        return plan
+
+
+class UserSerializer(
+    TimedSerializerMixin, FastRepresentationMixin, SparseFieldsetMixin,
+    serializers.ModelSerializer,
+):
     password = serializers.CharField(write_only=True, required=True)
 
     class Meta:
@@ -22,19 +237,41 @@ class UserSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'created_at', 'updated_at']
 
     def create(self, validated_data):
-        validated_data['password'] = make_password(validated_data['password'])
+        validated_data['password'] = hash_password(validated_data['password'])
         return super().create(validated_data)
 
     def update(self, instance, validated_data):
         password = validated_data.get('password')
         if password:
-            validated_data['password'] = make_password(password)
+            validated_data['password'] = hash_password(password)
         else:
             validated_data.pop('password', None)
         return super().update(instance, validated_data)
 
 
-class ProductSerializer(serializers.ModelSerializer):
+class ProductPriceStatsSerializer(FastRepresentationMixin, serializers.ModelSerializer):
+    class Meta:
+        model = ProductPriceStats
+        fields = [
+            'last_price',
+            'last_observed_at',
+            'min_price_30d',
+            'avg_price_30d',
+            'min_price_90d',
+            'avg_price_90d',
+            'observations_90d',
+        ]
+        read_only_fields = fields
+
+
+class ProductSerializer(
+    TimedSerializerMixin, FastRepresentationMixin, SparseFieldsetMixin,
+    serializers.ModelSerializer,
+):
+    expandable_fields = ('price_stats',)
+
+    price_stats = ProductPriceStatsSerializer(read_only=True, allow_null=True)
+
     class Meta:
         model = Product
         fields = [
@@ -42,17 +279,27 @@ class ProductSerializer(serializers.ModelSerializer):
             'sku',
             'name',
             'description',
+            'price_stats',
             'created_at',
             'updated_at',
         ]
-        read_only_fields = ['id', 'created_at', 'updated_at']
+        read_only_fields = ['id', 'price_stats', 'created_at', 'updated_at']
 
 
-class ShoppingListItemSerializer(serializers.ModelSerializer):
+class ShoppingListItemSerializer(
+    TimedSerializerMixin, FastRepresentationMixin, SparseFieldsetMixin,
+    serializers.ModelSerializer,
+):
+    expandable_fields = ('product_detail',)
+
     shopping_list = serializers.PrimaryKeyRelatedField(
         queryset=ShoppingList.objects.none()
     )
-    product = serializers.PrimaryKeyRelatedField(queryset=Product.objects.all())
+    # Stats come with the product: product_detail embeds them and new items
+    # take their default unit_price from them.
+    product = serializers.PrimaryKeyRelatedField(
+        queryset=Product.objects.select_related('price_stats')
+    )
     product_detail = ProductSerializer(source='product', read_only=True)
     total_price = serializers.DecimalField(max_digits=12, decimal_places=2, read_only=True)
 
@@ -94,8 +341,40 @@ class ShoppingListItemSerializer(serializers.ModelSerializer):
             )
         return shopping_list
 
+    def create(self, validated_data):
+        if 'unit_price' not in validated_data:
+            # Pre-fill with the last price paid for the product, if any.
+            stats = getattr(validated_data['product'], 'price_stats', None)
+            if stats is not None:
+                validated_data['unit_price'] = stats.last_price
+        return super().create(validated_data)
+
+
+class ShoppingListItemEventSerializer(FastRepresentationMixin, serializers.ModelSerializer):
+    """Flat item sent in list events: no nested product, so no queries."""
+    total_price = serializers.DecimalField(max_digits=12, decimal_places=2, read_only=True)
+
+    class Meta:
+        model = ShoppingListItem
+        fields = [
+            'id',
+            'shopping_list',
+            'product',
+            'quantity',
+            'unit_price',
+            'is_purchased',
+            'total_price',
+            'updated_at',
+        ]
+        read_only_fields = fields
+
+
+class ShoppingListSerializer(
+    TimedSerializerMixin, FastRepresentationMixin, SparseFieldsetMixin,
+    serializers.ModelSerializer,
+):
+    expandable_fields = ('items',)
 
-class ShoppingListSerializer(serializers.ModelSerializer):
     user = serializers.PrimaryKeyRelatedField(read_only=True)
     items = ShoppingListItemSerializer(many=True, read_only=True)
     total_cost = serializers.DecimalField(max_digits=12, decimal_places=2, read_only=True)
@@ -118,6 +397,7 @@ class ShoppingListSerializer(serializers.ModelSerializer):
             'title',
             'target_date',
             'budget',
+            'is_template',
             'items',
             'total_items',
             'purchased_items',
@@ -141,3 +421,210 @@ class ShoppingListSerializer(serializers.ModelSerializer):
             'created_at',
             'updated_at',
         ]
+
+
+class ShoppingListSummarySerializer(ShoppingListSerializer):
+    """List metadata and totals, without the nested items."""
+
+    class Meta(ShoppingListSerializer.Meta):
+        fields = [
+            field for field in ShoppingListSerializer.Meta.fields if field != 'items'
+        ]
+
+
+class DeletedRecordSerializer(
+    TimedSerializerMixin, FastRepresentationMixin, serializers.ModelSerializer
+):
+    id = serializers.IntegerField(source='object_id')
+
+    class Meta:
+        model = DeletedRecord
+        fields = ['model', 'id', 'shopping_list_id', 'deleted_at']
+
+
+class JobSerializer(TimedSerializerMixin, FastRepresentationMixin, serializers.ModelSerializer):
+
+    class Meta:
+        model = Job
+        fields = [
+            'id',
+            'kind',
+            'status',
+            'priority',
+            'attempts',
+            'max_attempts',
+            'progress',
+            'progress_total',
+            'result',
+            'error',
+            'run_after',
+            'started_at',
+            'finished_at',
+            'created_at',
+            'updated_at',
+        ]
+        read_only_fields = fields
+
+
+class JobCreateSerializer(serializers.Serializer):
+    """
+    A job to enqueue. ``import_products`` takes the uploaded ``file`` (and
+    optionally ``file_format``) and ``analytics`` takes ``year`` and
+    ``products``. ``refresh_price_stats`` only refreshes stale stats; the
+    catalogue-wide rebuild is left to ``manage.py refresh_price_stats --all``.
+    """
+    max_file_size = 50 * 1024 * 1024
+
+    kind = serializers.ChoiceField(choices=Job.KIND_CHOICES)
+    priority = serializers.IntegerField(min_value=-100, max_value=100, default=0)
+    file = serializers.FileField(required=False)
+    file_format = serializers.CharField(required=False)
+    year = serializers.IntegerField(required=False, allow_null=True, default=None)
+    products = serializers.IntegerField(min_value=0, max_value=50, default=10)
+
+    def validate(self, attrs):
+        kind = attrs['kind']
+        validated = {'kind': kind, 'priority': attrs['priority'], 'payload': {}}
+        if kind == Job.IMPORT_PRODUCTS:
+            upload = attrs.get('file')
+            if upload is None:
+                raise serializers.ValidationError({'file': ['Adjunta un archivo CSV o NDJSON.']})
+            if upload.size > self.max_file_size:
+                raise serializers.ValidationError(
+                    {'file': [f'El archivo supera el máximo de {self.max_file_size} bytes.']}
+                )
+            from .catalog import detect_format  # catalog imports this module
+
+            try:
+                file_format = detect_format(upload.name, attrs.get('file_format'))
+            except ValueError as exc:
+                raise serializers.ValidationError({'file_format': [str(exc)]})
+            validated['payload'] = {'file_format': file_format, 'filename': upload.name}
+            # Copied to storage in chunks when the job is saved.
+            validated['upload'] = upload
+        elif kind == Job.ANALYTICS:
+            validated['payload'] = {'year': attrs['year'], 'products': attrs['products']}
+        return validated
+
+
+class ShoppingListDuplicateSerializer(serializers.Serializer):
+    """Options of the duplicate action; the copy keeps the source budget."""
+    title = serializers.CharField(max_length=255, required=False)
+    target_date = serializers.DateField(required=False, allow_null=True, default=None)
+    is_template = serializers.BooleanField(default=False)
+    reset_purchased = serializers.BooleanField(default=True)
+    refresh_prices = serializers.BooleanField(default=False)
+
+
+class ShoppingListMarkPurchasedSerializer(serializers.Serializer):
+    """Items to mark as purchased; every item of the list without ``ids``."""
+    max_ids = 500
+
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        required=False,
+        allow_empty=False,
+        max_length=max_ids,
+    )
+
+
+class LoginSerializer(serializers.Serializer):
+    email = serializers.EmailField()
+    password = serializers.CharField(trim_whitespace=False)
+
+
+class UserImportRowSerializer(serializers.Serializer):
+    """One user to import; email uniqueness is checked per chunk."""
+    first_name = serializers.CharField(max_length=150)
+    last_name = serializers.CharField(max_length=150, allow_blank=True, default='')
+    email = serializers.EmailField()
+    password = serializers.CharField(trim_whitespace=False)
+
+
+class ProductImportRowSerializer(serializers.Serializer):
+    """One catalogue row; the ``sku`` uniqueness is resolved by the upsert."""
+    sku = serializers.CharField(max_length=50)
+    name = serializers.CharField(max_length=255)
+    description = serializers.CharField(allow_blank=True, required=False, default='')
+
+
+class BulkItemUpsertSerializer(serializers.Serializer):
+    """
+    Fields left out keep their value on an existing item. New items default
+    to quantity 1, not purchased, and the product's last price (0 without
+    history).
+    """
+    shopping_list = serializers.IntegerField(min_value=1)
+    product = serializers.IntegerField(min_value=1)
+    quantity = serializers.IntegerField(min_value=1, required=False)
+    unit_price = serializers.DecimalField(
+        max_digits=10, decimal_places=2, min_value=0, required=False
+    )
+    is_purchased = serializers.BooleanField(required=False)
+
+
+class BulkItemToggleSerializer(serializers.Serializer):
+    id = serializers.IntegerField(min_value=1)
+    is_purchased = serializers.BooleanField()
+
+
+class ShoppingListItemBulkSerializer(serializers.Serializer):
+    """
+    Envelope for the bulk item endpoint. Rows are validated one by one later
+    so a bad row does not reject the whole batch.
+    """
+    max_rows = 500
+
+    upsert = serializers.ListField(child=serializers.DictField(), required=False)
+    toggle = serializers.ListField(child=serializers.DictField(), required=False)
+    delete = serializers.ListField(
+        child=serializers.IntegerField(min_value=1), required=False
+    )
+
+    def validate(self, attrs):
+        total = sum(len(attrs.get(key, [])) for key in ('upsert', 'toggle', 'delete'))
+        if not total:
+            raise serializers.ValidationError('El lote está vacío.')
+        if total > self.max_rows:
+            raise serializers.ValidationError(
+                f'El lote admite como máximo {self.max_rows} operaciones.'
+            )
+        return attrs
+
+
+class AnalyticsMonthSerializer(serializers.Serializer):
+    month = serializers.DateField(format='%Y-%m', allow_null=True)
+    lists = serializers.IntegerField()
+    budgeted_lists = serializers.IntegerField()
+    within_budget = serializers.IntegerField()
+    budget_total = serializers.DecimalField(max_digits=14, decimal_places=2)
+    budgeted_cost = serializers.DecimalField(max_digits=14, decimal_places=2)
+    planned = serializers.DecimalField(max_digits=14, decimal_places=2)
+    spent = serializers.DecimalField(max_digits=14, decimal_places=2)
+
+
+class AnalyticsBudgetSerializer(serializers.Serializer):
+    budgeted_lists = serializers.IntegerField()
+    within_budget = serializers.IntegerField()
+    over_budget = serializers.IntegerField()
+    adherence_rate = serializers.FloatField(allow_null=True)
+    budget_total = serializers.DecimalField(max_digits=14, decimal_places=2)
+    budgeted_cost = serializers.DecimalField(max_digits=14, decimal_places=2)
+
+
+class AnalyticsProductSerializer(serializers.Serializer):
+    product = serializers.IntegerField(source='product_id')
+    sku = serializers.CharField(source='product__sku')
+    name = serializers.CharField(source='product__name')
+    lists = serializers.IntegerField()
+    total_quantity = serializers.IntegerField()
+    purchased_quantity = serializers.IntegerField()
+    average_unit_price = serializers.DecimalField(max_digits=12, decimal_places=2)
+    spent = serializers.DecimalField(max_digits=14, decimal_places=2)
+
+
+class SpendingAnalyticsSerializer(serializers.Serializer):
+    year = serializers.IntegerField(allow_null=True)
+    months = AnalyticsMonthSerializer(many=True)
+    budget = AnalyticsBudgetSerializer()
+    products = AnalyticsProductSerializer(many=True)
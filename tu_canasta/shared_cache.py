@@ -0,0 +1,15 @@
+"""
+Whether a cache alias is shared between processes.
+
+The replica pins, the throttle buckets and the cached responses with their
+generations live in caches. A per-process backend (local memory) gives each
+worker its own copy of that state, so the features that need one shared
+view of it check the alias first.
+"""
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+
+
+def is_shared_cache(alias) -> bool:
+    return not isinstance(caches[alias], (LocMemCache, DummyCache))
@@ -0,0 +1,277 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from decimal import Decimal
+from typing import Optional
+
+from django.db import models, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import Signal, receiver
+
+from .caching import PRODUCTS_SCOPE, bump_generation, user_scope
+from .events import LIST_DELETED, get_list_broker
+from .models import DeletedRecord, Product, ShoppingList, ShoppingListItem, User
+from .prices import record_price_observations
+from .serializers import ShoppingListItemEventSerializer
+from .user_resolver import get_user_resolver
+
+# Sent by ShoppingListItemQuerySet after bulk writes (update, delete, bulk_create)
+# with the ``shopping_list_ids`` whose items changed.
+items_bulk_changed = Signal()
+
+_pending_bulk_changes = ContextVar('pending_bulk_item_changes', default=None)
+
+
+def notify_items_bulk_changed(shopping_list_ids, using=None) -> None:
+    pending = _pending_bulk_changes.get()
+    if pending is not None:
+        pending.setdefault(using, set()).update(shopping_list_ids)
+    elif shopping_list_ids:
+        items_bulk_changed.send(
+            sender=ShoppingListItem,
+            shopping_list_ids=sorted(shopping_list_ids),
+            using=using,
+        )
+
+
+@contextmanager
+def coalesce_items_bulk_changed():
+    """
+    Collect the bulk item writes made inside the block and send a single
+    ``items_bulk_changed`` per database when it exits.
+    """
+    if _pending_bulk_changes.get() is not None:
+        yield
+        return
+    pending = {}
+    token = _pending_bulk_changes.set(pending)
+    try:
+        yield
+    finally:
+        _pending_bulk_changes.reset(token)
+    for using, shopping_list_ids in pending.items():
+        notify_items_bulk_changed(shopping_list_ids, using=using)
+
+
+def _origin_model(origin):
+    if isinstance(origin, models.QuerySet):
+        return origin.model
+    return type(origin)
+
+
+def _contribution(state: Optional[dict]) -> dict:
+    if state is None:
+        return {'items': 0, 'purchased': 0, 'cost': Decimal('0'), 'spent': Decimal('0')}
+    line_total = state['unit_price'] * state['quantity']
+    return {
+        'items': 1,
+        'purchased': int(state['is_purchased']),
+        'cost': line_total,
+        'spent': line_total if state['is_purchased'] else Decimal('0'),
+    }
+
+
+def _apply_deltas(using, before: Optional[dict], after: Optional[dict]) -> None:
+    deltas = {}
+    for state, sign in ((before, -1), (after, 1)):
+        if state is None:
+            continue
+        delta = deltas.setdefault(
+            state['shopping_list_id'], _contribution(None)
+        )
+        for key, value in _contribution(state).items():
+            delta[key] += sign * value
+    for shopping_list_id, delta in deltas.items():
+        if any(delta.values()):
+            ShoppingList.objects.using(using).filter(pk=shopping_list_id).apply_item_delta(
+                **delta
+            )
+
+
+def _saved_states(instance, created, update_fields):
+    """The item's totals state before and after a save."""
+    before = None if created else getattr(instance, '_stored_state', None)
+    after = instance.totals_state()
+    if before is not None and update_fields is not None:
+        # Only the saved fields changed; the rest keep their stored values.
+        saved = {
+            'shopping_list_id' if name == 'shopping_list' else name
+            for name in update_fields
+        }
+        after = {key: after[key] if key in saved else value for key, value in before.items()}
+    return before, after
+
+
+@receiver(post_save, sender=ShoppingListItem)
+def update_list_totals_on_save(sender, instance, created, raw=False, using=None,
+                               update_fields=None, **kwargs):
+    if raw:
+        return
+    _apply_deltas(using, *_saved_states(instance, created, update_fields))
+
+
+@receiver(post_save, sender=ShoppingListItem)
+def record_purchase_price(sender, instance, created, raw=False, using=None,
+                          update_fields=None, **kwargs):
+    if raw:
+        return
+    before, after = _saved_states(instance, created, update_fields)
+    if after['is_purchased'] and not (
+        before and before['is_purchased'] and before['unit_price'] == after['unit_price']
+    ):
+        record_price_observations(
+            [(instance.product_id, after['unit_price'], after['quantity'])], using=using
+        )
+
+
+@receiver(post_delete, sender=ShoppingListItem)
+def update_list_totals_on_delete(sender, instance, using=None, origin=None, **kwargs):
+    # Lists deleted together with their items need no update, and
+    # ShoppingListItemQuerySet.delete() recomputes the affected lists once.
+    if _origin_model(origin) in (User, ShoppingList, ShoppingListItem) and origin is not instance:
+        return
+    before = getattr(instance, '_stored_state', None) or instance.totals_state()
+    _apply_deltas(using, before, None)
+
+
+@receiver(items_bulk_changed, sender=ShoppingListItem)
+def recompute_list_totals_on_bulk_change(sender, shopping_list_ids, using=None, **kwargs):
+    ShoppingList.objects.using(using).filter(pk__in=shopping_list_ids).recompute_totals()
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_cached_user(sender, instance, using=None, **kwargs):
+    # Drop the snapshot now and again after commit, so a concurrent request
+    # cannot re-cache the pre-commit row (e.g. a user being deleted).
+    resolver = get_user_resolver()
+    resolver.invalidate(instance.pk)
+    transaction.on_commit(lambda: resolver.invalidate(instance.pk), using=using)
+
+
+def _list_owner_id(item: ShoppingListItem, using=None):
+    if ShoppingListItem.shopping_list.is_cached(item):
+        return item.shopping_list.user_id
+    return (
+        ShoppingList.objects.using(using)
+        .filter(pk=item.shopping_list_id)
+        .values_list('user_id', flat=True)
+        .first()
+    )
+
+
+def _bump_after_commit(using, *scopes) -> None:
+    # Bumped before the commit, a concurrent read could miss the cache, read
+    # the old rows and store them under the new generation.
+    if scopes:
+        transaction.on_commit(lambda: bump_generation(*scopes), using=using)
+
+
+@receiver(post_save, sender=ShoppingList)
+@receiver(post_delete, sender=ShoppingList)
+def bump_list_generation(sender, instance, using=None, **kwargs):
+    _bump_after_commit(using, user_scope(instance.user_id))
+
+
+@receiver(post_save, sender=ShoppingListItem)
+@receiver(post_delete, sender=ShoppingListItem)
+def bump_item_generation(sender, instance, using=None, origin=None, **kwargs):
+    if _origin_model(origin) in (User, ShoppingList, ShoppingListItem) and origin is not instance:
+        return  # covered by the list's post_delete or by items_bulk_changed
+    user_id = _list_owner_id(instance, using)
+    if user_id is not None:
+        _bump_after_commit(using, user_scope(user_id))
+
+
+@receiver(items_bulk_changed, sender=ShoppingListItem)
+def bump_bulk_item_generation(sender, shopping_list_ids, using=None, **kwargs):
+    user_ids = (
+        ShoppingList.objects.using(using)
+        .filter(pk__in=shopping_list_ids)
+        .order_by()
+        .values_list('user_id', flat=True)
+        .distinct()
+    )
+    _bump_after_commit(using, *(user_scope(user_id) for user_id in user_ids))
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def bump_product_generation(sender, using=None, **kwargs):
+    _bump_after_commit(using, PRODUCTS_SCOPE)
+
+
+@receiver(post_delete, sender=ShoppingList)
+def record_list_deletion(sender, instance, using=None, origin=None, **kwargs):
+    if _origin_model(origin) is User:
+        return  # the owner and their tombstones are going away too
+    DeletedRecord.objects.using(using).create(
+        user_id=instance.user_id,
+        model=DeletedRecord.SHOPPING_LIST,
+        object_id=instance.pk,
+    )
+
+
+@receiver(post_delete, sender=ShoppingListItem)
+def record_item_deletion(sender, instance, using=None, origin=None, **kwargs):
+    # A deleted list implies its items; ShoppingListItemQuerySet.delete()
+    # records its own tombstones in one INSERT.
+    if _origin_model(origin) in (User, ShoppingList, ShoppingListItem) and origin is not instance:
+        return
+    user_id = _list_owner_id(instance, using)
+    if user_id is not None:
+        DeletedRecord.objects.using(using).create(
+            user_id=user_id,
+            model=DeletedRecord.SHOPPING_LIST_ITEM,
+            object_id=instance.pk,
+            shopping_list_id=instance.shopping_list_id,
+        )
+
+
+def _publish(using, shopping_list_id, event_type, data) -> None:
+    # Subscribers only hear about committed writes.
+    transaction.on_commit(
+        lambda: get_list_broker().publish(shopping_list_id, event_type, data), using=using
+    )
+
+
+@receiver(post_save, sender=ShoppingListItem)
+def publish_item_saved(sender, instance, created, raw=False, using=None,
+                       update_fields=None, **kwargs):
+    if raw:
+        return
+    before, after = _saved_states(instance, created, update_fields)
+    moved = before is not None and before['shopping_list_id'] != after['shopping_list_id']
+    if moved:
+        _publish(using, before['shopping_list_id'], 'item.deleted', {
+            'id': instance.pk, 'shopping_list': before['shopping_list_id'],
+        })
+    shopping_list_id = after['shopping_list_id']
+    if not get_list_broker().is_watched(shopping_list_id):
+        # Nobody to send the diff to; a later reconnect reloads the items.
+        _publish(using, shopping_list_id, 'items.changed', {'shopping_list': shopping_list_id})
+        return
+    event_type = 'item.created' if created or moved else 'item.updated'
+    # Serialized now: the instance may change again before the commit.
+    data = ShoppingListItemEventSerializer(instance).data
+    _publish(using, shopping_list_id, event_type, data)
+
+
+@receiver(post_delete, sender=ShoppingListItem)
+def publish_item_deleted(sender, instance, using=None, origin=None, **kwargs):
+    if _origin_model(origin) in (User, ShoppingList, ShoppingListItem) and origin is not instance:
+        return  # list.deleted or items.changed covers it
+    _publish(using, instance.shopping_list_id, 'item.deleted', {
+        'id': instance.pk, 'shopping_list': instance.shopping_list_id,
+    })
+
+
+@receiver(items_bulk_changed, sender=ShoppingListItem)
+def publish_bulk_item_change(sender, shopping_list_ids, using=None, **kwargs):
+    # Bulk writes only report their lists: clients reload the list's items.
+    for shopping_list_id in shopping_list_ids:
+        _publish(using, shopping_list_id, 'items.changed', {'shopping_list': shopping_list_id})
+
+
+@receiver(post_delete, sender=ShoppingList)
+def publish_list_deleted(sender, instance, using=None, **kwargs):
+    _publish(using, instance.pk, LIST_DELETED, {'shopping_list': instance.pk})
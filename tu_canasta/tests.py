@@ -1,9 +1,78 @@
 from django.test import TestCase
 
 # Create your tests here.
-from django.test import TestCase
-from tu_canasta.models import Product
-from django.db import IntegrityError
+from datetime import date, timedelta
+import asyncio
+import json
+import os
+import runpy
+import shutil
+import tempfile
+import threading
+import time
+from decimal import Decimal
+from io import StringIO
+from unittest import mock, skipUnless
+
+from django.contrib.auth.hashers import check_password, make_password
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.test import (
+    AsyncRequestFactory,
+    RequestFactory,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+from tu_canasta.benchmarks import (
+    SCENARIOS,
+    api_route_names,
+    compare_to_baseline,
+    load_baseline,
+    run_benchmarks,
+    seed_fixtures,
+)
+from django.utils import timezone
+from tu_canasta.caching import PRODUCTS_SCOPE, bump_generation, get_generations
+from tu_canasta.events import InProcessBroker, get_list_broker
+from tu_canasta.jobs import HANDLERS, claim_job, enqueue, requeue_stale_jobs, run_job, work
+from tu_canasta.middleware import DatabaseLatencyMonitor, RequestMetrics
+from tu_canasta.models import (
+    DeletedRecord,
+    IdempotencyKey,
+    Job,
+    PriceObservation,
+    Product,
+    ProductPriceStats,
+    ShoppingList,
+    ShoppingListItem,
+    User,
+)
+from tu_canasta.prices import refresh_price_stats, stale_price_stats
+from tu_canasta.renderers import ORJSONRenderer
+from tu_canasta.passwords import hash_password, verify_password
+from tu_canasta.search import _prefix_matches
+from tu_canasta.sync import changed_since
+from tu_canasta.serializers import ShoppingListSerializer
+from tu_canasta.throttling import TokenBucketThrottle, check_throttle_cache
+from tu_canasta.user_resolver import get_user_resolver
+from tu_canasta.views import (
+    ProductViewSet,
+    ShoppingListItemViewSet,
+    ShoppingListViewSet,
+    UserViewSet,
+)
+from django.db import IntegrityError, connection, connections, transaction
+from django.db.models import Prefetch
+from django.test.utils import CaptureQueriesContext
 
 class ProductModelTest(TestCase):
 
@@ -33,3 +102,2112 @@ class ProductModelTest(TestCase):
                 name="Otro café",
                 description="Café duplicado"
             )
+
+
+class ShoppingListMetricsTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(
+            first_name="Ana", email="ana@example.com", password="secreto123"
+        )
+        self.client = APIClient()
+        self.client.credentials(HTTP_X_USER_ID=str(self.user.pk))
+        for list_index in range(3):
+            shopping_list = ShoppingList.objects.create(
+                user=self.user, title=f"Lista {list_index}", budget=Decimal("100.00")
+            )
+            for item_index in range(3):
+                product = Product.objects.create(
+                    sku=f"SKU-{list_index}-{item_index}", name=f"Producto {item_index}"
+                )
+                ShoppingListItem.objects.create(
+                    shopping_list=shopping_list,
+                    product=product,
+                    quantity=2,
+                    unit_price=Decimal("5.00"),
+                    is_purchased=item_index == 0,
+                )
+
+    def test_with_metrics_annotates_every_metric(self):
+        """with_metrics debe calcular las métricas sin consultas adicionales"""
+        shopping_list = ShoppingList.objects.with_metrics().first()
+        with self.assertNumQueries(0):
+            self.assertEqual(shopping_list.total_items, 3)
+            self.assertEqual(shopping_list.purchased_items, 1)
+            self.assertEqual(shopping_list.pending_items, 2)
+            self.assertEqual(shopping_list.total_cost, Decimal("30.00"))
+            self.assertEqual(shopping_list.total_spent, Decimal("10.00"))
+            self.assertEqual(shopping_list.remaining_budget, Decimal("70.00"))
+
+    def test_list_endpoint_uses_constant_queries(self):
+        """El listado no debe lanzar consultas por cada lista"""
+        with self.assertNumQueries(4):
+            response = self.client.get("/api/shopping-lists/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data["results"]), 3)
+        self.assertEqual(response.data["results"][0]["total_cost"], "30.00")
+
+
+class ShoppingListStoredTotalsTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(
+            first_name="Luis", email="luis@example.com", password="secreto123"
+        )
+        self.shopping_list = ShoppingList.objects.create(user=self.user)
+        self.rice = Product.objects.create(sku="ARROZ", name="Arroz")
+        self.milk = Product.objects.create(sku="LECHE", name="Leche")
+
+    def assertTotals(self, items, purchased, cost, spent):
+        self.shopping_list.refresh_from_db()
+        self.assertEqual(self.shopping_list.total_items, items)
+        self.assertEqual(self.shopping_list.purchased_items, purchased)
+        self.assertEqual(self.shopping_list.total_cost, Decimal(cost))
+        self.assertEqual(self.shopping_list.total_spent, Decimal(spent))
+
+    def test_totals_follow_item_writes(self):
+        """Los totales almacenados deben seguir cada escritura de ítems"""
+        item = ShoppingListItem.objects.create(
+            shopping_list=self.shopping_list, product=self.rice,
+            quantity=2, unit_price=Decimal("3.50"),
+        )
+        self.assertTotals(1, 0, "7.00", "0.00")
+
+        item = ShoppingListItem.objects.get(pk=item.pk)
+        item.is_purchased = True
+        item.quantity = 3
+        item.save()
+        self.assertTotals(1, 1, "10.50", "10.50")
+
+        ShoppingListItem.objects.create(
+            shopping_list=self.shopping_list, product=self.milk, unit_price=Decimal("2.00"),
+        )
+        self.assertTotals(2, 1, "12.50", "10.50")
+
+        ShoppingListItem.objects.filter(shopping_list=self.shopping_list).update(
+            is_purchased=False
+        )
+        self.assertTotals(2, 0, "12.50", "0.00")
+
+        item.delete()
+        self.assertTotals(1, 0, "2.00", "0.00")
+
+        ShoppingListItem.objects.all().delete()
+        self.assertTotals(0, 0, "0.00", "0.00")
+
+    def test_recompute_command_repairs_drift(self):
+        """El comando recompute_list_totals debe corregir totales desfasados"""
+        ShoppingListItem.objects.create(
+            shopping_list=self.shopping_list, product=self.rice, unit_price=Decimal("4.00"),
+        )
+        ShoppingList.objects.filter(pk=self.shopping_list.pk).update(
+            item_count=9, cost_total=Decimal("99.00")
+        )
+        self.assertEqual(ShoppingList.objects.with_drift().count(), 1)
+
+        call_command("recompute_list_totals", stdout=StringIO())
+
+        self.assertEqual(ShoppingList.objects.with_drift().count(), 0)
+        self.assertTotals(1, 0, "4.00", "0.00")
+
+
+class KeysetPaginationTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(
+            first_name="Eva", email="eva@example.com", password="secreto123"
+        )
+        self.client = APIClient()
+        self.client.credentials(HTTP_X_USER_ID=str(self.user.pk))
+        dates = [None, date(2025, 1, 1), date(2025, 1, 1), None, date(2025, 3, 1)]
+        for index, target_date in enumerate(dates * 2):
+            ShoppingList.objects.create(
+                user=self.user, title=f"Lista {index}", target_date=target_date
+            )
+
+    def walk(self, url):
+        ids = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            ids.extend(row["id"] for row in response.data["results"])
+            url = response.data["next"]
+        return ids
+
+    def test_pages_follow_model_ordering_without_gaps(self):
+        """Las páginas deben recorrer todas las listas en el orden del modelo"""
+        expected = list(
+            ShoppingList.objects.order_by(
+                "-target_date", "-updated_at", "-id"
+            ).values_list("id", flat=True)
+        )
+        self.assertEqual(self.walk("/api/shopping-lists/?page_size=3"), expected)
+
+    def test_previous_link_returns_prior_page(self):
+        """El enlace previous debe devolver exactamente la página anterior"""
+        first = self.client.get("/api/shopping-lists/?page_size=4").data
+        second = self.client.get(first["next"]).data
+        back = self.client.get(second["previous"]).data
+        self.assertEqual(
+            [row["id"] for row in back["results"]],
+            [row["id"] for row in first["results"]],
+        )
+
+    def test_invalid_cursor_returns_404(self):
+        """Un cursor corrupto debe rechazarse"""
+        response = self.client.get("/api/products/?cursor=no-es-valido")
+        self.assertEqual(response.status_code, 404)
+
+
+class ShoppingListItemBulkTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(
+            first_name="Sara", email="sara@example.com", password="secreto123"
+        )
+        other = User.objects.create(
+            first_name="Otro", email="otro@example.com", password="secreto123"
+        )
+        self.client = APIClient()
+        self.client.credentials(HTTP_X_USER_ID=str(self.user.pk))
+        self.shopping_list = ShoppingList.objects.create(user=self.user)
+        self.foreign_list = ShoppingList.objects.create(user=other)
+        self.products = [
+            Product.objects.create(sku=f"BULK-{index}", name=f"Producto {index}")
+            for index in range(20)
+        ]
+
+    def test_batch_applies_every_operation_with_constant_queries(self):
+        """El lote debe aplicar upserts, toggles y borrados con consultas constantes"""
+        existing = ShoppingListItem.objects.create(
+            shopping_list=self.shopping_list, product=self.products[0], quantity=1
+        )
+        doomed = ShoppingListItem.objects.create(
+            shopping_list=self.shopping_list, product=self.products[1]
+        )
+        payload = {
+            "upsert": [
+                {"shopping_list": self.shopping_list.pk, "product": product.pk,
+                 "quantity": 2, "unit_price": "1.50"}
+                for product in [self.products[0]] + self.products[2:]
+            ] + [{"shopping_list": self.foreign_list.pk, "product": self.products[2].pk}],
+            "toggle": [{"id": existing.pk, "is_purchased": True}],
+            "delete": [doomed.pk, 999999],
+        }
+        with self.assertNumQueries(17):
+            response = self.client.post(
+                "/api/shopping-list-items/bulk/", payload, format="json"
+            )
+
+        self.assertEqual(response.status_code, 200)
+        statuses = [row["status"] for row in response.data["upsert"]]
+        self.assertEqual(statuses, ["ok"] * 19 + ["error"])
+        self.assertEqual(response.data["upsert"][0]["id"], existing.pk)
+        self.assertEqual(response.data["toggle"][0]["status"], "ok")
+        self.assertEqual(
+            [row["status"] for row in response.data["delete"]], ["ok", "error"]
+        )
+        existing.refresh_from_db()
+        self.assertEqual(existing.quantity, 2)
+        self.assertTrue(existing.is_purchased)
+        self.assertFalse(ShoppingListItem.objects.filter(pk=doomed.pk).exists())
+        self.shopping_list.refresh_from_db()
+        self.assertEqual(self.shopping_list.total_items, 19)
+        self.assertEqual(self.shopping_list.purchased_items, 1)
+        self.assertEqual(self.shopping_list.total_cost, Decimal("57.00"))
+
+    def test_upsert_only_changes_the_fields_sent(self):
+        """Un upsert sobre un ítem existente conserva los campos que no se envían"""
+        purchased = ShoppingListItem.objects.create(
+            shopping_list=self.shopping_list, product=self.products[0],
+            quantity=1, unit_price=Decimal("4.50"), is_purchased=True,
+        )
+        observations = PriceObservation.objects.count()
+        payload = {"upsert": [
+            {"shopping_list": self.shopping_list.pk, "product": self.products[0].pk,
+             "quantity": 3},
+            {"shopping_list": self.shopping_list.pk, "product": self.products[1].pk},
+        ]}
+        response = self.client.post("/api/shopping-list-items/bulk/", payload, format="json")
+        self.assertEqual([row["status"] for row in response.data["upsert"]], ["ok", "ok"])
+        purchased.refresh_from_db()
+        self.assertEqual(purchased.quantity, 3)
+        self.assertEqual(purchased.unit_price, Decimal("4.50"))
+        self.assertTrue(purchased.is_purchased)
+        created = ShoppingListItem.objects.get(product=self.products[1])
+        self.assertEqual((created.quantity, created.is_purchased), (1, False))
+        self.assertEqual(PriceObservation.objects.count(), observations)
+
+
+class UserResolverTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(
+            first_name="Iván", email="ivan@example.com", password="secreto123"
+        )
+        self.client = APIClient()
+        self.client.credentials(HTTP_X_USER_ID=str(self.user.pk))
+
+    def test_cached_user_needs_no_queries(self):
+        """Tras la primera resolución el usuario no debe consultarse de nuevo"""
+        resolver = get_user_resolver()
+        with self.assertNumQueries(1):
+            resolver.resolve(self.user.pk)
+        with self.assertNumQueries(0):
+            user = resolver.resolve(str(self.user.pk))
+        self.assertEqual(user.pk, self.user.pk)
+        self.assertIn("password", user.get_deferred_fields())
+
+    def test_deletion_invalidates_snapshot(self):
+        """Borrar al usuario debe invalidar la caché y rechazarlo"""
+        self.assertEqual(self.client.get("/api/shopping-lists/").status_code, 200)
+        self.user.delete()
+        response = self.client.get("/api/shopping-lists/")
+        self.assertEqual(response.status_code, 403)
+
+    def test_lru_snapshots_expire_quickly(self):
+        """En memoria del proceso, la resolución caduca a los pocos segundos"""
+        resolver, pk = get_user_resolver(), self.user.pk
+        resolver.resolve(pk)
+        with mock.patch.object(resolver, "invalidate"):  # deleted by another worker
+            self.user.delete()
+        self.assertEqual(resolver.resolve(pk).pk, pk)
+        later = time.monotonic() + 6
+        with mock.patch("tu_canasta.user_resolver.time.monotonic", return_value=later):
+            with self.assertRaises(AuthenticationFailed):
+                resolver.resolve(pk)
+
+
+@override_settings(RESPONSE_CACHE={"ENABLED": True})
+class ResponseCacheTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(
+            first_name="Rosa", email="rosa@example.com", password="secreto123"
+        )
+        self.client = APIClient()
+        self.client.credentials(HTTP_X_USER_ID=str(self.user.pk))
+        self.shopping_list = ShoppingList.objects.create(user=self.user)
+        self.product = Product.objects.create(sku="PAN", name="Pan")
+
+    def test_repeated_get_is_served_from_cache(self):
+        """Una segunda lectura sin cambios no debe tocar la base de datos"""
+        first = self.client.get("/api/shopping-lists/")
+        with self.assertNumQueries(0):
+            second = self.client.get("/api/shopping-lists/")
+        self.assertEqual(first.content, second.content)
+        self.assertEqual(first["ETag"], second["ETag"])
+
+        with self.assertNumQueries(0):
+            not_modified = self.client.get(
+                "/api/shopping-lists/", HTTP_IF_NONE_MATCH=first["ETag"]
+            )
+        self.assertEqual(not_modified.status_code, 304)
+
+    def test_writes_change_the_etag(self):
+        """Cualquier escritura de ítems o productos debe invalidar la respuesta"""
+        etag = self.client.get("/api/shopping-lists/")["ETag"]
+        with self.captureOnCommitCallbacks(execute=True):
+            ShoppingListItem.objects.create(
+                shopping_list=self.shopping_list, product=self.product
+            )
+        response = self.client.get("/api/shopping-lists/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data["results"][0]["items"]), 1)
+
+        etag = response["ETag"]
+        self.product.name = "Pan integral"
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.save()
+        response = self.client.get("/api/shopping-lists/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.data["results"][0]["items"][0]["product_detail"]["name"], "Pan integral"
+        )
+
+    def test_generation_changes_only_after_commit(self):
+        """Hasta el commit se sirve la respuesta cacheada; después, la lectura es fresca"""
+        etag = self.client.get("/api/shopping-lists/")["ETag"]
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                ShoppingListItem.objects.create(
+                    shopping_list=self.shopping_list, product=self.product
+                )
+                # What a concurrent request sees: nothing committed, nothing to re-cache.
+                with self.assertNumQueries(0):
+                    response = self.client.get(
+                        "/api/shopping-lists/", HTTP_IF_NONE_MATCH=etag
+                    )
+                self.assertEqual(response.status_code, 304)
+        response = self.client.get("/api/shopping-lists/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data["results"][0]["items"]), 1)
+
+    def test_concurrent_bumps_always_change_the_generation(self):
+        """Cada invalidación escribe una generación nueva, sin depender de incr"""
+        seen = {get_generations([PRODUCTS_SCOPE])[PRODUCTS_SCOPE]}
+        for _ in range(3):
+            bump_generation(PRODUCTS_SCOPE)
+            seen.add(get_generations([PRODUCTS_SCOPE])[PRODUCTS_SCOPE])
+        self.assertEqual(len(seen), 4)
+
+    @override_settings(RESPONSE_CACHE={"ENABLED": False})
+    def test_disabled_without_a_shared_cache(self):
+        """Sin caché compartida las lecturas no se guardan ni responden 304"""
+        first = self.client.get("/api/shopping-lists/")
+        self.assertNotIn("ETag", first)
+        with self.assertNumQueries(2):
+            self.client.get("/api/shopping-lists/")
+
+
+class SyncEndpointTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(
+            first_name="Teo", email="teo@example.com", password="secreto123"
+        )
+        self.client = APIClient()
+        self.client.credentials(HTTP_X_USER_ID=str(self.user.pk))
+        self.shopping_list = ShoppingList.objects.create(user=self.user)
+        self.products = [
+            Product.objects.create(sku=f"SYNC-{index}", name=f"Producto {index}")
+            for index in range(3)
+        ]
+        self.items = [
+            ShoppingListItem.objects.create(shopping_list=self.shopping_list, product=product)
+            for product in self.products
+        ]
+
+    @override_settings(SYNC={"OVERLAP_SECONDS": 0})
+    def test_sync_returns_only_changes_and_tombstones(self):
+        """La sincronización debe devolver solo los cambios y los borrados"""
+        full = self.client.get("/api/sync/").data
+        self.assertEqual(len(full["lists"]), 1)
+        self.assertEqual(len(full["items"]), 3)
+        self.assertNotIn("items", full["lists"][0])
+
+        item = ShoppingListItem.objects.get(pk=self.items[0].pk)
+        item.quantity = 5
+        item.save()
+        deleted_ids = sorted(item.pk for item in self.items[1:])
+        self.items[1].delete()
+        ShoppingListItem.objects.filter(pk=self.items[2].pk).delete()
+
+        delta = self.client.get("/api/sync/", {"since": full["cursor"]}).data
+        self.assertEqual([row["id"] for row in delta["items"]], [item.pk])
+        self.assertEqual(sorted(row["id"] for row in delta["deleted"]), deleted_ids)
+        self.assertEqual(len(delta["lists"]), 1)
+        self.assertEqual(delta["lists"][0]["total_items"], 1)
+
+        empty = self.client.get("/api/sync/", {"since": delta["cursor"]}).data
+        self.assertEqual((empty["lists"], empty["items"], empty["deleted"]), ([], [], []))
+
+    def test_sync_pages_with_has_more(self):
+        """Con un límite pequeño la sincronización debe paginar"""
+        page = self.client.get("/api/sync/", {"limit": 2}).data
+        self.assertTrue(page["has_more"])
+        rest = self.client.get("/api/sync/", {"since": page["cursor"], "limit": 2}).data
+        self.assertEqual(len(page["items"]) + len(rest["items"]), 3)
+
+    def test_completed_sync_resends_the_overlap_window(self):
+        """Una fila que se confirma tarde con una fecha anterior al cursor no se pierde"""
+        cursor = self.client.get("/api/sync/").data["cursor"]
+        product = Product.objects.create(sku="SYNC-TARDE", name="Producto tardío")
+        late = ShoppingListItem.objects.create(shopping_list=self.shopping_list, product=product)
+        ShoppingListItem.objects.filter(pk=late.pk).update(
+            updated_at=timezone.now() - timedelta(seconds=30)
+        )
+        delta = self.client.get("/api/sync/", {"since": cursor}).data
+        self.assertIn(late.pk, [row["id"] for row in delta["items"]])
+        self.assertFalse(delta["has_more"])
+
+    def test_cursor_older_than_tombstones_is_refused(self):
+        """Un cursor anterior a los borrados conservados obliga a sincronizar desde cero"""
+        since = (timezone.now() - timedelta(days=91)).isoformat()
+        response = self.client.get("/api/sync/", {"since": since})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("since", response.data)
+
+    def test_prune_deleted_records(self):
+        """El comando elimina solo los registros de borrados vencidos"""
+        expired, kept = self.items[0].pk, self.items[1].pk
+        self.items[0].delete()
+        self.items[1].delete()
+        DeletedRecord.objects.filter(object_id=expired).update(
+            deleted_at=timezone.now() - timedelta(days=91)
+        )
+        out = StringIO()
+        call_command("prune_deleted_records", stdout=out)
+        self.assertIn("1 registros de borrados eliminados", out.getvalue())
+        self.assertEqual(
+            list(DeletedRecord.objects.values_list("object_id", flat=True)), [kept]
+        )
+
+
+class SparseFieldsetTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(
+            first_name="Noa", email="noa@example.com", password="secreto123"
+        )
+        self.client = APIClient()
+        self.client.credentials(HTTP_X_USER_ID=str(self.user.pk))
+        self.shopping_list = ShoppingList.objects.create(user=self.user, title="Semana")
+        for index in range(3):
+            ShoppingListItem.objects.create(
+                shopping_list=self.shopping_list,
+                product=Product.objects.create(sku=f"FS-{index}", name=f"Producto {index}"),
+            )
+
+    def test_fields_skip_items_and_their_prefetch(self):
+        """Sin items solicitados no debe cargarse ningún ítem"""
+        with self.assertNumQueries(2):
+            response = self.client.get(
+                "/api/shopping-lists/", {"fields": "id,title,total_items"}
+            )
+        self.assertEqual(
+            response.data["results"][0],
+            {"id": self.shopping_list.pk, "title": "Semana", "total_items": 3},
+        )
+
+    def test_expand_controls_nested_product_detail(self):
+        """expand=items debe incluir los ítems sin product_detail"""
+        with self.assertNumQueries(3):
+            response = self.client.get("/api/shopping-lists/", {"expand": "items"})
+        item = response.data["results"][0]["items"][0]
+        self.assertIn("product", item)
+        self.assertNotIn("product_detail", item)
+
+        response = self.client.get(
+            "/api/shopping-lists/", {"expand": "items.product_detail", "fields": "id,items.product_detail"}
+        )
+        self.assertEqual(
+            set(response.data["results"][0]["items"][0]), {"product_detail"}
+        )
+
+    def test_nested_items_route_paginates(self):
+        """La ruta anidada de ítems debe paginar los ítems de la lista"""
+        url = f"/api/shopping-lists/{self.shopping_list.pk}/items/"
+        first = self.client.get(url, {"page_size": 2}).data
+        self.assertEqual(len(first["results"]), 2)
+        second = self.client.get(first["next"]).data
+        self.assertEqual(len(second["results"]), 1)
+        self.assertIsNone(second["next"])
+
+
+class ProductSearchTest(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.coffee = Product.objects.create(
+            sku="CAFE-500", name="Café de Colombia", description="Tostado medio"
+        )
+        self.decaf = Product.objects.create(
+            sku="CAFE-DESC", name="Café descafeinado", description="Sin cafeína"
+        )
+        self.milk = Product.objects.create(
+            sku="LECHE-1L", name="Leche entera", description="Ideal con café"
+        )
+
+    def test_search_ranks_name_matches_first(self):
+        """La búsqueda debe priorizar coincidencias en nombre y SKU"""
+        response = self.client.get("/api/products/", {"search": "cafe"})
+        ids = [row["id"] for row in response.data["results"]]
+        self.assertEqual(set(ids), {self.coffee.pk, self.decaf.pk, self.milk.pk})
+        self.assertEqual(ids[-1], self.milk.pk)
+
+    def test_search_follows_product_updates(self):
+        """El índice de búsqueda debe actualizarse con los cambios del producto"""
+        self.milk.name = "Leche deslactosada"
+        self.milk.save()
+        response = self.client.get("/api/products/", {"search": "deslac"})
+        self.assertEqual([row["id"] for row in response.data["results"]], [self.milk.pk])
+        self.milk.delete()
+        response = self.client.get("/api/products/", {"search": "deslac"})
+        self.assertEqual(response.data["results"], [])
+
+    def test_autocomplete_matches_word_prefixes(self):
+        """El autocompletado debe sugerir por prefijo de nombre o SKU"""
+        response = self.client.get("/api/products/autocomplete/", {"q": "le"})
+        self.assertEqual(
+            response.data, [{"id": self.milk.pk, "sku": "LECHE-1L", "name": "Leche entera"}]
+        )
+        response = self.client.get("/api/products/autocomplete/", {"q": "café desc"})
+        self.assertEqual([row["id"] for row in response.data], [self.decaf.pk])
+
+
+class ProductCatalogImportTest(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.existing = Product.objects.create(sku="ARROZ-1", name="Arroz", description="")
+
+    def test_import_upserts_by_sku_and_reports_bad_rows(self):
+        """La importación debe actualizar por SKU y reportar filas inválidas"""
+        upload = SimpleUploadedFile(
+            "catalogo.csv",
+            (
+                "sku,name,description\n"
+                "ARROZ-1,Arroz blanco,Grano largo\n"
+                "PAN-1,Pan,\n"
+                "PAN-1,Pan tajado,Integral\n"
+                ",Sin SKU,\n"
+            ).encode("utf-8"),
+            content_type="text/csv",
+        )
+        response = self.client.post("/api/products/import/", {"file": upload})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["processed"], 4)
+        self.assertEqual(response.data["imported"], 2)
+        self.assertEqual(response.data["error_count"], 1)
+        self.assertEqual(response.data["errors"][0]["line"], 5)
+        self.existing.refresh_from_db()
+        self.assertEqual(self.existing.name, "Arroz blanco")
+        self.assertEqual(Product.objects.get(sku="PAN-1").description, "Integral")
+
+    def test_import_command_reads_ndjson(self):
+        """El comando import_products debe aceptar NDJSON en lotes"""
+        with tempfile.NamedTemporaryFile("w", suffix=".ndjson", delete=False) as handle:
+            handle.write('{"sku": "SAL-1", "name": "Sal"}\n\nno es json\n')
+            handle.write('{"sku": "ARROZ-1", "name": "Arroz integral"}\n')
+        self.addCleanup(os.remove, handle.name)
+        out, err = StringIO(), StringIO()
+        call_command("import_products", handle.name, "--chunk-size", "1", stdout=out, stderr=err)
+        self.assertIn("3 filas procesadas, 2 productos importados, 1 con errores", out.getvalue())
+        self.assertIn("Línea 3", err.getvalue())
+        self.assertEqual(Product.objects.get(sku="ARROZ-1").name, "Arroz integral")
+
+    def test_export_streams_catalog(self):
+        """La exportación debe transmitir el catálogo completo"""
+        Product.objects.create(sku="CAFE-1", name="Café", description="Molido, 500 g")
+        response = self.client.get("/api/products/export/", {"file_format": "csv"})
+        self.assertTrue(response.streaming)
+        content = b"".join(response.streaming_content).decode("utf-8")
+        self.assertEqual(
+            content.splitlines(),
+            ["sku,name,description", "ARROZ-1,Arroz,", 'CAFE-1,Café,"Molido, 500 g"'],
+        )
+        response = self.client.get("/api/products/export/", {"file_format": "xml"})
+        self.assertEqual(response.status_code, 400)
+
+
+class ApiQueryBudgetTest(TestCase):
+
+    def test_every_route_has_a_benchmark(self):
+        """Cada ruta de la API debe tener al menos un escenario de benchmark"""
+        self.assertEqual(api_route_names() - {scenario.route for scenario in SCENARIOS}, set())
+
+    def test_routes_stay_within_query_budget(self):
+        """Ningún endpoint debe superar su presupuesto de consultas"""
+        fixtures = seed_fixtures(users=3, lists_per_user=3, items_per_list=5, products=30)
+        results = run_benchmarks(fixtures, repeat=1)
+        self.assertEqual(compare_to_baseline(results, load_baseline()), [])
+
+
+class RequestMetricsMiddlewareTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(
+            first_name="Marta", email="marta@example.com", password="secreto123"
+        )
+        ShoppingList.objects.create(user=self.user, title="Semana")
+        self.client = APIClient()
+        self.client.credentials(HTTP_X_USER_ID=str(self.user.pk))
+
+    @override_settings(REQUEST_METRICS={"ENABLED": True})
+    def test_reports_server_timing_and_log_line(self):
+        """Las peticiones medidas deben incluir Server-Timing y un log estructurado"""
+        with self.assertLogs("tu_canasta.performance", "INFO") as logs:
+            response = self.client.get("/api/shopping-lists/")
+        for metric in ("db;dur=", "serialize;dur=", "render;dur=", "total;dur="):
+            self.assertIn(metric, response["Server-Timing"])
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record["route"], "shopping-list-list")
+        self.assertGreater(record["queries"], 0)
+        self.assertFalse(record["over_budget"])
+
+    @override_settings(REQUEST_METRICS={"ENABLED": True, "SLOW_QUERY_MS": 0})
+    def test_flags_requests_over_query_budget(self):
+        """Debe marcar las rutas que superan su presupuesto de consultas"""
+        with mock.patch(
+            "tu_canasta.middleware.load_query_budgets",
+            return_value={("shopping-list-list", "GET"): 1},
+        ), self.assertLogs("tu_canasta.performance", "WARNING") as logs:
+            response = self.client.get("/api/shopping-lists/")
+        self.assertIn('budget;desc="', response["Server-Timing"])
+        record = json.loads(logs.records[0].getMessage())
+        self.assertTrue(record["over_budget"])
+        self.assertEqual(len(record["slow_queries"]), record["queries"])
+
+    def test_disabled_by_default(self):
+        """Sin activarla, la instrumentación no debe agregar encabezados"""
+        response = self.client.get("/api/shopping-lists/")
+        self.assertNotIn("Server-Timing", response)
+
+
+class AsyncReadViewTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        get_user_resolver().backend.clear()
+        self.user = User.objects.create(
+            first_name="Luz", email="luz@example.com", password="secreto123"
+        )
+        self.other = User.objects.create(
+            first_name="Iván", email="ivan@example.com", password="secreto123"
+        )
+        self.product = Product.objects.create(sku="AVENA", name="Avena")
+        self.shopping_list = ShoppingList.objects.create(user=self.user, title="Mercado")
+        ShoppingListItem.objects.create(
+            shopping_list=self.shopping_list,
+            product=self.product,
+            quantity=2,
+            unit_price=Decimal("3000"),
+        )
+        self.foreign_list = ShoppingList.objects.create(user=self.other, title="Ajena")
+        with override_settings(ASYNC_READ_VIEWS=True):
+            self.list_view = ShoppingListViewSet.as_view({"get": "list", "post": "create"})
+            self.detail_view = ShoppingListViewSet.as_view({"get": "retrieve"})
+        self.headers = {"X-USER-ID": str(self.user.pk)}
+
+    async def test_async_list_matches_sync_response(self):
+        """El listado asíncrono debe devolver lo mismo que el síncrono"""
+        self.assertTrue(iscoroutinefunction(self.list_view))
+        response = await self.list_view(
+            AsyncRequestFactory().get("/api/shopping-lists/", headers=self.headers)
+        )
+        self.assertEqual(response.status_code, 200)
+
+        cache.clear()
+        sync_view = ShoppingListViewSet.as_view({"get": "list"})
+        self.assertFalse(iscoroutinefunction(sync_view))
+        expected = await sync_to_async(sync_view)(
+            RequestFactory().get("/api/shopping-lists/", headers=self.headers)
+        )
+        expected.render()
+        self.assertEqual(json.loads(response.content), json.loads(expected.content))
+
+    @override_settings(RESPONSE_CACHE={"ENABLED": True})
+    async def test_async_miss_is_stored_without_blocking(self):
+        """Una respuesta asíncrona se guarda en caché con aset, no con el set síncrono"""
+        request = AsyncRequestFactory().get("/api/shopping-lists/", headers=self.headers)
+        cache_set, threads = cache.set, []
+
+        def recording_set(*args, **kwargs):
+            threads.append(threading.get_ident())
+            return cache_set(*args, **kwargs)
+
+        with mock.patch.object(cache, "set", recording_set):
+            first = await self.list_view(request)
+        self.assertEqual(first.status_code, 200)
+        # locmem has no native aset: it runs set in a worker thread, off the loop.
+        self.assertTrue(threads)
+        self.assertNotIn(threading.get_ident(), threads)
+        second = await self.list_view(request)
+        self.assertEqual(second["ETag"], first["ETag"])
+        self.assertEqual(second.content, first.content)
+
+    async def test_async_retrieve_is_scoped_to_user(self):
+        """El detalle asíncrono no debe exponer listas de otros usuarios"""
+        response = await self.detail_view(
+            AsyncRequestFactory().get(
+                f"/api/shopping-lists/{self.foreign_list.pk}/", headers=self.headers
+            ),
+            pk=str(self.foreign_list.pk),
+        )
+        self.assertEqual(response.status_code, 404)
+        response = await self.detail_view(
+            AsyncRequestFactory().get(
+                f"/api/shopping-lists/{self.shopping_list.pk}/", headers=self.headers
+            ),
+            pk=str(self.shopping_list.pk),
+        )
+        self.assertEqual(json.loads(response.content)["total_cost"], "6000.00")
+
+    async def test_async_view_requires_user_and_keeps_writes_sync(self):
+        """Sin usuario debe fallar y las escrituras deben seguir funcionando"""
+        response = await self.list_view(AsyncRequestFactory().get("/api/shopping-lists/"))
+        self.assertEqual(response.status_code, 403)
+        response = await self.list_view(
+            AsyncRequestFactory().post(
+                "/api/shopping-lists/",
+                {"title": "Nueva"},
+                content_type="application/json",
+                headers=self.headers,
+            )
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(await ShoppingList.objects.filter(user=self.user).acount(), 2)
+
+    async def test_async_item_and_product_reads(self):
+        """Los ítems y productos también deben servirse de forma asíncrona"""
+        with override_settings(ASYNC_READ_VIEWS=True):
+            items_view = ShoppingListItemViewSet.as_view({"get": "list"})
+            products_view = ProductViewSet.as_view({"get": "list"})
+        response = await items_view(
+            AsyncRequestFactory().get(
+                "/api/shopping-list-items/", {"expand": "product_detail"}, headers=self.headers
+            )
+        )
+        rows = json.loads(response.content)["results"]
+        self.assertEqual(rows[0]["product_detail"]["sku"], "AVENA")
+        response = await products_view(AsyncRequestFactory().get("/api/products/"))
+        self.assertEqual([row["sku"] for row in json.loads(response.content)["results"]], ["AVENA"])
+
+
+class AnalyticsEndpointTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(
+            first_name="Eva", email="eva@example.com", password="secreto123"
+        )
+        self.client = APIClient()
+        self.client.credentials(HTTP_X_USER_ID=str(self.user.pk))
+        self.rice = Product.objects.create(sku="AN-1", name="Arroz")
+        self.beans = Product.objects.create(sku="AN-2", name="Fríjol")
+        january = ShoppingList.objects.create(
+            user=self.user, target_date=date(2030, 1, 5), budget=Decimal("10.00")
+        )
+        january_late = ShoppingList.objects.create(
+            user=self.user, target_date=date(2030, 1, 20), budget=Decimal("5.00")
+        )
+        february = ShoppingList.objects.create(user=self.user, target_date=date(2030, 2, 1))
+        ShoppingListItem.objects.create(
+            shopping_list=january, product=self.rice, quantity=2,
+            unit_price=Decimal("3.00"), is_purchased=True,
+        )
+        ShoppingListItem.objects.create(
+            shopping_list=january_late, product=self.rice, quantity=1,
+            unit_price=Decimal("5.00"), is_purchased=True,
+        )
+        ShoppingListItem.objects.create(
+            shopping_list=january_late, product=self.beans, quantity=4,
+            unit_price=Decimal("1.50"),
+        )
+        ShoppingListItem.objects.create(
+            shopping_list=february, product=self.beans, quantity=1,
+            unit_price=Decimal("2.00"), is_purchased=True,
+        )
+
+    def test_analytics_aggregates_months_budget_and_products(self):
+        """Las analíticas deben agrupar por mes, presupuesto y producto"""
+        with self.assertNumQueries(3):
+            data = self.client.get("/api/analytics/").json()
+
+        self.assertEqual([row["month"] for row in data["months"]], ["2030-01", "2030-02"])
+        january = data["months"][0]
+        self.assertEqual(january["lists"], 2)
+        self.assertEqual(january["within_budget"], 1)
+        self.assertEqual(january["budget_total"], "15.00")
+        self.assertEqual(january["planned"], "17.00")
+        self.assertEqual(january["spent"], "11.00")
+
+        self.assertEqual(data["budget"]["budgeted_lists"], 2)
+        self.assertEqual(data["budget"]["over_budget"], 1)
+        self.assertEqual(data["budget"]["adherence_rate"], 0.5)
+
+        rice, beans = data["products"]
+        self.assertEqual((rice["sku"], rice["purchased_quantity"]), ("AN-1", 3))
+        self.assertEqual(rice["average_unit_price"], "4.00")
+        self.assertEqual((beans["total_quantity"], beans["spent"]), (5, "2.00"))
+
+    def test_analytics_filters_by_year(self):
+        """El parámetro year debe limitar las listas por fecha objetivo"""
+        data = self.client.get("/api/analytics/", {"year": 2031}).json()
+        self.assertEqual((data["months"], data["products"]), ([], []))
+        self.assertIsNone(data["budget"]["adherence_rate"])
+        self.assertEqual(self.client.get("/api/analytics/", {"year": "x"}).status_code, 400)
+
+    @override_settings(RESPONSE_CACHE={"ENABLED": True})
+    def test_analytics_cache_is_invalidated_by_item_writes(self):
+        """Escribir un ítem debe invalidar las analíticas cacheadas"""
+        first = self.client.get("/api/analytics/")
+        with self.assertNumQueries(0):
+            cached = self.client.get("/api/analytics/", HTTP_IF_NONE_MATCH=first["ETag"])
+        self.assertEqual(cached.status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ShoppingListItem.objects.filter(product=self.beans).update(is_purchased=True)
+        data = self.client.get("/api/analytics/").json()
+        self.assertEqual(data["products"][0]["sku"], "AN-2")
+        self.assertEqual(data["months"][0]["spent"], "17.00")
+
+
+class PriceHistoryTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(
+            first_name="Leo", email="leo@example.com", password="secreto123"
+        )
+        self.client = APIClient()
+        self.client.credentials(HTTP_X_USER_ID=str(self.user.pk))
+        self.shopping_list = ShoppingList.objects.create(user=self.user)
+        self.product = Product.objects.create(sku="PH-1", name="Leche")
+        self.item = ShoppingListItem.objects.create(
+            shopping_list=self.shopping_list, product=self.product, unit_price=Decimal("4.00")
+        )
+
+    @override_settings(RESPONSE_CACHE={"ENABLED": True})
+    def test_purchase_invalidates_cached_product_stats(self):
+        """Una compra invalida los productos cacheados, que embeben sus estadísticas"""
+        url = f"/api/products/{self.product.pk}/?expand=price_stats"
+        self.assertIsNone(self.client.get(url).data["price_stats"])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(
+                f"/api/shopping-list-items/{self.item.pk}/", {"is_purchased": True},
+                format="json",
+            )
+        other = APIClient()
+        other.credentials(HTTP_X_USER_ID=str(self.user.pk))
+        self.assertEqual(other.get(url).data["price_stats"]["last_price"], "4.00")
+
+    def test_purchase_records_price_and_updates_stats(self):
+        """Marcar un ítem como comprado debe registrar su precio y las estadísticas"""
+        self.client.patch(
+            f"/api/shopping-list-items/{self.item.pk}/", {"is_purchased": True}, format="json"
+        )
+        self.client.patch(
+            f"/api/shopping-list-items/{self.item.pk}/", {"unit_price": "3.00"}, format="json"
+        )
+        self.client.patch(
+            f"/api/shopping-list-items/{self.item.pk}/", {"quantity": 2}, format="json"
+        )
+        self.assertEqual(
+            list(PriceObservation.objects.values_list("unit_price", flat=True)),
+            [Decimal("3.00"), Decimal("4.00")],
+        )
+        stats = self.client.get(f"/api/products/{self.product.pk}/").data["price_stats"]
+        self.assertEqual(stats["last_price"], "3.00")
+        self.assertEqual(stats["min_price_30d"], "3.00")
+        self.assertEqual(stats["avg_price_30d"], "3.50")
+        self.assertEqual(stats["observations_90d"], 2)
+
+    def test_bulk_purchases_record_only_new_purchases(self):
+        """Las escrituras masivas deben registrar solo las compras nuevas"""
+        other = Product.objects.create(sku="PH-2", name="Pan")
+        ShoppingListItem.objects.create(
+            shopping_list=self.shopping_list, product=other,
+            unit_price=Decimal("2.00"), is_purchased=True,
+        )
+        ShoppingListItem.objects.filter(shopping_list=self.shopping_list).update(
+            is_purchased=True
+        )
+        self.assertEqual(
+            sorted(PriceObservation.objects.values_list("product__sku", "unit_price")),
+            [("PH-1", Decimal("4.00")), ("PH-2", Decimal("2.00"))],
+        )
+        self.assertEqual(self.product.price_stats.last_price, Decimal("4.00"))
+
+    def test_new_items_are_prefilled_with_last_price(self):
+        """Los ítems nuevos sin precio deben tomar el último precio pagado"""
+        self.item.is_purchased = True
+        self.item.save()
+        second = ShoppingList.objects.create(user=self.user)
+        third = ShoppingList.objects.create(user=self.user)
+
+        created = self.client.post(
+            "/api/shopping-list-items/",
+            {"shopping_list": second.pk, "product": self.product.pk},
+            format="json",
+        )
+        self.assertEqual(created.data["unit_price"], "4.00")
+        result = self.client.post(
+            "/api/shopping-list-items/bulk/",
+            {"upsert": [{"shopping_list": third.pk, "product": self.product.pk}]},
+            format="json",
+        ).data
+        item = ShoppingListItem.objects.get(pk=result["upsert"][0]["id"])
+        self.assertEqual(item.unit_price, Decimal("4.00"))
+
+    def test_refresh_ages_out_old_observations(self):
+        """Las ventanas deben excluir observaciones antiguas al refrescarse"""
+        now = timezone.now()
+        PriceObservation.objects.bulk_create([
+            PriceObservation(product=self.product, unit_price=Decimal("1.00"),
+                             observed_at=now - timedelta(days=60)),
+            PriceObservation(product=self.product, unit_price=Decimal("5.00"),
+                             observed_at=now - timedelta(days=5)),
+        ])
+        refresh_price_stats([self.product.pk])
+        stats = ProductPriceStats.objects.get(product=self.product)
+        self.assertEqual(stats.last_price, Decimal("5.00"))
+        self.assertEqual(stats.min_price_30d, Decimal("5.00"))
+        self.assertEqual(stats.min_price_90d, Decimal("1.00"))
+        self.assertEqual(stats.avg_price_90d, Decimal("3.00"))
+
+        ProductPriceStats.objects.update(refreshed_at=now - timedelta(days=2))
+        with mock.patch("django.utils.timezone.now", return_value=now + timedelta(days=100)):
+            call_command("refresh_price_stats", stdout=StringIO())
+        stats.refresh_from_db()
+        self.assertEqual(stats.last_price, Decimal("5.00"))
+        self.assertEqual((stats.min_price_90d, stats.observations_90d), (None, 0))
+
+
+class ShoppingListDuplicateTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(
+            first_name="Sol", email="sol@example.com", password="secreto123"
+        )
+        self.client = APIClient()
+        self.client.credentials(HTTP_X_USER_ID=str(self.user.pk))
+        self.shopping_list = ShoppingList.objects.create(
+            user=self.user, title="Semanal", budget=Decimal("100.00")
+        )
+        self.products = [
+            Product.objects.create(sku=f"DUP-{index}", name=f"Producto {index}")
+            for index in range(30)
+        ]
+        ShoppingListItem.objects.bulk_create(
+            ShoppingListItem(
+                shopping_list=self.shopping_list, product=product, quantity=2,
+                unit_price=Decimal("1.00"), is_purchased=index % 2 == 0,
+            )
+            for index, product in enumerate(self.products)
+        )
+        ProductPriceStats.objects.create(
+            product=self.products[0], last_price=Decimal("2.50"),
+            last_observed_at=timezone.now(),
+        )
+
+    def test_duplicate_copies_items_in_constant_queries(self):
+        """Duplicar debe copiar los ítems con un número fijo de consultas"""
+        with self.assertNumQueries(12):
+            response = self.client.post(
+                f"/api/shopping-lists/{self.shopping_list.pk}/duplicate/",
+                {"title": "Semana 2"},
+                format="json",
+            )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data["title"], "Semana 2")
+        self.assertEqual(response.data["budget"], "100.00")
+        self.assertEqual(response.data["total_items"], 30)
+        self.assertEqual(response.data["purchased_items"], 0)
+        self.assertEqual(response.data["total_cost"], "60.00")
+        self.assertEqual(len(response.data["items"]), 30)
+
+    def test_template_keeps_purchases_and_refreshes_prices(self):
+        """Las opciones deben conservar compras, crear plantillas y refrescar precios"""
+        response = self.client.post(
+            f"/api/shopping-lists/{self.shopping_list.pk}/duplicate/",
+            {"is_template": True, "reset_purchased": False, "refresh_prices": True},
+            format="json",
+        )
+        template = ShoppingList.objects.get(pk=response.data["id"])
+        self.assertTrue(template.is_template)
+        self.assertEqual(template.purchased_items, 15)
+        self.assertEqual(
+            template.items.get(product=self.products[0]).unit_price, Decimal("2.50")
+        )
+        self.assertEqual(template.total_cost, Decimal("63.00"))
+
+        templates = self.client.get("/api/shopping-lists/", {"is_template": "true"}).data
+        self.assertEqual([row["id"] for row in templates["results"]], [template.pk])
+
+    def test_duplicate_rejects_foreign_lists(self):
+        """No se deben poder duplicar listas de otros usuarios"""
+        other = User.objects.create(first_name="Ana", email="ana@example.com", password="x")
+        self.client.credentials(HTTP_X_USER_ID=str(other.pk))
+        response = self.client.post(
+            f"/api/shopping-lists/{self.shopping_list.pk}/duplicate/", {}, format="json"
+        )
+        self.assertEqual(response.status_code, 404)
+
+
+class ShoppingListCheckoutTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(
+            first_name="Eva", email="eva@example.com", password="secreto123"
+        )
+        self.other = User.objects.create(
+            first_name="Leo", email="leo@example.com", password="secreto123"
+        )
+        self.client = APIClient()
+        self.client.credentials(HTTP_X_USER_ID=str(self.user.pk))
+        self.shopping_list = ShoppingList.objects.create(user=self.user, title="Mercado")
+        self.foreign_list = ShoppingList.objects.create(user=self.other, title="Ajena")
+        self.products = [
+            Product.objects.create(sku=f"CHK-{index}", name=f"Producto {index}")
+            for index in range(200)
+        ]
+        ShoppingListItem.objects.bulk_create(
+            ShoppingListItem(
+                shopping_list=self.shopping_list, product=product, quantity=1,
+                unit_price=Decimal("2.00"), is_purchased=index < 50,
+            )
+            for index, product in enumerate(self.products)
+        )
+        self.foreign_item = ShoppingListItem.objects.create(
+            shopping_list=self.foreign_list, product=self.products[0],
+            unit_price=Decimal("2.00"),
+        )
+
+    def _post(self, shopping_list, action, data=None):
+        return self.client.post(
+            f"/api/shopping-lists/{shopping_list.pk}/{action}/", data or {}, format="json"
+        )
+
+    def test_mark_all_purchased_is_one_round_trip(self):
+        """Marcar toda la lista debe usar consultas constantes y devolver los totales"""
+        already_purchased = ShoppingListItem.objects.filter(
+            shopping_list=self.shopping_list, is_purchased=True
+        ).first()
+        with self.assertNumQueries(13):
+            response = self._post(self.shopping_list, "mark-purchased")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["affected_items"], 150)
+        self.assertEqual(response.data["list"]["purchased_items"], 200)
+        self.assertEqual(response.data["list"]["total_spent"], "400.00")
+        self.assertNotIn("items", response.data["list"])
+        self.assertEqual(PriceObservation.objects.count(), 150)
+        # Items that were already purchased keep their updated_at.
+        updated_at = already_purchased.updated_at
+        already_purchased.refresh_from_db()
+        self.assertEqual(already_purchased.updated_at, updated_at)
+
+    def test_mark_given_ids_only_touches_owned_items(self):
+        """Solo deben marcarse los ítems indicados de la lista del usuario"""
+        pending = list(
+            ShoppingListItem.objects.filter(
+                shopping_list=self.shopping_list, is_purchased=False
+            ).values_list("pk", flat=True)[:3]
+        )
+        response = self._post(
+            self.shopping_list, "mark-purchased", {"ids": pending + [self.foreign_item.pk]}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["affected_items"], 3)
+        self.assertEqual(response.data["list"]["purchased_items"], 53)
+        self.foreign_item.refresh_from_db()
+        self.assertFalse(self.foreign_item.is_purchased)
+
+        response = self._post(self.shopping_list, "mark-purchased", {"ids": []})
+        self.assertEqual(response.status_code, 400)
+        response = self._post(self.foreign_list, "mark-purchased")
+        self.assertEqual(response.status_code, 404)
+        self.foreign_item.refresh_from_db()
+        self.assertFalse(self.foreign_item.is_purchased)
+
+    def test_reset_and_clear_purchased(self):
+        """Reiniciar y vaciar comprados deben actualizar los totales y las lápidas"""
+        with self.assertNumQueries(8):
+            response = self._post(self.shopping_list, "clear-purchased")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["affected_items"], 50)
+        self.assertEqual(response.data["list"]["total_items"], 150)
+        self.assertEqual(response.data["list"]["total_cost"], "300.00")
+        self.assertEqual(
+            DeletedRecord.objects.filter(
+                user=self.user, model=DeletedRecord.SHOPPING_LIST_ITEM
+            ).count(),
+            50,
+        )
+
+        self._post(self.shopping_list, "mark-purchased")
+        with self.assertNumQueries(6):
+            response = self._post(self.shopping_list, "reset")
+        self.assertEqual(response.data["affected_items"], 150)
+        self.assertEqual(response.data["list"]["purchased_items"], 0)
+        self.assertEqual(response.data["list"]["total_spent"], "0.00")
+
+        self.assertEqual(self._post(self.foreign_list, "clear-purchased").status_code, 404)
+        self.assertTrue(ShoppingListItem.objects.filter(pk=self.foreign_item.pk).exists())
+        for path in ("reset", "clear-purchased", "mark-purchased"):
+            response = self.client.post(f"/api/shopping-lists/abc/{path}/", format="json")
+            self.assertEqual(response.status_code, 404)
+
+
+class JobQueueTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(
+            first_name="Rita", email="rita@example.com", password="secreto123"
+        )
+        self.other = User.objects.create(
+            first_name="Tom", email="tom@example.com", password="secreto123"
+        )
+        self.client = APIClient()
+        self.client.credentials(HTTP_X_USER_ID=str(self.user.pk))
+        self.media = use_temp_media(self)
+
+    def test_import_is_enqueued_and_polled(self):
+        """La importación debe encolarse, ejecutarse en el worker y consultarse"""
+        upload = SimpleUploadedFile(
+            "catalogo.csv",
+            "sku,name,description\nJOB-1,Arroz,\nJOB-2,Lentejas,\n,Sin sku,\n".encode(),
+            content_type="text/csv",
+        )
+        response = self.client.post(
+            "/api/jobs/", {"kind": "import_products", "file": upload}, format="multipart"
+        )
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data["status"], "queued")
+        self.assertTrue(response["Location"].endswith(f"/api/jobs/{response.data['id']}/"))
+        self.assertFalse(Product.objects.filter(sku="JOB-1").exists())
+        # The upload waits in storage, not in the row.
+        job = Job.objects.get(pk=response.data["id"])
+        self.assertTrue(job.upload.name.startswith("jobs/"))
+        self.assertEqual(len(os.listdir(os.path.join(self.media, "jobs"))), 1)
+
+        self.assertEqual(work(worker="test", once=True), 1)
+
+        response = self.client.get(f"/api/jobs/{response.data['id']}/")
+        self.assertEqual(response.data["status"], "succeeded")
+        self.assertEqual(response.data["attempts"], 1)
+        self.assertEqual(response.data["progress"], 3)
+        self.assertEqual(response.data["progress_total"], 3)
+        self.assertEqual(response.data["result"]["imported"], 2)
+        self.assertEqual(response.data["result"]["error_count"], 1)
+        self.assertEqual(Product.objects.filter(sku__startswith="JOB-").count(), 2)
+        self.assertFalse(Job.objects.get(pk=response.data["id"]).upload)
+        self.assertEqual(os.listdir(os.path.join(self.media, "jobs")), [])
+
+    def test_catalogue_wide_refresh_is_not_public(self):
+        """La API solo encola el refresco de estadísticas vencidas, nunca el de todo el catálogo"""
+        response = self.client.post(
+            "/api/jobs/", {"kind": "refresh_price_stats", "all": True}, format="json"
+        )
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(Job.objects.get().payload, {})
+
+    def test_jobs_are_validated_and_scoped_to_the_user(self):
+        """Las tareas se validan al encolar y solo las ve su dueño"""
+        response = self.client.post("/api/jobs/", {"kind": "import_products"}, format="json")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("file", response.data)
+        response = self.client.post("/api/jobs/", {"kind": "unknown"}, format="json")
+        self.assertEqual(response.status_code, 400)
+
+        foreign = enqueue(Job.ANALYTICS, user=self.other)
+        response = self.client.post(
+            "/api/jobs/", {"kind": "analytics", "year": 2030}, format="json"
+        )
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(self.client.get(f"/api/jobs/{foreign.pk}/").status_code, 404)
+        listed = self.client.get("/api/jobs/").data["results"]
+        self.assertEqual([job["id"] for job in listed], [response.data["id"]])
+
+        self.assertEqual(work(worker="test", once=True), 2)
+        response = self.client.get(f"/api/jobs/{response.data['id']}/")
+        self.assertEqual(response.data["status"], "succeeded")
+        self.assertEqual(response.data["result"]["year"], 2030)
+
+    def test_claims_follow_priority_and_never_overlap(self):
+        """Los workers deben tomar primero la prioridad más alta y nunca la misma tarea"""
+        low = enqueue(Job.REFRESH_PRICE_STATS)
+        high = enqueue(Job.REFRESH_PRICE_STATS, priority=5)
+        later = enqueue(Job.REFRESH_PRICE_STATS, priority=10)
+        Job.objects.filter(pk=later.pk).update(run_after=timezone.now() + timedelta(hours=1))
+
+        first, second = claim_job("a"), claim_job("b")
+        self.assertEqual((first.pk, second.pk), (high.pk, low.pk))
+        self.assertEqual((first.status, first.worker, first.attempts), ("running", "a", 1))
+        self.assertIsNone(claim_job("c"))
+
+    def test_failed_jobs_are_retried_with_backoff(self):
+        """Una tarea fallida se reintenta con espera creciente hasta agotar intentos"""
+        job = enqueue(Job.ANALYTICS, user=self.user, max_attempts=2)
+        failing = mock.Mock(side_effect=RuntimeError("sin conexión"))
+        with mock.patch.dict(HANDLERS, {Job.ANALYTICS: failing}), \
+                self.assertLogs("tu_canasta.jobs", "ERROR"):
+            run_job(claim_job("test"))
+            job.refresh_from_db()
+            self.assertEqual(job.status, "queued")
+            self.assertEqual(job.error, "RuntimeError: sin conexión")
+            self.assertGreater(job.run_after, timezone.now())
+            self.assertIsNone(claim_job("test"))
+
+            Job.objects.filter(pk=job.pk).update(run_after=timezone.now())
+            run_job(claim_job("test"))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ("failed", 2))
+        self.assertIsNotNone(job.finished_at)
+
+    def test_jobs_of_silent_workers_are_requeued(self):
+        """Las tareas de un worker sin latido vuelven a la cola o fallan sin intentos"""
+        retried = enqueue(Job.REFRESH_PRICE_STATS)
+        exhausted = enqueue(Job.REFRESH_PRICE_STATS, max_attempts=1)
+        claim_job("dead"), claim_job("dead")
+        later = timezone.now() + timedelta(hours=1)
+        self.assertEqual(requeue_stale_jobs(now=later), 1)
+        retried.refresh_from_db()
+        exhausted.refresh_from_db()
+        self.assertEqual((retried.status, retried.worker), ("queued", ""))
+        self.assertEqual(exhausted.status, "failed")
+
+    def test_requeued_job_keeps_the_new_claim(self):
+        """Un worker lento cuya tarea volvió a la cola no pisa la ejecución del nuevo worker"""
+        enqueue(Job.REFRESH_PRICE_STATS)
+        slow = claim_job("lento")
+        Job.objects.update(heartbeat_at=timezone.now() - timedelta(hours=1))
+        requeue_stale_jobs()
+        fresh = claim_job("nuevo")
+        with self.assertLogs("tu_canasta.jobs", "WARNING"):
+            run_job(slow)
+        self.assertEqual((slow.status, slow.worker), ("running", "nuevo"))
+        fresh.refresh_from_db()
+        self.assertEqual((fresh.status, fresh.worker, fresh.result), ("running", "nuevo", None))
+
+        run_job(fresh)
+        fresh.refresh_from_db()
+        self.assertEqual((fresh.status, fresh.result), ("succeeded", {"refreshed": 0}))
+
+    def test_worker_requires_a_shared_cache_for_cached_responses(self):
+        """Con la caché de respuestas activa el worker no arranca sobre una caché por proceso"""
+        with override_settings(RESPONSE_CACHE={"ENABLED": True}):
+            with self.assertRaises(CommandError):
+                call_command("run_worker", "--once", stdout=StringIO())
+
+    def test_repair_job_only_touches_the_users_lists(self):
+        """La reparación encolada por un usuario solo corrige sus listas"""
+        product = Product.objects.create(sku="JOB-REP", name="Sal")
+        own = ShoppingList.objects.create(user=self.user)
+        foreign = ShoppingList.objects.create(user=self.other)
+        for shopping_list in (own, foreign):
+            ShoppingListItem.objects.create(shopping_list=shopping_list, product=product)
+        ShoppingList.objects.update(item_count=7)
+
+        self.client.post("/api/jobs/", {"kind": "repair_list_totals"}, format="json")
+        out = StringIO()
+        call_command("run_worker", "--once", "--name", "test", stdout=out)
+        self.assertIn("1 tareas procesadas por test.", out.getvalue())
+
+        job = Job.objects.get()
+        self.assertEqual(job.result, {"checked": 1, "repaired": 1})
+        self.assertEqual((job.progress, job.progress_total), (1, 1))
+        own.refresh_from_db()
+        foreign.refresh_from_db()
+        self.assertEqual((own.item_count, foreign.item_count), (1, 7))
+
+
+class RecordingBroker(InProcessBroker):
+    """Local stand-in for the list events broker that keeps what was published."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.published = []
+
+    def publish(self, shopping_list_id, event_type, data):
+        self.published.append((shopping_list_id, event_type, data))
+        return super().publish(shopping_list_id, event_type, data)
+
+
+class ListEventsTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        # A fresh stand-in broker per test.
+        self.enterContext(override_settings(
+            LIST_EVENTS={"BROKER": "tu_canasta.tests.RecordingBroker", "HISTORY": 3}
+        ))
+        get_user_resolver().backend.clear()
+        self.user = User.objects.create(
+            first_name="Ada", email="ada@example.com", password="secreto123"
+        )
+        self.other = User.objects.create(
+            first_name="Bea", email="bea@example.com", password="secreto123"
+        )
+        self.product = Product.objects.create(sku="SSE-1", name="Pan")
+        self.shopping_list = ShoppingList.objects.create(user=self.user, title="Casa")
+        self.second_list = ShoppingList.objects.create(user=self.user, title="Finca")
+        self.foreign_list = ShoppingList.objects.create(user=self.other, title="Ajena")
+        self.headers = {"X-USER-ID": str(self.user.pk)}
+        self.broker = get_list_broker()
+
+    def _events(self, body):
+        """Parse a text/event-stream body into (id, event, data) tuples."""
+        events = []
+        for block in body.decode().strip().split("\n\n"):
+            fields = dict(line.split(": ", 1) for line in block.splitlines() if ": " in line)
+            if "event" in fields:
+                events.append((fields.get("id"), fields["event"], json.loads(fields["data"])))
+        return events
+
+    def test_item_writes_publish_item_diffs_after_commit(self):
+        """Crear, editar, mover y borrar ítems debe publicar diferencias por ítem"""
+        # Polled by a client, as the WSGI fallback does.
+        self.broker.replay(self.shopping_list.pk)
+        self.broker.replay(self.second_list.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            item = ShoppingListItem.objects.create(
+                shopping_list=self.shopping_list, product=self.product, unit_price=Decimal("2")
+            )
+            self.assertEqual(self.broker.published, [])
+        with self.captureOnCommitCallbacks(execute=True):
+            item.quantity = 3
+            item.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            item.shopping_list = self.second_list
+            item.save(update_fields=["shopping_list", "updated_at"])
+        with self.captureOnCommitCallbacks(execute=True):
+            item.delete()
+        # Outside captureOnCommitCallbacks: never committed, never published.
+        ShoppingListItem.objects.bulk_create([ShoppingListItem(
+            shopping_list=self.shopping_list, product=self.product, is_purchased=True
+        )])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(
+                f"/api/shopping-lists/{self.shopping_list.pk}/reset/", headers=self.headers
+            )
+
+        published = [(list_id, event) for list_id, event, _ in self.broker.published]
+        self.assertEqual(published, [
+            (self.shopping_list.pk, "item.created"),
+            (self.shopping_list.pk, "item.updated"),
+            (self.shopping_list.pk, "item.deleted"),
+            (self.second_list.pk, "item.created"),
+            (self.second_list.pk, "item.deleted"),
+            (self.shopping_list.pk, "items.changed"),
+        ])
+        updated = self.broker.published[1][2]
+        self.assertEqual(updated["quantity"], 3)
+        self.assertEqual(updated["total_price"], "6.00")
+        self.assertNotIn("product_detail", updated)
+
+    def test_unwatched_lists_skip_item_serialization(self):
+        """Sin nadie siguiendo la lista no se serializa el ítem y se publica items.changed"""
+        with mock.patch(
+            "tu_canasta.signals.ShoppingListItemEventSerializer"
+        ) as serializer, self.captureOnCommitCallbacks(execute=True):
+            ShoppingListItem.objects.create(shopping_list=self.shopping_list, product=self.product)
+        serializer.assert_not_called()
+        self.assertEqual(self.broker.published, [
+            (self.shopping_list.pk, "items.changed", {"shopping_list": self.shopping_list.pk}),
+        ])
+
+    def test_reconnect_resumes_from_cursor_or_asks_for_resync(self):
+        """Reconectar con Last-Event-ID debe entregar lo perdido o pedir recargar"""
+        url = f"/api/shopping-lists/{self.shopping_list.pk}/events/"
+        response = self.client.get(url, headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        self.assertTrue(response.content.startswith(b"retry: "))
+        [(cursor, event, _)] = self._events(response.content)
+        self.assertEqual(event, "ready")
+
+        self.broker.publish(self.shopping_list.pk, "item.deleted", {"id": 1})
+        self.broker.publish(self.second_list.pk, "item.deleted", {"id": 2})
+        response = self.client.get(url, headers={**self.headers, "Last-Event-ID": cursor})
+        events = self._events(response.content)
+        self.assertEqual([(event, data) for _, event, data in events][:1],
+                         [("item.deleted", {"id": 1})])
+        self.assertEqual(events[-1][1], "ready")
+
+        # Older than the history kept for the list, or issued by another process.
+        for index in range(4):
+            self.broker.publish(self.shopping_list.pk, "item.deleted", {"id": 10 + index})
+        for stale in (cursor, "otro-proceso-5"):
+            response = self.client.get(url, {"last_event_id": stale}, headers=self.headers)
+            self.assertEqual(
+                [event for _, event, _ in self._events(response.content)], ["resync", "ready"]
+            )
+        # Another process's cursor for a list this process has not seen change.
+        quiet = ShoppingList.objects.create(user=self.user, title="Quieta")
+        response = self.client.get(
+            f"/api/shopping-lists/{quiet.pk}/events/",
+            {"last_event_id": "otro-proceso-5"}, headers=self.headers,
+        )
+        self.assertEqual([event for _, event, _ in self._events(response.content)], ["ready"])
+
+        response = self.client.get(
+            f"/api/shopping-lists/{self.foreign_list.pk}/events/", headers=self.headers
+        )
+        self.assertEqual(response.status_code, 404)
+
+    async def test_async_stream_pushes_live_events(self):
+        """Bajo ASGI el flujo debe quedar abierto y empujar los eventos en vivo"""
+        with override_settings(ASYNC_READ_VIEWS=True):
+            view = ShoppingListViewSet.as_view({"get": "events"})
+        self.assertTrue(iscoroutinefunction(view))
+        response = await view(
+            AsyncRequestFactory().get(
+                f"/api/shopping-lists/{self.shopping_list.pk}/events/", headers=self.headers
+            ),
+            pk=str(self.shopping_list.pk),
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Cache-Control"], "no-cache")
+        stream = response.streaming_content
+        self.assertTrue((await anext(stream)).startswith(b"retry: "))
+        self.assertEqual(self._events(await anext(stream))[0][1], "ready")
+
+        await sync_to_async(self.broker.publish)(
+            self.second_list.pk, "item.deleted", {"id": 1}
+        )
+        await sync_to_async(self.broker.publish)(
+            self.shopping_list.pk, "item.updated", {"id": 2, "quantity": 4}
+        )
+        [(event_id, event, data)] = self._events(await anext(stream))
+        self.assertEqual((event, data), ("item.updated", {"id": 2, "quantity": 4}))
+        self.assertIsNotNone(event_id)
+
+        # A client disconnect cancels the pending read, which unsubscribes.
+        pending = asyncio.ensure_future(anext(stream))
+        await asyncio.sleep(0)
+        pending.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await pending
+        self.assertEqual(dict(self.broker._subscriptions), {})
+
+
+@override_settings(PASSWORD_HASHERS=[
+    # MD5 is not a password hash; it keeps these tests fast.
+    "django.contrib.auth.hashers.MD5PasswordHasher",
+    "tu_canasta.hashers.TunedArgon2PasswordHasher",
+])
+class PasswordHashingTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def test_save_hashes_raw_passwords_only(self):
+        """Guardar por el ORM cifra contraseñas en claro y conserva hashes e inutilizables"""
+        user = User.objects.create(
+            first_name="Ana", email="ana@example.com", password="secreto123"
+        )
+        self.assertTrue(user.password.startswith("md5$"))
+        hashed = user.password
+        user.first_name = "Ana María"
+        user.save()
+        self.assertEqual(user.password, hashed)
+
+        unusable = User.objects.create(first_name="Sin", email="sin@example.com", password="!abc")
+        self.assertEqual(unusable.password, "!abc")
+
+    @override_settings(PASSWORD_HASHERS=[
+        "django.contrib.auth.hashers.MD5PasswordHasher",
+        "django.contrib.auth.hashers.PBKDF2PasswordHasher",
+    ])
+    def test_login_upgrades_outdated_hash(self):
+        """El login acepta hashes antiguos y los reemplaza por el hasher preferido"""
+        user = User.objects.create(
+            first_name="Leo", email="leo@example.com",
+            password=make_password("secreto123", hasher="pbkdf2_sha256"),
+        )
+        response = self.client.post(
+            "/api/users/login/", {"email": "leo@example.com", "password": "secreto123"},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["id"], user.pk)
+        self.assertNotIn("password", response.data)
+        user.refresh_from_db()
+        self.assertTrue(user.password.startswith("md5$"))
+
+        response = self.client.post(
+            "/api/users/login/", {"email": "leo@example.com", "password": "otra"},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(
+            "/api/users/login/", {"email": "nadie@example.com", "password": "otra"},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_sync_hashing_stays_on_the_calling_thread(self):
+        """Con WSGI el hash se calcula en el hilo de la petición, sin pasar por el pool"""
+        with mock.patch(
+            "tu_canasta.passwords._hashing_pool", side_effect=AssertionError("pool")
+        ):
+            encoded = hash_password("secreto123")
+            self.assertEqual(verify_password("secreto123", encoded), (True, False))
+            self.assertEqual(verify_password("otra", encoded), (False, False))
+
+    def test_unknown_hasher_profile_is_refused(self):
+        """Un PASSWORD_HASHER desconocido impide arrancar y lista los perfiles válidos"""
+        with mock.patch.dict(os.environ, {"PASSWORD_HASHER": "md5"}):
+            with self.assertRaisesMessage(ImproperlyConfigured, "argon2, scrypt, pbkdf2"):
+                runpy.run_module(os.environ["DJANGO_SETTINGS_MODULE"])
+
+    async def test_async_signup_and_login_await_the_pool(self):
+        """Bajo ASGI el registro y el login esperan el hashing sin bloquear el hilo síncrono"""
+        with override_settings(ASYNC_READ_VIEWS=True):
+            create_view = UserViewSet.as_view({"post": "create"})
+            login_view = UserViewSet.as_view(
+                {"post": "login"}, **UserViewSet.login.kwargs
+            )
+        self.assertTrue(iscoroutinefunction(login_view))
+        blocking = mock.patch(
+            "tu_canasta.passwords.hash_password", side_effect=AssertionError("bloqueante")
+        )
+        with blocking, mock.patch(
+            "tu_canasta.views.authenticate", side_effect=AssertionError("bloqueante")
+        ):
+            response = await create_view(AsyncRequestFactory().post(
+                "/api/users/",
+                {"first_name": "Sol", "email": "sol@example.com", "password": "secreto123"},
+                content_type="application/json",
+            ))
+            self.assertEqual(response.status_code, 201)
+            user = await User.objects.aget(email="sol@example.com")
+            self.assertTrue(user.password.startswith("md5$"))
+            self.assertTrue(check_password("secreto123", user.password))
+
+            response = await login_view(AsyncRequestFactory().post(
+                "/api/users/login/",
+                {"email": "sol@example.com", "password": "secreto123"},
+                content_type="application/json",
+            ))
+            self.assertEqual(json.loads(response.content)["id"], user.pk)
+            response = await login_view(AsyncRequestFactory().post(
+                "/api/users/login/",
+                {"email": "sol@example.com", "password": "otra"},
+                content_type="application/json",
+            ))
+            self.assertEqual(response.status_code, 400)
+
+    def test_import_users_hashes_and_reports_duplicates(self):
+        """import_users cifra las contraseñas de cada lote y omite correos existentes"""
+        User.objects.create(first_name="Ana", email="ana@example.com", password="secreto123")
+        rows = "first_name,last_name,email,password\n" + "".join(
+            f"Usuario,{index},u{index}@example.com,clave{index}\n" for index in range(5)
+        ) + "Ana,,ana@example.com,otra\nSin,,no-es-correo,clave\n"
+        with tempfile.NamedTemporaryFile("w", suffix=".csv", delete=False) as handle:
+            handle.write(rows)
+        self.addCleanup(os.remove, handle.name)
+        out, err = StringIO(), StringIO()
+        call_command("import_users", handle.name, "--chunk-size", "3", stdout=out, stderr=err)
+
+        self.assertIn("7 filas procesadas, 5 usuarios creados, 2 con errores.", out.getvalue())
+        self.assertIn("Línea 7", err.getvalue())
+        self.assertIn("Línea 8", err.getvalue())
+        user = User.objects.get(email="u3@example.com")
+        self.assertTrue(check_password("clave3", user.password))
+        self.assertEqual(User.objects.count(), 6)
+
+
+class QueryPlanTest(TestCase):
+    """EXPLAIN de las consultas frecuentes sobre una base con miles de ítems."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.fixtures = seed_fixtures(users=40, lists_per_user=10, items_per_list=20, products=500)
+        ShoppingList.objects.filter(pk=cls.fixtures.list_id).update(is_template=True)
+        now = timezone.now()
+        ProductPriceStats.objects.bulk_create(
+            ProductPriceStats(product=product, last_price=Decimal("1.00"), last_observed_at=now)
+            for product in Product.objects.all()[:300]
+        )
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+
+    def assertUsesIndex(self, queryset, index_name, table):
+        plan = queryset.explain()
+        self.assertIn(index_name, plan)
+        self.assertNotRegex(plan, rf"(^|\s)SCAN {table}\b|Seq Scan on {table}\b")
+
+    def test_hot_queries_use_indexes(self):
+        """Listas, ítems pendientes/comprados, plantillas y estadísticas usan sus índices"""
+        user_id, list_id = self.fixtures.user_id, self.fixtures.list_id
+        lists = ShoppingList.objects.filter(user_id=user_id).order_by(
+            "-target_date", "-updated_at", "-id"
+        )
+        items = ShoppingListItem.objects.filter(shopping_list_id=list_id).order_by(
+            "-updated_at", "-id"
+        )
+        cases = [
+            (lists[:51], "shoplist_user_keyset_idx", "tu_canasta_shoppinglist"),
+            (lists.filter(is_template=True)[:51], "shoplist_user_template_idx",
+             "tu_canasta_shoppinglist"),
+            (items[:51], "item_list_updated_keyset_idx", "tu_canasta_shoppinglistitem"),
+            (items.filter(is_purchased=False)[:51], "item_list_pending_idx",
+             "tu_canasta_shoppinglistitem"),
+            (items.filter(is_purchased=True)[:51], "item_list_purchased_idx",
+             "tu_canasta_shoppinglistitem"),
+            (ShoppingListItem.objects.filter(shopping_list__user_id=user_id, is_purchased=False)
+             .order_by("-updated_at", "-id")[:51], "item_list_pending_idx",
+             "tu_canasta_shoppinglistitem"),
+            (stale_price_stats(timezone.now() + timedelta(days=2)), "pricestats_refreshed_idx",
+             "tu_canasta_productpricestats"),
+        ]
+        since = (timezone.now() - timedelta(minutes=5), 0)
+        sync_cases = [
+            (ShoppingList.objects.filter(user_id=user_id), "shoplist_user_sync_idx",
+             "tu_canasta_shoppinglist"),
+            (ShoppingListItem.objects.filter(shopping_list__user_id=user_id),
+             "item_list_updated_keyset_idx", "tu_canasta_shoppinglistitem"),
+        ]
+        for queryset, index_name, table in cases:
+            with self.subTest(index=index_name):
+                self.assertUsesIndex(queryset, index_name, table)
+        for queryset, index_name, table in sync_cases:
+            with self.subTest(sync=index_name):
+                queryset = changed_since(queryset, "updated_at", since)[:501]
+                self.assertUsesIndex(queryset, index_name, table)
+                # The cursor bounds the index range instead of filtering its rows.
+                self.assertRegex(queryset.explain(), rf"{index_name}.*\n?.*updated_at ?>")
+
+    @skipUnless(connection.vendor == "postgresql", "índices pg_trgm de PostgreSQL")
+    def test_autocomplete_prefix_uses_trigram_indexes(self):
+        """El autocompletado por prefijo lo sirven los índices de trigramas, sin recorrer la tabla"""
+        with connection.cursor() as cursor:
+            # The table is small enough that a scan would win on cost alone.
+            cursor.execute("SET LOCAL enable_seqscan = off")
+        plan = _prefix_matches("prod", connection).explain()
+        self.assertIn("product_name_trgm_idx", plan)
+        self.assertIn("product_sku_trgm_idx", plan)
+        self.assertNotIn("Seq Scan on tu_canasta_product", plan)
+
+    def test_is_purchased_filter(self):
+        """?is_purchased= filtra los ítems del usuario y los de una lista"""
+        cache.clear()
+        client = APIClient()
+        client.credentials(HTTP_X_USER_ID=str(self.fixtures.user_id))
+        response = client.get(
+            f"/api/shopping-lists/{self.fixtures.list_id}/items/?is_purchased=false"
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data["results"]), 10)
+        self.assertFalse(any(item["is_purchased"] for item in response.data["results"]))
+        response = client.get("/api/shopping-list-items/?is_purchased=true&page_size=200")
+        self.assertEqual(len(response.data["results"]), 100)
+        self.assertTrue(all(item["is_purchased"] for item in response.data["results"]))
+
+
+def use_shared_cache(test_case) -> str:
+    """Añade al test un alias de caché en disco, compartible entre procesos"""
+    location = tempfile.mkdtemp()
+    test_case.addCleanup(shutil.rmtree, location, ignore_errors=True)
+    test_case.enterContext(override_settings(CACHES={
+        **settings.CACHES,
+        "shared": {
+            "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+            "LOCATION": location,
+        },
+    }))
+    return "shared"
+
+
+def use_temp_media(test_case) -> str:
+    """Guarda los archivos subidos del test en un directorio temporal"""
+    location = tempfile.mkdtemp()
+    test_case.addCleanup(shutil.rmtree, location, ignore_errors=True)
+    test_case.enterContext(override_settings(MEDIA_ROOT=location))
+    return location
+
+
+class ReplicaRoutingTest(TransactionTestCase):
+    databases = {"default", "replica"}
+
+    def setUp(self):
+        cache.clear()
+        self.enterContext(override_settings(REPLICA_ROUTING={
+            "ALIAS": "replica", "STICKY_SECONDS": 5, "CACHE": use_shared_cache(self),
+        }))
+        self.user = User.objects.create(
+            first_name="Eva", email="eva@example.com", password="secreto123"
+        )
+        self.other = User.objects.create(first_name="Ian", email="ian@example.com", password="x")
+        self.shopping_list = ShoppingList.objects.create(user=self.user, title="Semanal")
+        # Resolver misses read the primary on purpose; warm them up.
+        get_user_resolver().resolve(self.user.pk)
+        get_user_resolver().resolve(self.other.pk)
+        self.client = APIClient()
+        self.client.credentials(HTTP_X_USER_ID=str(self.user.pk))
+
+    def _aliases(self, method, path, data=None):
+        """Ejecuta la petición y devuelve (respuesta, consultas en default, en replica)"""
+        with CaptureQueriesContext(connections["default"]) as primary, \
+                CaptureQueriesContext(connections["replica"]) as replica:
+            response = getattr(self.client, method)(path, data, format="json")
+        return response, len(primary), len(replica)
+
+    def test_reads_go_to_replica_until_the_user_writes(self):
+        """Los GET de la API leen de la réplica salvo justo después de una escritura"""
+        response, primary, replica = self._aliases("get", "/api/shopping-lists/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data["results"]), 1)
+        self.assertEqual(primary, 0)
+        self.assertGreater(replica, 0)
+
+        response, primary, replica = self._aliases(
+            "patch", f"/api/shopping-lists/{self.shopping_list.pk}/", {"title": "Nueva"}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(replica, 0)
+
+        response, primary, replica = self._aliases("get", "/api/shopping-list-items/")
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(primary, 0)
+        self.assertEqual(replica, 0)
+
+        # Other users are not pinned.
+        self.client.credentials(HTTP_X_USER_ID=str(self.other.pk))
+        response, primary, replica = self._aliases("get", "/api/shopping-list-items/")
+        self.assertEqual(primary, 0)
+        self.assertGreater(replica, 0)
+
+    @override_settings(RESPONSE_CACHE={"ENABLED": True})
+    def test_response_cache_misses_read_the_primary(self):
+        """Un fallo de la caché de respuestas lee del primario para no guardar datos atrasados"""
+        Product.objects.create(sku="CAFE", name="Café")
+        response, primary, replica = self._aliases("get", "/api/products/")
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(primary, 0)
+        self.assertEqual(replica, 0)
+        response, primary, replica = self._aliases("get", "/api/products/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(replica, 0)
+
+    def test_requires_a_shared_pin_cache(self):
+        """Sin una caché compartida para los pines el enrutado a la réplica no arranca"""
+        with override_settings(REPLICA_ROUTING={"ALIAS": "replica", "CACHE": "default"}):
+            with self.assertRaises(ImproperlyConfigured):
+                self.client.get("/api/shopping-lists/")
+
+    def test_no_replica_configured(self):
+        """Sin réplica configurada todo se lee del primario"""
+        with override_settings(REPLICA_ROUTING={"ALIAS": None}):
+            response, primary, replica = self._aliases("get", "/api/shopping-lists/")
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(primary, 0)
+        self.assertEqual(replica, 0)
+
+
+class FastRenderingTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(first_name="Noa", email="noa@example.com", password="x")
+        self.shopping_list = ShoppingList.objects.create(
+            user=self.user, title="Mercado", target_date=date(2030, 5, 1),
+            budget=Decimal("80.00"),
+        )
+        products = [
+            Product.objects.create(sku="FAST-1", name="Café", description="Línea\u2028nueva"),
+            Product.objects.create(sku="FAST-2", name="Té"),
+        ]
+        ProductPriceStats.objects.create(
+            product=products[0], last_price=Decimal("3.10"), last_observed_at=timezone.now(),
+            avg_price_30d=Decimal("3.05"), observations_90d=4,
+        )
+        for index, product in enumerate(products):
+            ShoppingListItem.objects.create(
+                shopping_list=self.shopping_list, product=product, quantity=index + 1,
+                unit_price=Decimal("2.50"), is_purchased=index == 0,
+            )
+
+    def test_fast_serializers_and_orjson_match_drf(self):
+        """La ruta rápida y orjson producen exactamente los mismos bytes que DRF"""
+        shopping_list = ShoppingList.objects.prefetch_related(
+            Prefetch("items__product", Product.objects.select_related("price_stats"))
+        ).get(pk=self.shopping_list.pk)
+        with override_settings(FAST_READ_SERIALIZERS=False):
+            expected = ShoppingListSerializer(shopping_list).data
+        fast = ShoppingListSerializer(shopping_list).data
+        self.assertEqual(fast, expected)
+        self.assertEqual(
+            ORJSONRenderer().render(fast), JSONRenderer().render(expected)
+        )
+        self.assertIn(b"\\u2028", ORJSONRenderer().render(fast))
+        self.assertEqual(
+            ORJSONRenderer().render({"total": Decimal("1.50"), "when": timezone.now().date()}),
+            JSONRenderer().render({"total": Decimal("1.50"), "when": timezone.now().date()}),
+        )
+
+    def test_orjson_parser_and_no_browsable_api(self):
+        """orjson interpreta las peticiones y sin DEBUG no se sirve la API navegable"""
+        client = APIClient()
+        client.credentials(HTTP_X_USER_ID=str(self.user.pk))
+        response = client.post(
+            "/api/shopping-lists/", '{"title": "Ñandú", "budget": "10.00"}',
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data["title"], "Ñandú")
+        response = client.post(
+            "/api/shopping-lists/", '{"title": ', content_type="application/json"
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("JSON parse error", response.data["detail"])
+
+        response = client.get(
+            "/api/products/", HTTP_ACCEPT="text/html,application/xhtml+xml,*/*;q=0.8"
+        )
+        self.assertEqual(response["Content-Type"], "application/json")
+
+
+class IdempotencyKeyTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(
+            first_name="Iris", email="iris@example.com", password="secreto123"
+        )
+        self.client = APIClient()
+        self.client.credentials(HTTP_X_USER_ID=str(self.user.pk))
+        self.shopping_list = ShoppingList.objects.create(user=self.user, title="Mercado")
+        self.product = Product.objects.create(sku="IDEM-1", name="Pan")
+        use_temp_media(self)
+
+    def _create_item(self, key, **data):
+        payload = {"shopping_list": self.shopping_list.pk, "product": self.product.pk, **data}
+        return self.client.post(
+            "/api/shopping-list-items/", payload, format="json", HTTP_IDEMPOTENCY_KEY=key
+        )
+
+    def test_retry_replays_the_stored_response(self):
+        """Un reintento con la misma clave repite la respuesta sin volver a escribir"""
+        first = self._create_item("clave-1", quantity=2)
+        self.assertEqual(first.status_code, 201)
+        # The key's INSERT and locking SELECT, inside the request's savepoint.
+        with self.assertNumQueries(4):
+            retry = self._create_item("clave-1", quantity=2)
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry["Idempotent-Replayed"], "true")
+        self.assertEqual(json.loads(retry.content), first.data)
+        self.assertEqual(ShoppingListItem.objects.count(), 1)
+        self.shopping_list.refresh_from_db()
+        self.assertEqual(self.shopping_list.item_count, 1)
+
+        # Without a key the retry still hits the unique constraint.
+        self.assertEqual(self._create_item(None, quantity=2).status_code, 400)
+
+    def test_key_reused_for_another_request_is_rejected(self):
+        """Reutilizar una clave con otro cuerpo o en otra ruta responde 422"""
+        self.assertEqual(self._create_item("clave-2", quantity=1).status_code, 201)
+        response = self._create_item("clave-2", quantity=5)
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(response.data["detail"].code, "idempotency_key_reused")
+        response = self.client.post(
+            "/api/shopping-lists/", {"title": "Otra"}, format="json",
+            HTTP_IDEMPOTENCY_KEY="clave-2",
+        )
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(ShoppingList.objects.count(), 1)
+        self.assertEqual(self._create_item("", quantity=1).status_code, 400)
+
+    def test_failed_write_keeps_nothing(self):
+        """Una escritura rechazada no guarda la clave y puede reintentarse"""
+        response = self._create_item("clave-3", quantity=0)
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(IdempotencyKey.objects.exists())
+        self.assertEqual(self._create_item("clave-3", quantity=0).status_code, 400)
+
+    def test_bulk_and_upload_retries_replay(self):
+        """Los lotes y las importaciones también se repiten sin reaplicarse"""
+        payload = {"upsert": [
+            {"shopping_list": self.shopping_list.pk, "product": self.product.pk, "quantity": 3}
+        ]}
+        responses = [
+            self.client.post(
+                "/api/shopping-list-items/bulk/", payload, format="json",
+                HTTP_IDEMPOTENCY_KEY="lote-1",
+            )
+            for _ in range(2)
+        ]
+        self.assertEqual(json.loads(responses[1].content), responses[0].data)
+        self.assertEqual(ShoppingListItem.objects.get().quantity, 3)
+
+        def upload(path):
+            csv = b"sku,name\nIDEM-2,Leche\n"
+            return self.client.post(
+                path,
+                {
+                    "kind": "import_products",
+                    "file": SimpleUploadedFile("catalogo.csv", csv, content_type="text/csv"),
+                },
+                HTTP_IDEMPOTENCY_KEY="catalogo-1",
+            )
+
+        first = upload("/api/jobs/")
+        self.assertEqual(first.status_code, 202)
+        retry = upload("/api/jobs/")
+        self.assertEqual(retry["Idempotent-Replayed"], "true")
+        self.assertEqual(json.loads(retry.content), first.data)
+        self.assertEqual(Job.objects.count(), 1)
+
+        # The synchronous import runs outside the key's transaction.
+        with mock.patch("tu_canasta.views.import_products") as import_products:
+            import_products.return_value.as_dict.return_value = {}
+            upload("/api/products/import/")
+            upload("/api/products/import/")
+        self.assertEqual(import_products.call_count, 2)
+
+    def test_anonymous_keys_are_scoped_to_the_client(self):
+        """Sin usuario, la misma clave de dos clientes distintos no choca"""
+        anonymous = APIClient()
+        for index, address in enumerate(("10.0.0.1", "10.0.0.2")):
+            response = anonymous.post(
+                "/api/users/",
+                {"first_name": "Ana", "email": f"ana{index}@example.com", "password": "x"},
+                format="json", HTTP_IDEMPOTENCY_KEY="registro", REMOTE_ADDR=address,
+            )
+            self.assertEqual(response.status_code, 201)
+        self.assertEqual(
+            sorted(IdempotencyKey.objects.filter(key="registro").values_list("scope", flat=True)),
+            ["ip:10.0.0.1", "ip:10.0.0.2"],
+        )
+
+    def test_expired_keys_are_pruned(self):
+        """Las claves vencidas se eliminan y una clave vencida vuelve a ejecutar la escritura"""
+        self.assertEqual(self._create_item("clave-4", quantity=1).status_code, 201)
+        IdempotencyKey.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        ShoppingListItem.objects.all().delete()
+        response = self._create_item("clave-4", quantity=1)
+        self.assertEqual(response.status_code, 201)
+        self.assertNotIn("Idempotent-Replayed", response)
+        self.assertEqual(ShoppingListItem.objects.count(), 1)
+
+        IdempotencyKey.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        IdempotencyKey.objects.create(
+            key="vigente", fingerprint="x", expires_at=timezone.now() + timedelta(hours=1)
+        )
+        out = StringIO()
+        call_command("prune_idempotency_keys", stdout=out)
+        self.assertIn("1 claves eliminadas", out.getvalue())
+        self.assertEqual(list(IdempotencyKey.objects.values_list("key", flat=True)), ["vigente"])
+
+
+@override_settings(THROTTLING={"RATE": 60, "BURST": 10})
+class ThrottlingTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        get_user_resolver().backend.clear()
+        self.user = User.objects.create(
+            first_name="Nora", email="nora@example.com", password="secreto123"
+        )
+        self.other = User.objects.create(
+            first_name="Tomás", email="tomas@example.com", password="secreto123"
+        )
+        self.product = Product.objects.create(sku="TB-1", name="Arroz")
+        ShoppingList.objects.create(user=self.user, title="Semana")
+        self.client = APIClient()
+        self.client.credentials(HTTP_X_USER_ID=str(self.user.pk))
+        self.clock = self.enterContext(mock.patch("tu_canasta.throttling.time"))
+        self.clock.time.return_value = 1000.0
+
+    def test_bucket_charges_each_endpoint_its_cost(self):
+        """Las listas anidadas consumen más fichas que un detalle de producto"""
+        product_url = f"/api/products/{self.product.pk}/"
+        for _ in range(5):
+            self.assertEqual(self.client.get(product_url).status_code, 200)
+        response = self.client.get("/api/shopping-lists/")
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response["Retry-After"], "5")
+        self.assertEqual(self.client.get(product_url).status_code, 200)
+
+        # The same user through ?user_id= shares the bucket; another user has its own.
+        response = APIClient().get("/api/shopping-lists/", {"user_id": self.user.pk})
+        self.assertEqual(response.status_code, 429)
+        other = APIClient()
+        other.credentials(HTTP_X_USER_ID=str(self.other.pk))
+        self.assertEqual(other.get("/api/shopping-lists/").status_code, 200)
+
+        self.clock.time.return_value = 1010.0
+        self.assertEqual(self.client.get("/api/shopping-lists/").status_code, 200)
+
+    def test_concurrent_requests_share_the_bucket(self):
+        """Las peticiones que encuentran el balde bloqueado no esperan, pero pagan sus fichas"""
+        view = ProductViewSet()
+        view.action = "retrieve"
+        start = threading.Barrier(30)
+        results = []
+
+        def take():
+            request = Request(APIRequestFactory().get("/api/products/"))
+            start.wait()
+            results.append(TokenBucketThrottle().allow_request(request, view))
+
+        take_tokens = TokenBucketThrottle._take
+
+        def slow_take(throttle, *args):
+            # A cache round trip between reading the bucket and writing it back.
+            time.sleep(0.005)
+            return take_tokens(throttle, *args)
+
+        threads = [threading.Thread(target=take) for _ in range(30)]
+        with mock.patch.object(TokenBucketThrottle, "_take", slow_take):
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.clock.sleep.assert_not_called()
+        allowed = results.count(True)
+        self.assertGreaterEqual(allowed, 10)
+
+        # Every request let through was charged once: the bucket owes the excess.
+        throttle = TokenBucketThrottle()
+        self.assertFalse(throttle.allow_request(Request(APIRequestFactory().get("/")), view))
+        self.assertEqual(throttle.wait(), allowed - 9)
+
+    @override_settings(WEB_CONCURRENCY=4)
+    def test_several_workers_need_a_shared_cache(self):
+        """Con varios workers, el límite se niega a arrancar sobre una caché local al proceso"""
+        with self.assertRaises(ImproperlyConfigured):
+            check_throttle_cache()
+        with override_settings(THROTTLING={"RATE": 0}):
+            check_throttle_cache()
+        use_shared_cache(self)
+        with override_settings(THROTTLING={"RATE": 60, "BURST": 10, "CACHE": "shared"}):
+            check_throttle_cache()
+
+    async def test_async_views_are_throttled(self):
+        """Las lecturas asíncronas también descuentan fichas del mismo balde"""
+        with override_settings(ASYNC_READ_VIEWS=True):
+            list_view = ShoppingListViewSet.as_view({"get": "list"})
+        request = AsyncRequestFactory().get(
+            "/api/shopping-lists/", headers={"X-USER-ID": str(self.user.pk)}
+        )
+        self.assertEqual((await list_view(request)).status_code, 200)
+        response = await list_view(request)
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response["Retry-After"], "10")
+
+
+@override_settings(LOAD_SHEDDING={"ENABLED": True})
+class LoadSheddingTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(
+            first_name="Rosa", email="rosa@example.com", password="secreto123"
+        )
+        self.product = Product.objects.create(sku="LS-1", name="Sal")
+        self.client = APIClient()
+        self.client.credentials(HTTP_X_USER_ID=str(self.user.pk))
+
+    def test_monitor_averages_query_latency(self):
+        """La latencia media de las consultas se suaviza y caduca sin muestras nuevas"""
+        monitor = DatabaseLatencyMonitor(smoothing=0.5, max_age=5)
+        self.assertIsNone(monitor.latency())
+        for db_seconds, queries in ((0.4, 2), (0.0, 0), (1.2, 2)):
+            metrics = RequestMetrics(float("inf"))
+            metrics.query_count = queries
+            metrics.timings["db"] = db_seconds
+            monitor.observe(metrics)
+        self.assertAlmostEqual(monitor.latency(), 0.4)
+        monitor.updated_at -= 6
+        self.assertIsNone(monitor.latency())
+
+    def test_overload_sheds_expensive_requests(self):
+        """Con la base de datos lenta, las rutas costosas responden 503 con Retry-After"""
+        with mock.patch.object(DatabaseLatencyMonitor, "latency", return_value=1.0):
+            response = self.client.get("/api/shopping-lists/")
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response["Retry-After"], "5")
+            self.assertEqual(self.client.get("/api/analytics/").status_code, 503)
+            self.assertEqual(self.client.get(f"/api/products/{self.product.pk}/").status_code, 200)
+        with mock.patch.object(DatabaseLatencyMonitor, "latency", return_value=0.01):
+            self.assertEqual(self.client.get("/api/shopping-lists/").status_code, 200)
+
+    def test_disabled_by_default(self):
+        """Sin ENABLED no se miden las consultas ni se rechaza nada"""
+        with override_settings(LOAD_SHEDDING={}), mock.patch.object(
+            DatabaseLatencyMonitor, "observe"
+        ) as observe, mock.patch.object(DatabaseLatencyMonitor, "latency", return_value=1.0):
+            client = APIClient()
+            client.credentials(HTTP_X_USER_ID=str(self.user.pk))
+            self.assertEqual(client.get("/api/shopping-lists/").status_code, 200)
+        observe.assert_not_called()
@@ -0,0 +1,172 @@
+"""
+Per-user rate limiting.
+
+``TokenBucketThrottle`` gives each user resolved from X-USER-ID (clients
+without one are keyed by IP) a bucket of ``BURST`` tokens refilled at
+``RATE`` tokens per minute. A request takes as many tokens as its cost.
+Views declare costs in ``throttle_costs``, by action or, on plain API
+views, by method; anything not listed costs 1.
+
+The buckets live in the ``CACHE`` alias. Each take holds a lock on its
+bucket, an ``add`` of a key next to it, so concurrent requests of one user
+cannot both spend the same tokens. A request that finds the bucket locked
+does not wait for it: it goes through and adds its cost to a debt counter
+with ``incr``, which the next take subtracts from the bucket. The alias must
+be shared by every worker (``check_throttle_cache`` refuses local memory with
+several of them) and its ``add`` and ``incr`` should be atomic: Redis's are;
+the file cache's are not, so there the limit is approximate.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.throttling import BaseThrottle
+
+from .shared_cache import is_shared_cache
+from .user_resolver import get_user_resolver
+
+DEFAULTS = {
+    'RATE': 600,
+    'BURST': 200,
+    'CACHE': 'default',
+}
+
+
+def throttle_options() -> dict:
+    return {**DEFAULTS, **getattr(settings, 'THROTTLING', {})}
+
+
+def check_throttle_cache():
+    """Refuse per-process buckets when several workers serve the API."""
+    options = throttle_options()
+    if options['RATE'] and settings.WEB_CONCURRENCY > 1 and not is_shared_cache(options['CACHE']):
+        raise ImproperlyConfigured(
+            'THROTTLING necesita una caché compartida entre procesos (CACHE_BACKEND=redis) '
+            f'con WEB_CONCURRENCY={settings.WEB_CONCURRENCY}; con locmem cada worker tendría '
+            'sus propios baldes.'
+        )
+
+
+def request_cost(view_class, action) -> int:
+    """Tokens taken by ``action`` (or method) of ``view_class``."""
+    return getattr(view_class, 'throttle_costs', {}).get(action, 1)
+
+
+def _view_action(request, view):
+    return getattr(view, 'action', None) or request.method.lower()
+
+
+def _user_identifier(request):
+    return request.headers.get('X-USER-ID') or request.query_params.get('user_id')
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """Token bucket per user; see the module docstring."""
+    cache_format = 'tu_canasta:throttle:{ident}'
+    # A holder that died frees the lock after lock_timeout seconds.
+    lock_timeout = 1
+
+    def __init__(self):
+        options = throttle_options()
+        self.rate = options['RATE'] / 60
+        self.burst = options['BURST']
+        self.cache = caches[options['CACHE']]
+        self.wait_seconds = None
+
+    def allow_request(self, request, view):
+        if not self.rate:
+            return True
+        user = None
+        if _user_identifier(request):
+            try:
+                user = self._user(request)
+            except AuthenticationFailed:
+                pass  # the view rejects it if it needs a user
+        key = self._cache_key(request, user)
+        cost = self._cost(request, view)
+        lock, debt = f'{key}:lock', f'{key}:debt'
+        if not self.cache.add(lock, True, self.lock_timeout):
+            self.cache.add(debt, 0, self._timeout())
+            self.cache.incr(debt, cost)
+            return True
+        try:
+            owed = self.cache.get(debt)
+            if owed:
+                self.cache.decr(debt, owed)
+            state, allowed = self._take(self.cache.get(key), cost, owed or 0)
+            self.cache.set(key, state, self._timeout())
+        finally:
+            self.cache.delete(lock)
+        return allowed
+
+    async def aallow_request(self, request, view):
+        """Same as ``allow_request`` for the async views."""
+        if not self.rate:
+            return True
+        user = None
+        if _user_identifier(request):
+            try:
+                user = await self._auser(request)
+            except AuthenticationFailed:
+                pass
+        key = self._cache_key(request, user)
+        cost = self._cost(request, view)
+        lock, debt = f'{key}:lock', f'{key}:debt'
+        if not await self.cache.aadd(lock, True, self.lock_timeout):
+            await self.cache.aadd(debt, 0, self._timeout())
+            await self.cache.aincr(debt, cost)
+            return True
+        try:
+            owed = await self.cache.aget(debt)
+            if owed:
+                await self.cache.adecr(debt, owed)
+            state, allowed = self._take(await self.cache.aget(key), cost, owed or 0)
+            await self.cache.aset(key, state, self._timeout())
+        finally:
+            await self.cache.adelete(lock)
+        return allowed
+
+    @staticmethod
+    def _user(request):
+        # Shared with RequestUserMixin, so the view does not resolve it again.
+        if not hasattr(request, '_cached_user_object'):
+            request._cached_user_object = get_user_resolver().resolve(_user_identifier(request))
+        return request._cached_user_object
+
+    @staticmethod
+    async def _auser(request):
+        if not hasattr(request, '_cached_user_object'):
+            request._cached_user_object = await get_user_resolver().aresolve(
+                _user_identifier(request)
+            )
+        return request._cached_user_object
+
+    def _cache_key(self, request, user) -> str:
+        ident = f'user:{user.pk}' if user is not None else f'ip:{self.get_ident(request)}'
+        return self.cache_format.format(ident=ident)
+
+    def _timeout(self) -> int:
+        # An untouched bucket is full again after this long.
+        return int(self.burst / self.rate) + 1
+
+    def _cost(self, request, view) -> int:
+        # A request costlier than the whole bucket waits for a full one.
+        return min(request_cost(type(view), _view_action(request, view)), self.burst)
+
+    def _take(self, state, cost, owed):
+        """
+        The bucket after this request, and whether the request fits in it.
+        ``owed`` tokens were spent by requests that found the bucket locked.
+        """
+        now = time.time()
+        tokens, updated_at = state or (self.burst, now)
+        tokens = min(self.burst, tokens + (now - updated_at) * self.rate) - owed
+        if tokens >= cost:
+            return (tokens - cost, now), True
+        self.wait_seconds = (cost - tokens) / self.rate
+        return (tokens, now), False
+
+    def wait(self):
+        return self.wait_seconds
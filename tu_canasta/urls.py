@@ -1,9 +1,13 @@
+from django.urls import path
 from rest_framework.routers import DefaultRouter
 
 from .views import (
+    AnalyticsView,
+    JobViewSet,
     ProductViewSet,
     ShoppingListItemViewSet,
     ShoppingListViewSet,
+    SyncView,
     UserViewSet,
 )
 
@@ -14,5 +18,9 @@ router.register(r'shopping-lists', ShoppingListViewSet, basename='shopping-list'
 router.register(
     r'shopping-list-items', ShoppingListItemViewSet, basename='shopping-list-item'
 )
+router.register(r'jobs', JobViewSet, basename='job')
 
-urlpatterns = router.urls
+urlpatterns = router.urls + [
+    path('sync/', SyncView.as_view(), name='sync'),
+    path('analytics/', AnalyticsView.as_view(), name='analytics'),
+]
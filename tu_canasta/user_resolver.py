@@ -0,0 +1,179 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.db import DEFAULT_DB_ALIAS
+from django.dispatch import receiver
+from rest_framework.exceptions import AuthenticationFailed
+
+from .models import User
+
+DEFAULTS = {
+    'BACKEND': 'lru',
+    'TIMEOUT': 5,
+    'MAX_SIZE': 4096,
+}
+
+
+class LRUUserCache:
+    """
+    Thread-safe in-process LRU with a per-entry TTL.
+
+    User writes only invalidate the process that made them, so other workers
+    keep a deleted user until the entry expires: keep the TTL short.
+    """
+
+    def __init__(self, max_size: int, timeout: int):
+        self.max_size = max_size
+        self.timeout = timeout
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.timeout)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    async def aget(self, key):
+        # In-process and lock-protected only: no I/O to hand off to a thread.
+        return self.get(key)
+
+    async def aset(self, key, value):
+        self.set(key, value)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class DjangoUserCache:
+    """Stores snapshots in a Django cache alias (locmem, file-based, ...)."""
+    key_prefix = 'tu_canasta:user:'
+
+    def __init__(self, alias: str, timeout: int):
+        self.cache = caches[alias]
+        self.timeout = timeout
+
+    def get(self, key):
+        return self.cache.get(f'{self.key_prefix}{key}')
+
+    def set(self, key, value):
+        self.cache.set(f'{self.key_prefix}{key}', value, self.timeout)
+
+    async def aget(self, key):
+        return await self.cache.aget(f'{self.key_prefix}{key}')
+
+    async def aset(self, key, value):
+        await self.cache.aset(f'{self.key_prefix}{key}', value, self.timeout)
+
+    def delete(self, key):
+        self.cache.delete(f'{self.key_prefix}{key}')
+
+    def clear(self):
+        self.cache.clear()
+
+
+class UserResolver:
+    """
+    Resolves the X-USER-ID header into a ``User`` without touching the
+    database on cache hits.
+
+    Only a minimal snapshot ``(id, is_active)`` is cached; the returned
+    instance has every other field deferred, so the password hash and the
+    rest of the row are only loaded if some caller actually reads them.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def resolve(self, identifier) -> User:
+        pk = self._parse(identifier)
+        snapshot = self.backend.get(pk)
+        if snapshot is None:
+            snapshot = self._snapshot(
+                pk, self._users(pk).values_list('is_active', flat=True).first()
+            )
+            self.backend.set(pk, snapshot)
+        return self._user(snapshot)
+
+    async def aresolve(self, identifier) -> User:
+        """Same as ``resolve`` for async views, using the async ORM on a miss."""
+        pk = self._parse(identifier)
+        snapshot = await self.backend.aget(pk)
+        if snapshot is None:
+            snapshot = self._snapshot(
+                pk,
+                await self._users(pk).values_list('is_active', flat=True).afirst(),
+            )
+            await self.backend.aset(pk, snapshot)
+        return self._user(snapshot)
+
+    @staticmethod
+    def _users(pk):
+        # Misses read the primary: a user created a moment ago may not have
+        # reached the read replica yet.
+        return User.objects.using(DEFAULT_DB_ALIAS).filter(pk=pk)
+
+    @staticmethod
+    def _parse(identifier) -> int:
+        try:
+            return int(identifier)
+        except (TypeError, ValueError) as exc:
+            raise AuthenticationFailed('Usuario no encontrado.') from exc
+
+    @staticmethod
+    def _snapshot(pk, is_active):
+        if is_active is None:
+            raise AuthenticationFailed('Usuario no encontrado.')
+        return (pk, is_active)
+
+    @staticmethod
+    def _user(snapshot) -> User:
+        pk, is_active = snapshot
+        return User.from_db(DEFAULT_DB_ALIAS, ['id', 'is_active'], [pk, is_active])
+
+    def invalidate(self, pk) -> None:
+        self.backend.delete(pk)
+
+
+_resolver = None
+
+
+def get_user_resolver() -> UserResolver:
+    global _resolver
+    if _resolver is None:
+        options = {**DEFAULTS, **getattr(settings, 'USER_RESOLVER', {})}
+        if options['BACKEND'] == 'lru':
+            backend = LRUUserCache(options['MAX_SIZE'], options['TIMEOUT'])
+        else:
+            backend = DjangoUserCache(options['BACKEND'], options['TIMEOUT'])
+        _resolver = UserResolver(backend)
+    return _resolver
+
+
+@receiver(setting_changed)
+def _reset_user_resolver(setting, **kwargs):
+    global _resolver
+    if setting in ('USER_RESOLVER', 'CACHES'):
+        _resolver = None
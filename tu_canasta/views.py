@@ -1,20 +1,52 @@
+import io
+
+from asgiref.sync import sync_to_async
+from django.db.models import Prefetch
+from django.http import HttpResponse, StreamingHttpResponse
 from django.urls import reverse as django_reverse
-from rest_framework import viewsets
-from rest_framework.decorators import api_view
-from rest_framework.exceptions import AuthenticationFailed
+from rest_framework import mixins, status, viewsets
+from rest_framework.decorators import action, api_view
+from rest_framework.exceptions import AuthenticationFailed, ValidationError
+from rest_framework.parsers import MultiPartParser
 from rest_framework.response import Response
 from rest_framework.reverse import reverse
+from rest_framework.views import APIView
 
-from .models import Product, ShoppingList, ShoppingListItem, User
+from .accounts import aauthenticate, authenticate
+from .analytics import spending_analytics
+from .async_views import AsyncReadViewSetMixin
+from .bulk import apply_item_batch
+from .catalog import CONTENT_TYPES, detect_format, export_products, import_products, read_rows
+from .caching import PRODUCTS_SCOPE, CachedResponseMixin, user_scope
+from .events import event_options, format_event, format_retry, get_list_broker, stream_events
+from .idempotency import IdempotentWriteMixin
+from .jobs import enqueue
+from .models import Job, Product, ShoppingList, ShoppingListItem, User
+from .pagination import RankedPagination
+from .passwords import ahash_password
+from .renderers import EventStreamRenderer
+from .search import ProductSearch, autocomplete_products
 from .serializers import (
+    DeletedRecordSerializer,
+    JobCreateSerializer,
+    JobSerializer,
+    LoginSerializer,
     ProductSerializer,
+    ShoppingListItemBulkSerializer,
     ShoppingListItemSerializer,
+    ShoppingListDuplicateSerializer,
     ShoppingListSerializer,
+    ShoppingListMarkPurchasedSerializer,
+    ShoppingListSummarySerializer,
+    SparseFieldset,
+    SpendingAnalyticsSerializer,
     UserSerializer,
 )
+from .sync import collect_changes, decode_sync_cursor, encode_sync_cursor
+from .user_resolver import get_user_resolver
 
 
-def _get_request_user(request) -> User:
+def _user_identifier(request) -> str:
     user_identifier = (
         request.headers.get('X-USER-ID') or request.query_params.get('user_id')
     )
@@ -22,10 +54,63 @@ def _get_request_user(request) -> User:
         raise AuthenticationFailed(
             'Proporciona el encabezado X-USER-ID o el parámetro user_id.'
         )
-    try:
-        return User.objects.get(pk=user_identifier)
-    except (ValueError, User.DoesNotExist) as exc:
-        raise AuthenticationFailed('Usuario no encontrado.') from exc
+    return user_identifier
+
+
+def _get_request_user(request) -> User:
+    return get_user_resolver().resolve(_user_identifier(request))
+
+
+def _last_event_id(request):
+    # EventSource resends the last id as a header; ?last_event_id= serves
+    # clients that reconnect by hand.
+    return request.headers.get('Last-Event-ID') or request.query_params.get('last_event_id')
+
+
+def _with_product_detail(queryset, fieldset):
+    """Join the product (and its price stats) when the items embed them."""
+    if fieldset.is_expanded('product_detail.price_stats'):
+        return queryset.select_related('product__price_stats')
+    if fieldset.is_expanded('product_detail'):
+        return queryset.select_related('product')
+    return queryset
+
+
+def _filter_purchased(queryset, request):
+    """Apply ``?is_purchased=true|false``; each value has its own partial index."""
+    is_purchased = request.query_params.get('is_purchased')
+    if is_purchased in ('true', 'false'):
+        return queryset.filter(is_purchased=is_purchased == 'true')
+    return queryset
+
+
+class RequestUserMixin:
+    """
+    Resolves the X-USER-ID user once per request and exposes it to the
+    serializers as ``request_user``.
+    """
+
+    def _get_user(self) -> User:
+        if not hasattr(self.request, '_cached_user_object'):
+            self.request._cached_user_object = _get_request_user(self.request)
+        return self.request._cached_user_object
+
+    async def ainitial(self, request, *args, **kwargs):
+        # Resolved before the async handler runs, so the synchronous
+        # _get_user() calls in get_queryset() never touch the database.
+        await super().ainitial(request, *args, **kwargs)
+        if not hasattr(request, '_cached_user_object'):
+            request._cached_user_object = await get_user_resolver().aresolve(
+                _user_identifier(request)
+            )
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        try:
+            context['request_user'] = self._get_user()
+        except AuthenticationFailed:
+            pass
+        return context
 
 
 @api_view(['GET'])
@@ -43,80 +128,363 @@ def api_root(request, format=None):
             "shopping_list_items": reverse(
                 'shopping-list-item-list', request=request, format=format
             ),
+            "sync": reverse('sync', request=request, format=format),
+            "analytics": reverse('analytics', request=request, format=format),
+            "jobs": reverse('job-list', request=request, format=format),
         }
     )
 
 
-class UserViewSet(viewsets.ModelViewSet):
+class UserViewSet(IdempotentWriteMixin, AsyncReadViewSetMixin, viewsets.ModelViewSet):
     """
     CRUD for application users.
     Passwords are hashed before saving through the serializer.
     """
     queryset = User.objects.all()
     serializer_class = UserSerializer
+    # Under ASGI, await the hashing pool instead of holding the sync thread.
+    async_actions = ('create', 'login')
+    # Password hashing is deliberately slow.
+    throttle_costs = {'create': 5, 'login': 5}
 
+    async def acreate(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        # The unique email check queries the database.
+        await sync_to_async(serializer.is_valid)(raise_exception=True)
+        data = dict(serializer.validated_data)
+        data['password'] = await ahash_password(data['password'])
+        serializer.instance = await User.objects.acreate(**data)
+        headers = self.get_success_headers(serializer.data)
+        return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
 
-class ProductViewSet(viewsets.ModelViewSet):
+    @action(detail=False, methods=['post'], serializer_class=LoginSerializer)
+    def login(self, request):
+        """
+        Check an email and password and return the user. Hashes made with an
+        older hasher or weaker parameters are upgraded on success.
+        """
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        user = authenticate(
+            serializer.validated_data['email'], serializer.validated_data['password']
+        )
+        return self._login_response(user)
+
+    async def alogin(self, request):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        user = await aauthenticate(
+            serializer.validated_data['email'], serializer.validated_data['password']
+        )
+        return self._login_response(user)
+
+    def _login_response(self, user):
+        if user is None:
+            raise ValidationError({'non_field_errors': ['Credenciales inválidas.']})
+        return Response(UserSerializer(user, context=self.get_serializer_context()).data)
+
+
+class ProductViewSet(
+    IdempotentWriteMixin, CachedResponseMixin, AsyncReadViewSetMixin, viewsets.ModelViewSet
+):
     """
     Basic CRUD for products available in the inventory.
     """
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
+    throttle_costs = {'list': 2, 'import_catalog': 20, 'export': 20}
+    autocomplete_limit = 10
+    max_autocomplete_limit = 20
+
+    def get_cache_scopes(self):
+        return [PRODUCTS_SCOPE]
+
+    def perform_create(self, serializer):
+        product = serializer.save()
+        # A new product has no price history; spare the response a lookup.
+        Product.price_stats.related.set_cached_value(product, None)
+
+    def _search_term(self) -> str:
+        if self.action != 'list':
+            return ''
+        return self.request.query_params.get('search', '').strip()
+
+    def supports_async(self, request):
+        # Ranked search runs raw FTS queries through the synchronous cursor.
+        return super().supports_async(request) and not self._search_term()
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if SparseFieldset(self.request).is_expanded('price_stats'):
+            queryset = queryset.select_related('price_stats')
+        term = self._search_term()
+        if term:
+            return ProductSearch(term, queryset)
+        return queryset
+
+    @property
+    def paginator(self):
+        if self._search_term():
+            # Ranked results are paged by number, not by keyset.
+            self.pagination_class = RankedPagination
+        return super().paginator
 
+    @action(detail=False, methods=['get'])
+    def autocomplete(self, request):
+        """
+        Typeahead suggestions for ``?q=``: at most ``limit`` products whose
+        name or SKU words start with the typed text.
+        """
+        return self._cached_response(self._autocomplete, request)
 
-class ShoppingListViewSet(viewsets.ModelViewSet):
+    def _autocomplete(self, request):
+        try:
+            limit = int(request.query_params.get('limit', self.autocomplete_limit))
+        except ValueError:
+            limit = self.autocomplete_limit
+        limit = max(1, min(limit, self.max_autocomplete_limit))
+        rows = autocomplete_products(request.query_params.get('q', ''), limit)
+        return Response([{'id': pk, 'sku': sku, 'name': name} for pk, sku, name in rows])
+
+    @action(
+        detail=False,
+        methods=['post'],
+        url_path='import',
+        parser_classes=[MultiPartParser],
+    )
+    def import_catalog(self, request):
+        """
+        Upsert products by SKU from an uploaded CSV or NDJSON ``file``. The
+        file is read line by line; invalid rows are reported, not fatal.
+        Ignores ``Idempotency-Key``: holding the key's transaction open for a
+        whole file would lock the catalogue. Re-running an import is safe, and
+        the job queue's import honours the key.
+        """
+        upload = request.FILES.get('file')
+        if upload is None:
+            raise ValidationError({'file': ['Adjunta un archivo CSV o NDJSON.']})
+        try:
+            file_format = detect_format(
+                upload.name, request.query_params.get('file_format')
+            )
+        except ValueError as exc:
+            raise ValidationError({'file_format': [str(exc)]})
+        stream = io.TextIOWrapper(upload.file, encoding='utf-8-sig', newline='')
+        report = import_products(read_rows(stream, file_format))
+        return Response(report.as_dict())
+
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """Stream the whole catalogue as ``?file_format=csv`` or ``ndjson``."""
+        try:
+            file_format = detect_format('', request.query_params.get('file_format', 'csv'))
+        except ValueError as exc:
+            raise ValidationError({'file_format': [str(exc)]})
+        response = StreamingHttpResponse(
+            export_products(file_format), content_type=CONTENT_TYPES[file_format]
+        )
+        response['Content-Disposition'] = f'attachment; filename="productos.{file_format}"'
+        return response
+
+
+class ShoppingListViewSet(
+    IdempotentWriteMixin,
+    RequestUserMixin,
+    CachedResponseMixin,
+    AsyncReadViewSetMixin,
+    viewsets.ModelViewSet,
+):
     """
     Allows each user to mantener múltiples listas de compras planificadas por fecha.
     Acceso restringido vía el encabezado X-USER-ID o el parámetro user_id.
     """
     serializer_class = ShoppingListSerializer
+    async_actions = ('list', 'retrieve', 'events')
+    idempotent_actions = ('create', 'duplicate', 'mark_purchased', 'reset', 'clear_purchased')
+    # Lists embed every item unpaginated.
+    throttle_costs = {
+        'list': 10, 'retrieve': 5, 'duplicate': 5, 'mark_purchased': 2, 'list_items': 2
+    }
 
     def get_queryset(self):
         user = self._get_user()
-        return (
-            ShoppingList.objects.filter(user=user)
-            .prefetch_related('items__product')
-            .order_by('-target_date', '-updated_at')
+        queryset = ShoppingList.objects.filter(user=user).order_by(
+            '-target_date', '-updated_at'
         )
+        is_template = self.request.query_params.get('is_template')
+        if self.action == 'list' and is_template in ('true', 'false'):
+            queryset = queryset.filter(is_template=is_template == 'true')
+        if self.action in (
+            'list_items', 'duplicate', 'mark_purchased', 'reset', 'clear_purchased', 'events'
+        ):
+            return queryset
+        return self._with_items(queryset)
 
-    def _get_user(self) -> User:
-        if not hasattr(self.request, '_cached_user_object'):
-            self.request._cached_user_object = _get_request_user(self.request)
-        return self.request._cached_user_object
+    def _with_items(self, queryset):
+        fieldset = SparseFieldset(self.request)
+        if not fieldset.is_expanded('items'):
+            return queryset
+        if fieldset.is_expanded('items.product_detail.price_stats'):
+            return queryset.prefetch_related(
+                Prefetch('items__product', Product.objects.select_related('price_stats'))
+            )
+        if fieldset.is_expanded('items.product_detail'):
+            return queryset.prefetch_related('items__product')
+        return queryset.prefetch_related('items')
+
+    def supports_async(self, request) -> bool:
+        if self.action == 'events':
+            return True
+        return super().supports_async(request)
+
+    def get_cache_scopes(self):
+        # Lists embed product_detail, so product edits also invalidate them.
+        return [user_scope(self._get_user().pk), PRODUCTS_SCOPE]
 
     def perform_create(self, serializer):
         user = self._get_user()
         serializer.save(user=user)
 
-    def get_serializer_context(self):
-        context = super().get_serializer_context()
-        if hasattr(self.request, '_cached_user_object'):
-            context['request_user'] = self.request._cached_user_object
-        else:
-            try:
-                context['request_user'] = self._get_user()
-            except AuthenticationFailed:
-                pass
-        return context
+    def update(self, request, *args, **kwargs):
+        partial = kwargs.pop('partial', False)
+        instance = self.get_object()
+        serializer = self.get_serializer(instance, data=request.data, partial=partial)
+        serializer.is_valid(raise_exception=True)
+        self.perform_update(serializer)
+        # Items are read-only here, so the ones prefetched by get_object() are
+        # still current. UpdateModelMixin would discard them and reload each
+        # item and product with its own query.
+        return Response(serializer.data)
+
+    @action(detail=True, methods=['post'], serializer_class=ShoppingListDuplicateSerializer)
+    def duplicate(self, request, pk=None):
+        """
+        Copy a list, or save it as a template with ``is_template``. Items are
+        copied in bulk; ``reset_purchased`` (default) clears their purchase
+        flag and ``refresh_prices`` uses each product's last paid price.
+        """
+        source = self.get_object()
+        options = self.get_serializer(data=request.data)
+        options.is_valid(raise_exception=True)
+        copy = source.duplicate(**options.validated_data)
+        copy = self._with_items(ShoppingList.objects.filter(pk=copy.pk)).get()
+        serializer = ShoppingListSerializer(copy, context=self.get_serializer_context())
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    def _list_items_changed(self, shopping_list, rows):
+        # The write recomputed the stored totals.
+        shopping_list.refresh_from_db()
+        serializer = ShoppingListSummarySerializer(
+            shopping_list, context=self.get_serializer_context()
+        )
+        return Response({'affected_items': rows, 'list': serializer.data})
+
+    def _owned_items(self):
+        # get_object() answers 404 for a malformed or foreign id before writing.
+        shopping_list = self.get_object()
+        return shopping_list, ShoppingListItem.objects.filter(shopping_list=shopping_list)
+
+    @action(
+        detail=True,
+        methods=['post'],
+        url_path='mark-purchased',
+        serializer_class=ShoppingListMarkPurchasedSerializer,
+    )
+    def mark_purchased(self, request, pk=None):
+        """
+        Check out the list, or only the items in ``ids``, with one UPDATE.
+        Returns how many items changed and the refreshed list totals.
+        """
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        shopping_list, items = self._owned_items()
+        if 'ids' in serializer.validated_data:
+            items = items.filter(pk__in=serializer.validated_data['ids'])
+        return self._list_items_changed(shopping_list, items.set_purchased(True))
+
+    @action(detail=True, methods=['post'])
+    def reset(self, request, pk=None):
+        """Mark every item of the list as pending again with one UPDATE."""
+        shopping_list, items = self._owned_items()
+        return self._list_items_changed(shopping_list, items.set_purchased(False))
+
+    @action(detail=True, methods=['post'], url_path='clear-purchased')
+    def clear_purchased(self, request, pk=None):
+        """Delete the purchased items of the list with one DELETE."""
+        shopping_list, items = self._owned_items()
+        rows, _ = items.filter(is_purchased=True).delete()
+        return self._list_items_changed(shopping_list, rows)
+
+    @action(detail=True, methods=['get'], renderer_classes=[EventStreamRenderer])
+    def events(self, request, pk=None):
+        """
+        Without an event loop (WSGI) the stream cannot stay open: answer with
+        the events missed since ``Last-Event-ID`` and let EventSource
+        reconnect after the ``retry`` delay.
+        """
+        shopping_list = self.get_object()
+        events = get_list_broker().replay(shopping_list.pk, _last_event_id(request))
+        body = format_retry(event_options()['RETRY_MS']) + b''.join(map(format_event, events))
+        return HttpResponse(body, content_type='text/event-stream')
+
+    async def aevents(self, request, pk=None):
+        """
+        Server-Sent Events of the list's items: the events missed since
+        ``Last-Event-ID`` (or ``?last_event_id=``), then live item diffs.
+        """
+        shopping_list = await self.aget_object()
+        options = event_options()
+        broker = get_list_broker()
+        subscription = broker.subscribe(shopping_list.pk, _last_event_id(request))
+        response = StreamingHttpResponse(
+            stream_events(
+                broker, subscription, options['KEEPALIVE_SECONDS'], options['RETRY_MS']
+            ),
+            content_type='text/event-stream',
+        )
+        response['Cache-Control'] = 'no-cache'
+        # Tell nginx-style proxies not to buffer the stream.
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+    @action(
+        detail=True,
+        methods=['get'],
+        url_path='items',
+        serializer_class=ShoppingListItemSerializer,
+    )
+    def list_items(self, request, pk=None):
+        """
+        Items of one list, paginated on their own so clients can fetch a
+        lightweight list and stream its items separately.
+        """
+        shopping_list = self.get_object()
+        queryset = ShoppingListItem.objects.filter(shopping_list=shopping_list)
+        queryset = _filter_purchased(queryset, request)
+        queryset = _with_product_detail(queryset, SparseFieldset(request))
+        page = self.paginate_queryset(queryset)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
 
 
-class ShoppingListItemViewSet(viewsets.ModelViewSet):
+class ShoppingListItemViewSet(
+    IdempotentWriteMixin, RequestUserMixin, AsyncReadViewSetMixin, viewsets.ModelViewSet
+):
     """
     CRUD de los productos dentro de las listas de compras del usuario autenticado.
     """
     serializer_class = ShoppingListItemSerializer
+    idempotent_actions = ('create', 'bulk')
+    throttle_costs = {'list': 2, 'bulk': 5}
 
     def get_queryset(self):
         user = self._get_user()
-        return (
-            ShoppingListItem.objects.filter(shopping_list__user=user)
-            .select_related('product', 'shopping_list__user')
-        )
-
-    def _get_user(self) -> User:
-        if not hasattr(self.request, '_cached_user_object'):
-            self.request._cached_user_object = _get_request_user(self.request)
-        return self.request._cached_user_object
+        queryset = ShoppingListItem.objects.filter(
+            shopping_list__user=user
+        ).select_related('shopping_list')
+        if self.action == 'list':
+            queryset = _filter_purchased(queryset, self.request)
+        return _with_product_detail(queryset, SparseFieldset(self.request))
 
     def perform_create(self, serializer):
         self._get_user()
@@ -134,13 +502,115 @@ class ShoppingListItemViewSet(viewsets.ModelViewSet):
             raise AuthenticationFailed('No puedes eliminar listas de otros usuarios.')
         instance.delete()
 
-    def get_serializer_context(self):
-        context = super().get_serializer_context()
-        if hasattr(self.request, '_cached_user_object'):
-            context['request_user'] = self.request._cached_user_object
-        else:
-            try:
-                context['request_user'] = self._get_user()
-            except AuthenticationFailed:
-                pass
-        return context
+    @action(detail=False, methods=['post'], serializer_class=ShoppingListItemBulkSerializer)
+    def bulk(self, request):
+        """
+        Upsert, toggle and delete many items in one request. Each row gets its
+        own result so a single invalid row does not reject the batch.
+        """
+        user = self._get_user()
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return Response(apply_item_batch(user, **serializer.validated_data))
+
+
+class JobViewSet(
+    IdempotentWriteMixin,
+    RequestUserMixin,
+    mixins.CreateModelMixin,
+    mixins.ListModelMixin,
+    mixins.RetrieveModelMixin,
+    viewsets.GenericViewSet,
+):
+    """
+    Background jobs of the user. POST enqueues one and answers 202 right away;
+    ``manage.py run_worker`` runs it, and its ``status``, ``progress`` and
+    ``result`` are polled on the detail URL.
+    """
+    serializer_class = JobSerializer
+    throttle_costs = {'create': 5}
+
+    def get_queryset(self):
+        return Job.objects.filter(user=self._get_user())
+
+    def get_serializer_class(self):
+        if self.action == 'create':
+            return JobCreateSerializer
+        return JobSerializer
+
+    def create(self, request, *args, **kwargs):
+        user = self._get_user()
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        job = enqueue(user=user, **serializer.validated_data)
+        location = reverse('job-detail', args=[job.pk], request=request)
+        return Response(
+            JobSerializer(job, context=self.get_serializer_context()).data,
+            status=status.HTTP_202_ACCEPTED,
+            headers={'Location': location},
+        )
+
+
+class SyncView(RequestUserMixin, APIView):
+    """
+    Delta sync for offline clients: lists, items and deletion tombstones that
+    changed after ``?since=`` (a previous ``cursor`` or an ISO timestamp).
+    Keep calling with the returned cursor while ``has_more`` is true.
+    """
+    page_size = 500
+    max_page_size = 2000
+    throttle_costs = {'get': 5}
+
+    def get(self, request, format=None):
+        user = self._get_user()
+        positions = decode_sync_cursor(request.query_params.get('since'))
+        try:
+            limit = min(int(request.query_params.get('limit', self.page_size)), self.max_page_size)
+        except ValueError:
+            limit = self.page_size
+        changes, has_more, next_positions = collect_changes(user, positions, max(limit, 1))
+        context = {'request': request, 'request_user': user}
+        return Response(
+            {
+                'lists': ShoppingListSummarySerializer(
+                    changes['lists'], many=True, context=context
+                ).data,
+                'items': ShoppingListItemSerializer(
+                    changes['items'], many=True, context=context
+                ).data,
+                'deleted': DeletedRecordSerializer(changes['deleted'], many=True).data,
+                'cursor': encode_sync_cursor(next_positions) if next_positions else None,
+                'has_more': has_more,
+            }
+        )
+
+
+class AnalyticsView(RequestUserMixin, CachedResponseMixin, APIView):
+    """
+    Spending per month, budget adherence and most bought products of the
+    user's lists, aggregated in the database. ``?year=`` limits the lists by
+    ``target_date`` and ``?products=`` sets how many products are returned.
+    """
+    default_products = 10
+    max_products = 50
+    throttle_costs = {'get': 10}
+
+    def get_cache_scopes(self):
+        return [user_scope(self._get_user().pk), PRODUCTS_SCOPE]
+
+    def get(self, request, format=None):
+        return self._cached_response(self._analytics, request)
+
+    def _analytics(self, request):
+        params = request.query_params
+        try:
+            year = int(params['year']) if params.get('year') else None
+        except ValueError:
+            raise ValidationError({'year': 'Año inválido.'})
+        try:
+            products = int(params.get('products', self.default_products))
+        except ValueError:
+            raise ValidationError({'products': 'Debe ser un número entero.'})
+        products = min(max(products, 0), self.max_products)
+        data = spending_analytics(self._get_user(), year=year, products=products)
+        return Response(SpendingAnalyticsSerializer(data).data)
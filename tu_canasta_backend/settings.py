@@ -15,6 +15,7 @@ import os
 from pathlib import Path
 
 import dj_database_url
+from django.core.exceptions import ImproperlyConfigured
 from dotenv import load_dotenv
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -61,7 +62,10 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware',
+    'tu_canasta.middleware.AsyncWhiteNoiseMiddleware',
+    'tu_canasta.middleware.RequestMetricsMiddleware',
+    'tu_canasta.middleware.LoadSheddingMiddleware',
+    'tu_canasta.middleware.ReplicaRoutingMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -95,15 +99,213 @@ WSGI_APPLICATION = 'tu_canasta_backend.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+# DATABASE_POOL enables psycopg 3's connection pool on PostgreSQL: each
+# worker process keeps between MIN_SIZE and MAX_SIZE connections that its
+# threads share, instead of one persistent connection per thread.
+DATABASE_POOL = os.getenv('DATABASE_POOL', 'False').lower() == 'true'
+
+
+def _database(url):
+    config = dj_database_url.parse(url, conn_max_age=600, conn_health_checks=True)
+    if DATABASE_POOL and config['ENGINE'] == 'django.db.backends.postgresql':
+        # Pooled connections go back to the pool after each request.
+        config['CONN_MAX_AGE'] = 0
+        config.setdefault('OPTIONS', {})['pool'] = {
+            'min_size': int(os.getenv('DATABASE_POOL_MIN_SIZE', '2')),
+            'max_size': int(os.getenv('DATABASE_POOL_MAX_SIZE', '10')),
+            'timeout': float(os.getenv('DATABASE_POOL_TIMEOUT', '10')),
+        }
+    return config
+
+
+DATABASE_URL = os.getenv('DATABASE_URL', f'sqlite:///{BASE_DIR / "db.sqlite3"}')
 DATABASES = {
-    'default': dj_database_url.config(
-        default=os.getenv('DATABASE_URL', f'sqlite:///{BASE_DIR / "db.sqlite3"}'),
-        conn_max_age=600,
-        conn_health_checks=True,
-    )
+    'default': _database(DATABASE_URL),
+}
+
+# Optional read replica for the GET requests of the API (tu_canasta.routers).
+# Without DATABASE_REPLICA_URL the alias points at the default database and
+# routing stays off; tests run it as a mirror of the default database and
+# enable routing through REPLICA_ROUTING.
+DATABASE_REPLICA_URL = os.getenv('DATABASE_REPLICA_URL')
+DATABASES['replica'] = {
+    **_database(DATABASE_REPLICA_URL or DATABASE_URL),
+    'TEST': {'MIRROR': 'default'},
+}
+
+DATABASE_ROUTERS = ['tu_canasta.routers.PrimaryReplicaRouter']
+
+# After a write, the same X-USER-ID reads from the primary for STICKY_SECONDS.
+# The pins live in CACHE, which must be shared between workers
+# (CACHE_BACKEND=file or redis); with locmem the middleware refuses to start.
+REPLICA_ROUTING = {
+    'ALIAS': 'replica' if DATABASE_REPLICA_URL else None,
+    'STICKY_SECONDS': int(os.getenv('DATABASE_REPLICA_STICKY_SECONDS', '5')),
+    'CACHE': 'default',
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# Local memory is per process. CACHE_BACKEND=file shares entries between
+# gunicorn workers on the same host, and redis (CACHE_LOCATION=redis://...)
+# between hosts.
+
+CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'locmem')
+
+if CACHE_BACKEND == 'redis':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('CACHE_LOCATION', 'redis://127.0.0.1:6379/0'),
+        }
+    }
+elif CACHE_BACKEND == 'file':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.getenv('CACHE_LOCATION', str(BASE_DIR / '.cache')),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'tu-canasta',
+        }
+    }
+
+# Cached list/retrieve responses (tu_canasta.caching). Their invalidation only
+# reaches the processes that share the cache, so they are off with locmem.
+RESPONSE_CACHE = {
+    'ENABLED': os.getenv(
+        'RESPONSE_CACHE_ENABLED', str(CACHE_BACKEND != 'locmem')
+    ).lower() == 'true',
+}
+
+# X-USER-ID resolution: 'lru' keeps snapshots in-process, any other value is
+# the name of a CACHES alias. User writes only invalidate the LRU of their own
+# process, so it gets a short TTL and the shared cache is used when there is one.
+USER_RESOLVER_BACKEND = os.getenv(
+    'USER_RESOLVER_BACKEND', 'lru' if CACHE_BACKEND == 'locmem' else 'default'
+)
+USER_RESOLVER = {
+    'BACKEND': USER_RESOLVER_BACKEND,
+    'TIMEOUT': int(os.getenv(
+        'USER_RESOLVER_TIMEOUT', '5' if USER_RESOLVER_BACKEND == 'lru' else '300'
+    )),
+    'MAX_SIZE': int(os.getenv('USER_RESOLVER_MAX_SIZE', '4096')),
+}
+
+# Async list/retrieve views; enabled by asgi.py, off under WSGI.
+ASYNC_READ_VIEWS = os.getenv('ASYNC_READ_VIEWS', 'False').lower() == 'true'
+
+# Per-request query/DB/serializer/render timings (Server-Timing header and
+# JSON log lines). Disabled by default; SAMPLE_RATE is a fraction of requests.
+REQUEST_METRICS = {
+    'ENABLED': os.getenv('REQUEST_METRICS_ENABLED', 'False').lower() == 'true',
+    'SAMPLE_RATE': float(os.getenv('REQUEST_METRICS_SAMPLE_RATE', '1.0')),
+    'SLOW_QUERY_MS': int(os.getenv('REQUEST_METRICS_SLOW_QUERY_MS', '100')),
+    'SLOW_REQUEST_MS': int(os.getenv('REQUEST_METRICS_SLOW_REQUEST_MS', '500')),
+}
+
+# Per-user token buckets (tu_canasta.throttling): BURST tokens refilled at
+# RATE per minute; views weigh their expensive actions with throttle_costs.
+# CACHE must be shared by every worker and lock atomically: use redis.
+THROTTLING = {
+    'RATE': int(os.getenv('THROTTLE_RATE', '600')),
+    'BURST': int(os.getenv('THROTTLE_BURST', '200')),
+    'CACHE': os.getenv('THROTTLE_CACHE', 'default'),
+}
+
+# gunicorn's worker count (it reads the same variable). With more than one,
+# startup refuses a throttle CACHE local to each process.
+WEB_CONCURRENCY = int(os.getenv('WEB_CONCURRENCY', '1'))
+
+# Overload mode: 503 + Retry-After for requests costing MIN_COST tokens or
+# more while the average query latency is above DB_LATENCY_MS. Off unless
+# enabled: it times the queries of every sampled request.
+LOAD_SHEDDING = {
+    'ENABLED': os.getenv('LOAD_SHEDDING_ENABLED', 'False').lower() == 'true',
+    'SAMPLE_RATE': float(os.getenv('LOAD_SHEDDING_SAMPLE_RATE', '1.0')),
+    'DB_LATENCY_MS': int(os.getenv('LOAD_SHEDDING_DB_LATENCY_MS', '250')),
+    'MIN_COST': int(os.getenv('LOAD_SHEDDING_MIN_COST', '5')),
+    'RETRY_AFTER': int(os.getenv('LOAD_SHEDDING_RETRY_AFTER', '5')),
+}
+
+# Database-backed job queue run by `manage.py run_worker` (tu_canasta.jobs).
+JOB_QUEUE = {
+    'POLL_INTERVAL': float(os.getenv('JOB_POLL_INTERVAL', '1.0')),
+    'RETRY_DELAY': int(os.getenv('JOB_RETRY_DELAY', '10')),
+    'MAX_RETRY_DELAY': int(os.getenv('JOB_MAX_RETRY_DELAY', '600')),
+    'HEARTBEAT_TIMEOUT': int(os.getenv('JOB_HEARTBEAT_TIMEOUT', '300')),
+}
+
+# Responses stored for writes retried with Idempotency-Key (tu_canasta.idempotency).
+IDEMPOTENCY = {
+    'TTL_SECONDS': int(os.getenv('IDEMPOTENCY_TTL_SECONDS', '86400')),
+}
+
+# Delta sync (tu_canasta.sync): completed syncs resend the last OVERLAP_SECONDS
+# so rows from transactions that commit late are not skipped; deletion
+# tombstones are kept TOMBSTONE_RETENTION_DAYS (manage.py prune_deleted_records).
+SYNC = {
+    'OVERLAP_SECONDS': int(os.getenv('SYNC_OVERLAP_SECONDS', '60')),
+    'TOMBSTONE_RETENTION_DAYS': int(os.getenv('SYNC_TOMBSTONE_RETENTION_DAYS', '90')),
+}
+
+# Server-Sent Events of shared lists (tu_canasta.events). The default broker
+# fans out within one process and only suits a single web process; see the
+# README before running several workers.
+LIST_EVENTS = {
+    'BROKER': os.getenv('LIST_EVENTS_BROKER', 'tu_canasta.events.InProcessBroker'),
+    'HISTORY': int(os.getenv('LIST_EVENTS_HISTORY', '200')),
+    'KEEPALIVE_SECONDS': int(os.getenv('LIST_EVENTS_KEEPALIVE_SECONDS', '15')),
+    'RETRY_MS': int(os.getenv('LIST_EVENTS_RETRY_MS', '3000')),
+    'WATCH_SECONDS': int(os.getenv('LIST_EVENTS_WATCH_SECONDS', '60')),
+}
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'tu_canasta.performance': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+    },
+}
+
+
+# Password hashing. PASSWORD_HASHER picks the profile; every profile keeps
+# the other hashers so existing hashes verify and are upgraded on login.
+# https://docs.djangoproject.com/en/5.2/topics/auth/passwords/
+
+_ARGON2 = 'tu_canasta.hashers.TunedArgon2PasswordHasher'
+_SCRYPT = 'tu_canasta.hashers.TunedScryptPasswordHasher'
+_PBKDF2 = 'django.contrib.auth.hashers.PBKDF2PasswordHasher'
+_PBKDF2_SHA1 = 'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher'
+PASSWORD_HASHER_PROFILES = {
+    'argon2': [_ARGON2, _SCRYPT, _PBKDF2, _PBKDF2_SHA1],
+    'scrypt': [_SCRYPT, _ARGON2, _PBKDF2, _PBKDF2_SHA1],
+    'pbkdf2': [_PBKDF2, _ARGON2, _SCRYPT, _PBKDF2_SHA1],
+}
+PASSWORD_HASHER = os.getenv('PASSWORD_HASHER', 'argon2')
+if PASSWORD_HASHER not in PASSWORD_HASHER_PROFILES:
+    raise ImproperlyConfigured(
+        f'PASSWORD_HASHER={PASSWORD_HASHER!r} no es válido; usa uno de: '
+        f"{', '.join(PASSWORD_HASHER_PROFILES)}."
+    )
+PASSWORD_HASHERS = PASSWORD_HASHER_PROFILES[PASSWORD_HASHER]
+# Async signups and logins hash in a pool of this many threads, bounding the
+# CPU a burst of them can take from other requests.
+PASSWORD_HASHING_WORKERS = int(os.getenv('PASSWORD_HASHING_WORKERS', os.cpu_count() or 1))
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -140,6 +342,11 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 STATIC_ROOT = BASE_DIR / 'staticfiles'
+
+# Uploads of queued imports (Job.upload) wait here until run_worker reads
+# them: the web and worker processes must share this directory, or point the
+# default storage of STORAGES at a shared backend.
+MEDIA_ROOT = os.getenv('MEDIA_ROOT', str(BASE_DIR / 'media'))
 STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 
 
@@ -149,13 +356,27 @@ STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 # Django REST Framework
+# Read-only fast path of the model serializers (tu_canasta.serializers).
+FAST_READ_SERIALIZERS = os.getenv('FAST_READ_SERIALIZERS', 'True').lower() == 'true'
+
 REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.AllowAny',
     ],
+    'DEFAULT_THROTTLE_CLASSES': [
+        'tu_canasta.throttling.TokenBucketThrottle',
+    ],
+    # orjson when installed (tu_canasta.renderers); the browsable API only in DEBUG.
     'DEFAULT_RENDERER_CLASSES': [
-        'rest_framework.renderers.JSONRenderer',
-        'rest_framework.renderers.BrowsableAPIRenderer',
+        'tu_canasta.renderers.ORJSONRenderer',
+        *(['rest_framework.renderers.BrowsableAPIRenderer'] if DEBUG else []),
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'tu_canasta.renderers.ORJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
     ],
+    'DEFAULT_PAGINATION_CLASS': 'tu_canasta.pagination.KeysetCursorPagination',
+    'PAGE_SIZE': 50,
 }
 